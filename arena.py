@@ -0,0 +1,353 @@
+import argparse
+import http.client
+import json
+import math
+import random
+import time
+import urllib.request
+from collections import deque
+from multiprocessing import Pool
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import game_cache
+import metrics
+import position_cache
+import server_logic
+from game_state import FULL_HEALTH, MOVES, GameState
+from policies import random_policy
+"""
+Headless self-play arena: plays many local games between versions of our snake
+and reports who wins and what it costs.
+
+A player is either a version of server_logic.choose_move in this process
+(an engine plus an opponent policy) or a snake server reached over HTTP. Games
+run in parallel over a process pool, and the report has win rates with 95%
+confidence intervals, mean and p99 move latency and search nodes per second.
+
+    python arena.py --games 200 --workers 4 lookahead mcts lookahead:greedy
+    python arena.py lookahead http://localhost:8080
+
+self_play() is the plain loop of choose_move against itself that book_builder.py
+and train_eval.py collect their positions from.
+"""
+
+SIZE = 11
+MAX_TURNS = 500
+TIMEOUT_MS = 500
+MINIMUM_FOOD = 1
+FOOD_SPAWN_CHANCE = 0.15
+START_LENGTH = 3
+Z_95 = 1.96
+
+
+class Player:
+    """
+    "engine[:opponent_policy]" plays choose_move in process, e.g. "mcts" or
+    "lookahead:greedy". Anything starting with http is a server URL.
+    """
+
+    def __init__(self, spec: str):
+        self.spec = spec
+        self.url = spec.rstrip("/") if spec.startswith("http") else None
+        engine, _, policy = spec.partition(":")
+        self.engine = None if self.url else engine
+        self.opponent_policy = None if self.url else (policy or None)
+
+    def post(self, path: str, data: dict) -> Optional[dict]:
+        """The server's answer, None when it timed out, failed or made no sense"""
+        request = urllib.request.Request(self.url + path, data=json.dumps(data).encode(),
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=data['game']['timeout'] / 1000 * 2) as response:
+                body = response.read()
+            return json.loads(body) if path == "/move" else None
+        except (OSError, http.client.HTTPException, ValueError):
+            return None
+
+    def start(self, data: dict) -> None:
+        if self.url:
+            self.post("/start", data)
+        else:
+            game_cache.games.start(data)
+
+    def move(self, data: dict) -> Optional[str]:
+        """None when a server player missed its turn"""
+        if self.url:
+            answer = self.post("/move", data)
+            move = answer.get('move') if isinstance(answer, dict) else None
+            return move if move in MOVES else None
+        move, _ = server_logic.choose_move(data, self.engine, self.opponent_policy)
+        return move
+
+    def end(self, data: dict) -> None:
+        if self.url:
+            self.post("/end", data)
+        else:
+            game_cache.games.end(data)
+
+
+def start_positions(size: int) -> List[Tuple[int, int]]:
+    low, middle, high = 1, size // 2, size - 2
+    return [(low, low), (high, high), (low, high), (high, low),
+            (low, middle), (high, middle), (middle, low), (middle, high)]
+
+
+def new_game(players: int, size: int, rng: random.Random) -> GameState:
+    state = GameState(size, size)
+    positions = start_positions(size)[:players]
+    rng.shuffle(positions)
+    for index, (x, y) in enumerate(positions):
+        cell = state.cell({'x': x, 'y': y})
+        state.bodies.append(deque([cell] * START_LENGTH))
+        state.occupied[cell] += START_LENGTH
+        state.ids.append(f"snake-{index}")
+        state.health.append(FULL_HEALTH)
+        state.alive.append(True)
+        # Food one step diagonally away from every snake, towards the center
+        food_x = x + (1 if x < size // 2 else -1)
+        food_y = y + (1 if y < size // 2 else -1)
+        state.food.add(state.cell({'x': food_x, 'y': food_y}))
+    state.food.add(state.cell({'x': size // 2, 'y': size // 2}))
+    state.rehash()
+    return state
+
+
+def spawn_food(state: GameState, rng: random.Random) -> None:
+    if len(state.food) >= MINIMUM_FOOD and rng.random() >= FOOD_SPAWN_CHANCE:
+        return
+    empty = [cell for cell, count in enumerate(state.occupied) if not count and cell not in state.food]
+    if empty:
+        cell = rng.choice(empty)
+        state.food.add(cell)
+        state.hash ^= state.keys.food[cell]
+
+
+def snake_data(state: GameState, snake: int, latency: str) -> dict:
+    body = [state.point(cell) for cell in state.bodies[snake]]
+    return {
+        'id': state.ids[snake],
+        'name': state.ids[snake],
+        'health': state.health[snake],
+        'body': body,
+        'latency': latency,
+        'head': body[0],
+        'length': len(body),
+        'shout': "",
+        'squad': "",
+    }
+
+
+def request_data(state: GameState, snake: int, game_id: str, turn: int, timeout: int,
+                 latencies: List[str]) -> dict:
+    """The /move payload the engine would send to `snake`"""
+    snakes = [snake_data(state, index, latencies[index]) for index, alive in enumerate(state.alive) if alive]
+    return {
+        'game': {'id': game_id, 'ruleset': {'name': state.ruleset.name, 'version': "arena"}, 'timeout': timeout},
+        'turn': turn,
+        'board': {
+            'height': state.height,
+            'width': state.width,
+            'food': [state.point(cell) for cell in state.food],
+            'hazards': [state.point(cell) for cell, hazard in enumerate(state.hazards) if hazard],
+            'snakes': snakes,
+        },
+        'you': snake_data(state, snake, latencies[snake]),
+    }
+
+
+def straight_on(state: GameState, snake: int) -> str:
+    """What the engine plays for a snake that missed its turn: the same move as last time"""
+    body = state.bodies[snake]
+    for move, cell in state.neighbors[body[1]] if len(body) > 1 else ():
+        if cell == body[0]:
+            return move
+    return "up"
+
+
+def play_game(specs: List[str], seed: int, size: int = SIZE, timeout: int = TIMEOUT_MS,
+              max_turns: int = MAX_TURNS) -> dict:
+    """
+    Plays one game, snake i controlled by specs[i]. Returns the winner's spec
+    (None for a draw) and every player's move latencies, search nodes and the
+    moves it missed (a server that timed out or failed).
+    """
+    # Search nodes are read from the metrics counters, turned on only for the game
+    enabled = metrics.ENABLED
+    metrics.ENABLED = True
+    try:
+        # Games in one process share their openings, moves from the cache would skew latency and nodes
+        with position_cache.positions.disabled():
+            return _play_game(specs, seed, size, timeout, max_turns)
+    finally:
+        metrics.ENABLED = enabled
+
+
+def _play_game(specs: List[str], seed: int, size: int, timeout: int, max_turns: int) -> dict:
+    rng = random.Random(seed)
+    players = [Player(spec) for spec in specs]
+    state = new_game(len(players), size, rng)
+    game_id = f"arena-{seed}"
+    latencies = [""] * len(players)
+    stats = [{'latencies': [], 'nodes': 0, 'missed': 0} for _ in players]
+
+    for snake, player in enumerate(players):
+        player.start(request_data(state, snake, game_id, 0, timeout, latencies))
+    turn = 0
+    while sum(state.alive) > (1 if len(players) > 1 else 0) and turn < max_turns:
+        moves = [None] * len(players)
+        for snake, player in enumerate(players):
+            if not state.alive[snake]:
+                continue
+            data = request_data(state, snake, game_id, turn, timeout, latencies)
+            nodes = metrics.NODES.value
+            started = time.perf_counter()
+            moves[snake] = player.move(data)
+            if moves[snake] is None:
+                moves[snake] = straight_on(state, snake)
+                stats[snake]['missed'] += 1
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            latencies[snake] = str(int(elapsed_ms))
+            stats[snake]['latencies'].append(elapsed_ms)
+            stats[snake]['nodes'] += metrics.NODES.value - nodes
+        state.step(moves)
+        spawn_food(state, rng)
+        turn += 1
+    for snake, player in enumerate(players):
+        player.end(request_data(state, snake, game_id, turn, timeout, latencies))
+
+    survivors = [specs[snake] for snake, alive in enumerate(state.alive) if alive]
+    return {
+        'winner': survivors[0] if len(survivors) == 1 else None,
+        'turns': turn,
+        'players': [dict(spec=spec, **stat) for spec, stat in zip(specs, stats)],
+    }
+
+
+def _play(args) -> dict:
+    return play_game(*args)
+
+
+class SelfPlayMove(NamedTuple):
+    turn: int
+    snake: int
+    # The /move request the snake got
+    data: dict
+    move: str
+
+
+def self_play(games: int, size: int = SIZE, players: int = 4, play_timeout: int = 100, explore: float = 0.0,
+              seed: int = 0, name: str = "self-play", max_turns: int = MAX_TURNS
+              ) -> Iterator[Tuple[List[SelfPlayMove], List[Optional[int]]]]:
+    """
+    Games of choose_move against itself where every move is a random safe one
+    instead with chance `explore`. Yields each game's moves once it's over, with
+    the turn every snake died on (None for the ones still alive at the end).
+    """
+    rng = random.Random(seed)
+    explore_policy = random_policy(rng)
+    for game in range(games):
+        state = new_game(players, size, rng)
+        game_id = f"{name}-{seed}-{game}"
+        latencies = [""] * players
+        played = []
+        death_turns: List[Optional[int]] = [None] * players
+        for turn in range(max_turns):
+            if sum(state.alive) <= 1:
+                break
+            moves = [None] * players
+            for snake, alive in enumerate(state.alive):
+                if not alive:
+                    continue
+                data = request_data(state, snake, game_id, turn, play_timeout, latencies)
+                if turn == 0:
+                    game_cache.games.start(data)
+                moves[snake], _ = server_logic.choose_move(data)
+                if rng.random() < explore:
+                    moves[snake] = explore_policy(state, snake)
+                played.append(SelfPlayMove(turn, snake, data, moves[snake]))
+            alive_before = list(state.alive)
+            state.step(moves)
+            spawn_food(state, rng)
+            for snake, alive in enumerate(state.alive):
+                if alive_before[snake] and not alive:
+                    death_turns[snake] = turn + 1
+        for snake in range(players):
+            game_cache.games.end(request_data(state, snake, game_id, 0, play_timeout, latencies))
+        yield played, death_turns
+
+
+def wilson_interval(wins: int, games: int, z: float = Z_95):
+    if not games:
+        return 0.0, 0.0
+    rate = wins / games
+    denominator = 1 + z * z / games
+    center = (rate + z * z / (2 * games)) / denominator
+    margin = z * math.sqrt(rate * (1 - rate) / games + z * z / (4 * games * games)) / denominator
+    return center - margin, center + margin
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def summarize(specs: List[str], results: List[dict]) -> Dict[str, dict]:
+    summary = {}
+    for spec in dict.fromkeys(specs):
+        wins = sum(1 for result in results if result['winner'] == spec)
+        latencies = [latency for result in results for player in result['players'] if player['spec'] == spec
+                     for latency in player['latencies']]
+        nodes = sum(player['nodes'] for result in results for player in result['players'] if player['spec'] == spec)
+        missed = sum(player.get('missed', 0) for result in results for player in result['players']
+                     if player['spec'] == spec)
+        seconds = sum(latencies) / 1000
+        summary[spec] = {
+            'games': len(results),
+            'wins': wins,
+            'win_rate': wins / len(results) if results else 0.0,
+            'win_rate_95': wilson_interval(wins, len(results)),
+            'mean_ms': sum(latencies) / len(latencies) if latencies else 0.0,
+            'p99_ms': percentile(latencies, 0.99),
+            'nodes_per_second': nodes / seconds if seconds else 0.0,
+            'missed_moves': missed,
+        }
+    summary['draws'] = sum(1 for result in results if result['winner'] is None)
+    return summary
+
+
+def run(specs: List[str], games: int, workers: int = 1, size: int = SIZE, timeout: int = TIMEOUT_MS,
+        max_turns: int = MAX_TURNS, seed: int = 0) -> Dict[str, dict]:
+    jobs = [(specs, seed + game, size, timeout, max_turns) for game in range(games)]
+    if workers > 1:
+        with Pool(workers) as pool:
+            results = list(pool.imap_unordered(_play, jobs))
+    else:
+        results = [_play(job) for job in jobs]
+    return summarize(specs, results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play local games between versions of the snake")
+    parser.add_argument("players", nargs="+", help="engine[:opponent_policy] or a server URL, one per snake")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--size", type=int, default=SIZE)
+    parser.add_argument("--timeout", type=int, default=TIMEOUT_MS, help="game timeout in ms")
+    parser.add_argument("--max-turns", type=int, default=MAX_TURNS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    summary = run(args.players, args.games, args.workers, args.size, args.timeout, args.max_turns, args.seed)
+    draws = summary.pop('draws')
+    for spec, result in summary.items():
+        low, high = result['win_rate_95']
+        print(f"{spec}: won {result['wins']}/{result['games']} ({result['win_rate']:.1%}, 95% CI {low:.1%}-{high:.1%})"
+              f", mean {result['mean_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms"
+              f", {result['nodes_per_second']:.0f} nodes/s, {result['missed_moves']} missed moves")
+    print(f"draws: {draws}")
+
+
+if __name__ == "__main__":
+    main()
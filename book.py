@@ -0,0 +1,214 @@
+import mmap
+import os
+import struct
+from typing import Dict, List, Optional
+
+from floodfill import free_after
+from game_state import FULL_HEALTH, MOVE_INDEX, MOVES, GameState
+from symmetry import canonical_key, local_canonical, move_from_canonical, stable_hash
+"""
+Opening book and endgame tablebase: moves worked out offline for positions that
+keep coming back, looked up before choose_move searches anything.
+
+* Opening: the first OPENING_TURNS turns of a game, keyed by the canonical
+  (rotation and reflection reduced) hash of the whole position and answered with
+  a move from a search with a much bigger time budget than a real turn has.
+* Endgame: we're sealed into a region of at most REGION_CELLS cells that no
+  opponent can get to. The key is the shape of the region (where it is on the
+  board doesn't matter), with when each cell frees up and whose segment is on
+  it, and the move is the one that survives the longest, found by trying every
+  path.
+
+Both live in one file of sorted (key, move) records that's memory-mapped at
+import, so every worker process shares the same pages. book_builder.py makes it,
+and it's found through SNAKE_BOOK (default book.bin next to this file).
+"""
+
+BOOK_PATH = os.environ.get("SNAKE_BOOK", os.path.join(os.path.dirname(os.path.abspath(__file__)), "book.bin"))
+MAGIC = b"SNKBOOK1"
+HEADER = struct.Struct("<8sI")
+RECORD = struct.Struct("<QB")
+OPENING_TURNS = 6
+REGION_CELLS = 12
+# Turns an endgame path has to last to count as surviving, and the most a timing in the key can say
+HORIZON = 2 * REGION_CELLS
+
+
+class Book:
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as book_file:
+            self.data = mmap.mmap(book_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a book file")
+
+    def __len__(self):
+        return self.count
+
+    def get(self, key: int) -> Optional[str]:
+        """Binary search over the records, straight on the mapped file"""
+        data = self.data
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            record_key, move = RECORD.unpack_from(data, HEADER.size + middle * RECORD.size)
+            if record_key == key:
+                return MOVES[move]
+            if record_key < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def close(self) -> None:
+        self.data.close()
+
+
+def write_book(path: str, entries: Dict[int, str]) -> None:
+    with open(path, "wb") as book_file:
+        book_file.write(HEADER.pack(MAGIC, len(entries)))
+        for key in sorted(entries):
+            book_file.write(RECORD.pack(key, MOVE_INDEX[entries[key]]))
+
+
+def load(path: str = BOOK_PATH) -> Optional[Book]:
+    return Book(path) if os.path.exists(path) else None
+
+
+loaded = load()
+
+
+def opening_key(state: GameState):
+    key, symmetry = canonical_key(state)
+    return stable_hash(("opening", key)), symmetry
+
+
+def sealed_region(state: GameState, free_at: List[int]) -> Optional[List[int]]:
+    """
+    The cells our head can get to if they're at most REGION_CELLS and no opponent
+    head is next to any of them, otherwise None. Cells taking longer than HORIZON
+    turns to free up count as walls.
+    """
+    ruleset = state.ruleset
+    if ruleset.wrapped or ruleset.constrictor or not ruleset.hazards_are_walls:
+        return None
+    adjacent = state.adjacent
+    head = state.head(state.you)
+    seen = {head}
+    frontier = [head]
+    region = []
+    while frontier:
+        cell = frontier.pop()
+        for next_cell in adjacent[cell]:
+            if next_cell not in seen and free_at[next_cell] <= HORIZON:
+                seen.add(next_cell)
+                region.append(next_cell)
+                if len(region) > REGION_CELLS:
+                    return None
+                frontier.append(next_cell)
+    if not region:
+        return None
+    cells = set(region)
+    for snake, alive in enumerate(state.alive):
+        if not alive or snake == state.you:
+            continue
+        other_head = state.head(snake)
+        if other_head in cells or any(next_cell in cells for next_cell in adjacent[other_head]):
+            return None
+    return region
+
+
+def endgame_key(state: GameState, region: List[int], free_at: List[int]):
+    width = state.width
+    head = state.head(state.you)
+    # Ours or not matters, survival_turns keeps our segments longer once we eat
+    ours = set(state.bodies[state.you])
+    points = [(cell % width, cell // width, (min(free_at[cell], HORIZON + 1), cell in state.food, cell in ours))
+              for cell in region]
+    points.append((head % width, head // width, (-1, False, True)))
+    encoding, symmetry = local_canonical(points)
+    length = min(len(state.bodies[state.you]), HORIZON + 1)
+    health = min(state.health[state.you], HORIZON + 1)
+    return stable_hash(("endgame", state.ruleset.name, length, health, encoding)), symmetry
+
+
+def survival_turns(state: GameState, region: List[int], free_at: List[int]) -> Dict[str, int]:
+    """
+    How many turns (up to HORIZON) every move into the region lets us survive,
+    trying every path. Our own segments, old and new, stay one turn longer for
+    every food we eat on the way.
+    """
+    cells = set(region)
+    ours = set(state.bodies[state.you])
+    adjacent = state.adjacent
+    start_length = len(state.bodies[state.you])
+    # Turn our segment on each cell frees up at, not counting growth
+    until = {cell: free_at[cell] for cell in ours}
+
+    def longest(cell, turn, grown, health, eaten):
+        if turn >= HORIZON:
+            return turn
+        best = turn
+        next_turn = turn + 1
+        for next_cell in adjacent[cell]:
+            if next_cell not in cells:
+                continue
+            if next_cell in until:
+                if until[next_cell] + grown > next_turn:
+                    continue
+            elif free_at[next_cell] > next_turn:
+                continue
+            best = max(best, enter(next_cell, next_turn, grown, health, eaten))
+            if best >= HORIZON:
+                break
+        return best
+
+    def enter(cell, turn, grown, health, eaten):
+        previous = until.get(cell)
+        until[cell] = turn + start_length
+        if cell in state.food and cell not in eaten:
+            turns = longest(cell, turn, grown + 1, FULL_HEALTH, eaten | {cell})
+        elif health > 1:
+            turns = longest(cell, turn, grown, health - 1, eaten)
+        else:
+            turns = turn - 1
+        if previous is None:
+            del until[cell]
+        else:
+            until[cell] = previous
+        return turns
+
+    turns = {}
+    for move, cell in state.neighbors[state.head(state.you)]:
+        if cell in cells and free_at[cell] <= 1:
+            turns[move] = enter(cell, 1, 0, state.health[state.you], frozenset())
+    return turns
+
+
+def best_endgame_move(state: GameState, region: List[int], free_at: List[int]) -> Optional[str]:
+    turns = survival_turns(state, region, free_at)
+    return max(turns, key=turns.get) if turns else None
+
+
+def lookup(state: GameState, turn: int, book: Optional[Book] = None) -> Optional[str]:
+    """The book's move for this position, if it has one and it doesn't run into anything right away"""
+    book = book or loaded
+    if book is None:
+        return None
+    move = None
+    if turn <= OPENING_TURNS:
+        key, symmetry = opening_key(state)
+        move = book.get(key)
+    if move is None:
+        free_at = free_after(state)
+        region = sealed_region(state, free_at)
+        if region is None:
+            return None
+        key, symmetry = endgame_key(state, region, free_at)
+        move = book.get(key)
+    if move is None:
+        return None
+    move = move_from_canonical(move, symmetry)
+    cell = state.neighbor(state.head(state.you), move)
+    return move if cell >= 0 and state.is_free(cell) else None
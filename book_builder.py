@@ -0,0 +1,73 @@
+import argparse
+from typing import Dict
+
+import arena
+import game_cache
+import position_cache
+import server_logic
+from book import BOOK_PATH, OPENING_TURNS, best_endgame_move, endgame_key, opening_key, sealed_region, write_book
+from floodfill import free_after
+from game_state import GameState
+from symmetry import move_to_canonical
+"""
+Builds the opening book and endgame tablebase that book.py looks up, from
+self-play games:
+
+    python book_builder.py --games 200 --out book.bin
+
+Opening positions get a search with a much bigger time budget than a real turn
+has, sealed endgame regions are solved by trying every path.
+"""
+
+# Without some random moves every self-play game would look the same
+EXPLORE = 0.1
+
+
+def generate(games: int, size: int = arena.SIZE, players: int = 4, timeout: int = 2000,
+             play_timeout: int = 100, explore: float = EXPLORE, seed: int = 0) -> Dict[int, str]:
+    """
+    Plays self-play games and adds every opening position (answered with a search
+    of `timeout` ms) and every sealed endgame region (solved exactly) in them.
+    """
+    entries: Dict[int, str] = {}
+    for moves, _ in arena.self_play(games, size, players, play_timeout, explore, seed, name="book"):
+        for played in moves:
+            data = played.data
+            position = GameState.from_data(data)
+            if played.turn <= OPENING_TURNS:
+                key, symmetry = opening_key(position)
+                if key not in entries:
+                    deep = dict(data, game=dict(data['game'], timeout=timeout))
+                    # The game already put its own, much shallower, move in the position cache
+                    with position_cache.positions.disabled():
+                        move, _ = server_logic.choose_move(deep)
+                    game_cache.games.end(deep)
+                    entries[key] = move_to_canonical(move, symmetry)
+            free_at = free_after(position)
+            region = sealed_region(position, free_at)
+            if region is not None:
+                key, symmetry = endgame_key(position, region, free_at)
+                move = best_endgame_move(position, region, free_at)
+                if key not in entries and move is not None:
+                    entries[key] = move_to_canonical(move, symmetry)
+    return entries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the opening book and endgame tablebase")
+    parser.add_argument("--games", type=int, default=100, help="self-play games to collect positions from")
+    parser.add_argument("--size", type=int, default=arena.SIZE)
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--timeout", type=int, default=2000, help="game timeout in ms for the opening searches")
+    parser.add_argument("--explore", type=float, default=EXPLORE, help="chance of a random move in self-play")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=BOOK_PATH)
+    args = parser.parse_args()
+
+    entries = generate(args.games, args.size, args.players, args.timeout, explore=args.explore, seed=args.seed)
+    write_book(args.out, entries)
+    print(f"{len(entries)} positions written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
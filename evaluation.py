@@ -0,0 +1,203 @@
+import os
+from typing import List, Optional, Sequence, Tuple
+
+from floodfill import free_after, reachable_area
+from game_state import FULL_HEALTH, MOVE_INDEX, GameState
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, without it choose_move keeps the hand-tuned weights
+    np = None
+"""
+Learned move evaluation, to replace the hand-tuned food and enemy weights once
+there's a model trained for it.
+
+Every candidate move becomes a row of features: WINDOW x WINDOW planes around
+the cell we'd move to (blocked cells, food, hazards, heads of snakes as long as
+us or longer, heads of shorter ones) and a few numbers about the whole position
+(health, length against the longest opponent, room after the move, distance to
+food). The same window is used on every board size, so one model plays them all.
+
+The model is a small MLP (or linear, with no hidden layer) scoring how likely a
+move is to keep us alive, NumPy only and on the CPU. score_moves puts the
+candidates of any number of positions through it as one matrix, so choose_moves
+scores a whole batch of games with one multiply per layer. Models are trained
+offline by train_eval.py and found through SNAKE_EVAL_MODEL (default eval.npz
+next to this file), with no model file the hand-tuned weights are used.
+"""
+
+MODEL_PATH = os.environ.get("SNAKE_EVAL_MODEL",
+                            os.path.join(os.path.dirname(os.path.abspath(__file__)), "eval.npz"))
+RADIUS = 3
+WINDOW = 2 * RADIUS + 1
+PLANES = ("blocked", "food", "hazard", "bigger_head", "smaller_head")
+SCALARS = ("health", "length", "room", "food_distance", "eats")
+FEATURES = len(PLANES) * WINDOW * WINDOW + len(SCALARS)
+# Where the room after a move stops counting, in body lengths
+ROOM_LENGTHS = 2
+# One more than the window needs, so a move off the board still gets a whole window (of wall)
+PADDING = RADIUS + 1
+
+
+def available() -> bool:
+    return np is not None
+
+
+def board_planes(state: GameState, free_at: List[int]):
+    """(planes, height + 2 * PADDING, width + 2 * PADDING): the board with PADDING cells around"""
+    width, height = state.width, state.height
+    planes = np.zeros((len(PLANES), height * width), dtype=np.float32)
+    planes[0] = np.array(free_at, dtype=np.int64) > 1
+    planes[1, list(state.food)] = 1
+    planes[2] = np.frombuffer(bytes(state.hazards), dtype=np.uint8)
+    our_length = len(state.bodies[state.you])
+    for snake, alive in enumerate(state.alive):
+        if alive and snake != state.you:
+            planes[3 if len(state.bodies[snake]) >= our_length else 4, state.head(snake)] = 1
+    planes = planes.reshape(len(PLANES), height, width)
+    padding = ((0, 0), (PADDING, PADDING), (PADDING, PADDING))
+    if state.ruleset.wrapped:
+        return np.pad(planes, padding, mode="wrap")
+    padded = np.pad(planes, padding)
+    # Off the board is a wall
+    padded[0, :PADDING] = padded[0, -PADDING:] = padded[0, :, :PADDING] = padded[0, :, -PADDING:] = 1
+    return padded
+
+
+def features(state: GameState, moves: Sequence[str], free_at: Optional[List[int]] = None):
+    """(len(moves), FEATURES) rows for our snake's candidate moves"""
+    if free_at is None:
+        free_at = free_after(state)
+    width, height = state.width, state.height
+    planes = board_planes(state, free_at)
+    you = state.you
+    head = state.head(you)
+    head_x, head_y = head % width, head // width
+    length = len(state.bodies[you])
+    opponents = [len(body) for snake, body in enumerate(state.bodies) if state.alive[snake] and snake != you]
+    length_difference = max(-1.0, min(1.0, (length - max(opponents, default=length)) / 10))
+    food = [(cell % width, cell // width) for cell in state.food]
+    steps = state.steps[head]
+    rows = np.zeros((len(moves), FEATURES), dtype=np.float32)
+    for row, move in enumerate(moves):
+        cell = steps[MOVE_INDEX[move]]
+        if cell >= 0:
+            x, y = cell % width, cell // width
+        else:
+            # Off the board (x or y is -1, width or height), the window still shows the wall we'd hit
+            x = head_x + (move == "right") - (move == "left")
+            y = head_y + (move == "up") - (move == "down")
+        # The window's corner, in padded coordinates
+        left, bottom = x + PADDING - RADIUS, y + PADDING - RADIUS
+        window = planes[:, bottom:bottom + WINDOW, left:left + WINDOW]
+        rows[row, :window.size] = window.ravel()
+        room = reachable_area(state, cell, free_at, limit=ROOM_LENGTHS * length) / (ROOM_LENGTHS * length)
+        distance = min((abs(x - food_x) + abs(y - food_y) for food_x, food_y in food), default=width + height)
+        rows[row, window.size:] = (
+            state.health[you] / FULL_HEALTH,
+            length_difference,
+            room,
+            distance / (width + height),
+            cell in state.food,
+        )
+    return rows
+
+
+class Model:
+    """
+    Dense layers with tanh between them, features are standardized with the
+    mean and scale of the training set first.
+    """
+
+    def __init__(self, layers: List[Tuple["np.ndarray", "np.ndarray"]], mean, scale):
+        self.layers = layers
+        self.mean = mean
+        self.scale = scale
+
+    def score(self, rows):
+        values = (rows - self.mean) / self.scale
+        for index, (weights, bias) in enumerate(self.layers):
+            values = values @ weights + bias
+            if index < len(self.layers) - 1:
+                values = np.tanh(values)
+        return values[:, 0]
+
+    def save(self, path: str) -> None:
+        arrays = {"mean": self.mean, "scale": self.scale}
+        for index, (weights, bias) in enumerate(self.layers):
+            arrays[f"weights{index}"] = weights
+            arrays[f"bias{index}"] = bias
+        with open(path, "wb") as model_file:
+            np.savez(model_file, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "Model":
+        with np.load(path) as arrays:
+            layers = [(arrays[f"weights{index}"], arrays[f"bias{index}"])
+                      for index in range(sum(1 for name in arrays.files if name.startswith("weights")))]
+            return cls(layers, arrays["mean"], arrays["scale"])
+
+
+def load(path: str = MODEL_PATH) -> Optional[Model]:
+    return Model.load(path) if available() and os.path.exists(path) else None
+
+
+loaded = load()
+
+
+def train(rows, targets, hidden: int = 32, epochs: int = 300, learning_rate: float = 0.01,
+          seed: int = 0) -> Model:
+    """
+    Fits a model to (rows, targets): least squares with no hidden layer, otherwise
+    full batch Adam on the squared error.
+    """
+    rows = np.asarray(rows, dtype=np.float32)
+    targets = np.asarray(targets, dtype=np.float32).reshape(-1, 1)
+    mean = rows.mean(axis=0)
+    scale = rows.std(axis=0)
+    scale[scale == 0] = 1
+    inputs = (rows - mean) / scale
+    if not hidden:
+        with_bias = np.hstack([inputs, np.ones((len(inputs), 1), dtype=np.float32)])
+        # A bit of ridge keeps features that never change (or always change together) at 0
+        solution = np.linalg.solve(with_bias.T @ with_bias + 1e-3 * np.eye(with_bias.shape[1]), with_bias.T @ targets)
+        return Model([(solution[:-1].astype(np.float32), solution[-1].astype(np.float32))], mean, scale)
+
+    rng = np.random.default_rng(seed)
+    parameters = [
+        rng.normal(0, 1 / np.sqrt(inputs.shape[1]), (inputs.shape[1], hidden)).astype(np.float32),
+        np.zeros(hidden, dtype=np.float32),
+        rng.normal(0, 1 / np.sqrt(hidden), (hidden, 1)).astype(np.float32),
+        np.full(1, targets.mean(), dtype=np.float32),
+    ]
+    first_moments = [np.zeros_like(parameter) for parameter in parameters]
+    second_moments = [np.zeros_like(parameter) for parameter in parameters]
+    for epoch in range(1, epochs + 1):
+        hidden_values = np.tanh(inputs @ parameters[0] + parameters[1])
+        error = (hidden_values @ parameters[2] + parameters[3] - targets) * (2 / len(inputs))
+        hidden_error = (error @ parameters[2].T) * (1 - hidden_values ** 2)
+        gradients = [inputs.T @ hidden_error, hidden_error.sum(axis=0), hidden_values.T @ error, error.sum(axis=0)]
+        for parameter, gradient, first, second in zip(parameters, gradients, first_moments, second_moments):
+            first *= 0.9
+            first += 0.1 * gradient
+            second *= 0.999
+            second += 0.001 * gradient ** 2
+            parameter -= learning_rate * (first / (1 - 0.9 ** epoch)) / (np.sqrt(second / (1 - 0.999 ** epoch)) + 1e-8)
+    return Model([(parameters[0], parameters[1]), (parameters[2], parameters[3])], mean, scale)
+
+
+def score_moves(positions: List[Tuple[GameState, Sequence[str]]], model: Optional[Model] = None) -> List[List[float]]:
+    """The model's score for every (position, moves) pair's moves, all of them in one pass through the model"""
+    model = model or loaded
+    rows = [features(state, moves) for state, moves in positions]
+    scores = model.score(np.concatenate(rows)).tolist() if rows else []
+    split = []
+    for position_rows in rows:
+        split.append(scores[:len(position_rows)])
+        scores = scores[len(position_rows):]
+    return split
+
+
+def rank(moves: Sequence[str], scores: Sequence[float]) -> List[str]:
+    """Best move first"""
+    return [moves[index] for index in sorted(range(len(moves)), key=lambda index: -scores[index])]
@@ -0,0 +1,102 @@
+from collections import deque
+from typing import List, Optional
+
+from game_state import GameState
+"""
+Reachable space evaluation: how much room a snake has after a move, and how the
+board splits between the snakes (Voronoi territory).
+
+Both are flood fills over the flat cell arrays of GameState that know when body
+segments move away: a segment i cells from the tail is gone in i + 1 turns, so a
+cell we'd reach in d turns counts as free if it empties in d turns or less.
+
+Every fill starts from scratch, there are no incremental updates. From one turn
+to the next every head moves and every segment's timing shifts, so there's
+little of the previous fill left to patch, and the fills are cheap already:
+weight_for_food's stop at our length (a few us), a whole 19x19 board takes about
+0.15 ms and voronoi about 0.35 ms. Minimax calls voronoi at its leaves, each on
+a different board made by step/undo, where there's no previous fill either.
+"""
+
+BLOCKED = 1 << 30
+
+
+def free_after(state: GameState) -> List[int]:
+    """How many turns until each cell is free (0 = free now, BLOCKED = never)"""
+    free_at = [0] * len(state.occupied)
+    if state.ruleset.hazards_are_walls:
+        for cell, hazard in enumerate(state.hazards):
+            if hazard:
+                free_at[cell] = BLOCKED
+    for snake, body in enumerate(state.bodies):
+        if not state.alive[snake]:
+            continue
+        length = len(body)
+        for index, cell in enumerate(body):
+            # max() takes care of stacked tails, the cell frees up with the last segment on it
+            free_at[cell] = max(free_at[cell], length - index)
+    return free_at
+
+
+def reachable_area(state: GameState, start: int, free_at: Optional[List[int]] = None,
+                   limit: Optional[int] = None) -> int:
+    """
+    Number of cells a snake stepping onto `start` next turn can reach. Stops counting
+    at `limit` since usually we only care whether there's enough room.
+    """
+    if start < 0:
+        return 0
+    if free_at is None:
+        free_at = free_after(state)
+    if free_at[start] > 1:
+        return 0
+    adjacent = state.adjacent
+    seen = {start}
+    frontier = deque([(start, 1)])
+    while frontier:
+        if limit is not None and len(seen) >= limit:
+            return len(seen)
+        cell, distance = frontier.popleft()
+        distance += 1
+        for next_cell in adjacent[cell]:
+            if next_cell not in seen and free_at[next_cell] <= distance:
+                seen.add(next_cell)
+                frontier.append((next_cell, distance))
+    return len(seen)
+
+
+def voronoi(state: GameState, free_at: Optional[List[int]] = None) -> List[int]:
+    """
+    Cells each snake reaches strictly before every other snake, by snake index.
+    Cells reached at the same time by several snakes don't count for anybody.
+    """
+    if free_at is None:
+        free_at = free_after(state)
+    adjacent = state.adjacent
+    owner = {}
+    distance_to = {}
+    frontier = deque()
+    territory = [0] * len(state.bodies)
+    for snake, body in enumerate(state.bodies):
+        if state.alive[snake]:
+            owner[body[0]] = snake
+            distance_to[body[0]] = 0
+            frontier.append(body[0])
+    contested = -1
+    while frontier:
+        cell = frontier.popleft()
+        snake = owner[cell]
+        distance = distance_to[cell] + 1
+        for next_cell in adjacent[cell]:
+            if free_at[next_cell] > distance:
+                continue
+            if next_cell not in distance_to:
+                distance_to[next_cell] = distance
+                owner[next_cell] = snake
+                frontier.append(next_cell)
+            elif distance_to[next_cell] == distance and owner[next_cell] not in (snake, contested):
+                owner[next_cell] = contested
+    for cell, snake in owner.items():
+        if snake != contested and distance_to[cell]:
+            territory[snake] += 1
+    return territory
@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from transposition import TranspositionTable
+"""
+State we keep for each game between /move requests: the transposition table,
+the MCTS tree, how long our last move took and the engine picked for the game.
+
+Games are keyed by game id and snake id, the same server can play several
+snakes in one game. They are created on /start and dropped on /end. Since /end can get lost (and
+the server can restart in the middle of a game) get() creates the game when it
+doesn't know it. Games nobody asked about in IDLE_SECONDS are dropped, and so
+are the least recently used ones while there are more than MAX_GAMES or their
+transposition tables take more than MAX_MEMORY_MB.
+
+The board itself isn't kept: GameState.from_data builds one in 10-20 us, far
+less than diffing each request against the previous turn would save.
+"""
+
+MAX_GAMES = int(os.environ.get("SNAKE_MAX_GAMES", "64"))
+# Per game, so MAX_GAMES full tables have to fit in memory
+TABLE_ENTRIES = int(os.environ.get("SNAKE_GAME_TT_ENTRIES", "20000"))
+IDLE_SECONDS = float(os.environ.get("SNAKE_GAME_IDLE_SECONDS", "300"))
+# The default lets MAX_GAMES full tables in
+MAX_MEMORY_MB = float(os.environ.get("SNAKE_GAME_CACHE_MB", "256"))
+# Roughly what a transposition table entry takes
+TABLE_ENTRY_BYTES = 200
+
+
+def game_key(data: dict) -> str:
+    return f"{data['game']['id']}/{data['you']['id']}"
+
+
+class GameContext:
+    __slots__ = ("key", "turn", "table", "mcts", "engine", "last_elapsed_ms", "last_used")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.turn = -1
+        self.table = TranspositionTable(TABLE_ENTRIES)
+        self.mcts = None
+        # None plays server_logic.ENGINE
+        self.engine: Optional[str] = None
+        self.last_elapsed_ms: Optional[float] = None
+        self.last_used = time.monotonic()
+
+
+class GameCache:
+    def __init__(self, max_games: int = MAX_GAMES, idle_seconds: float = IDLE_SECONDS,
+                 max_memory_mb: float = MAX_MEMORY_MB):
+        self.max_games = max_games
+        self.idle_seconds = idle_seconds
+        self.max_memory_bytes = max_memory_mb * 1024 * 1024
+        self.games = OrderedDict()
+        # gunicorn's threads share it
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.games)
+
+    def __contains__(self, key: str):
+        return key in self.games
+
+    def start(self, data: dict) -> GameContext:
+        with self.lock:
+            self.games.pop(game_key(data), None)
+        return self.get(data)
+
+    def get(self, data: dict) -> GameContext:
+        key = game_key(data)
+        now = time.monotonic()
+        with self.lock:
+            game = self.games.get(key)
+            if game is None:
+                game = self.games[key] = GameContext(key)
+            else:
+                self.games.move_to_end(key)
+            game.last_used = now
+            self.evict(now)
+        return game
+
+    def evict(self, now: float) -> None:
+        """Drops idle games, then the least recently used over the limits. Called holding the lock."""
+        # Oldest first, so the idle ones are at the front
+        while self.games:
+            oldest = next(iter(self.games.values()))
+            if now - oldest.last_used < self.idle_seconds:
+                break
+            self.games.popitem(last=False)
+        while len(self.games) > self.max_games:
+            self.games.popitem(last=False)
+        # The game just asked for is last and always stays
+        while len(self.games) > 1 and self.memory_bytes() > self.max_memory_bytes:
+            self.games.popitem(last=False)
+
+    def memory_bytes(self) -> int:
+        return sum(len(game.table) for game in self.games.values()) * TABLE_ENTRY_BYTES
+
+    def end(self, data: dict) -> None:
+        with self.lock:
+            self.games.pop(game_key(data), None)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'games': len(self.games),
+                'max_games': self.max_games,
+                'table_entries': sum(len(game.table) for game in self.games.values()),
+                'memory_bytes': self.memory_bytes(),
+            }
+
+
+# Shared by every request this process serves
+games = GameCache()
@@ -0,0 +1,326 @@
+from collections import deque
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Tuple
+
+from transposition import zobrist_keys
+"""
+Compact game state for the lookahead search.
+
+The request JSON is converted once per move into flat arrays indexed by cell
+(cell = y * width + x). Moving a snake and undoing that move only touches a
+couple of integers, so the search never has to deepcopy the whole payload or
+rebuild a list-of-lists board for every node.
+"""
+
+MOVES = ("up", "down", "left", "right")
+MOVE_INDEX = {move: index for index, move in enumerate(MOVES)}
+FULL_HEALTH = 100
+DEFAULT_HAZARD_DAMAGE = 14
+# move_snake records use these instead of a tail when the snake grew
+ATE = -1
+GREW = -2
+
+
+class Ruleset(NamedTuple):
+    name: str
+    # Moving off an edge comes back on the other side
+    wrapped: bool = False
+    # Every snake grows every turn and never gets hungry
+    constrictor: bool = False
+    # Standard games keep treating hazards as walls like fill_board_with_snakes does,
+    # royale maps are covered in them so there we walk through and pay the damage
+    hazards_are_walls: bool = True
+
+
+RULESETS = {
+    "standard": Ruleset("standard"),
+    "solo": Ruleset("solo"),
+    "royale": Ruleset("royale", hazards_are_walls=False),
+    "constrictor": Ruleset("constrictor", constrictor=True),
+    "wrapped": Ruleset("wrapped", wrapped=True, hazards_are_walls=False),
+}
+STANDARD = RULESETS["standard"]
+
+
+def get_ruleset(name: str) -> Ruleset:
+    """Unknown rulesets are played as standard"""
+    return RULESETS.get(name, STANDARD)
+
+
+@lru_cache(maxsize=None)
+def step_table(width: int, height: int, wrapped: bool = False) -> Tuple[Tuple[int, ...], ...]:
+    """
+    For every cell, the cell each of MOVES leads to (in MOVES order), -1 if off the
+    board. On wrapped boards every move lands somewhere.
+    """
+    table = []
+    for cell in range(width * height):
+        x, y = cell % width, cell // width
+        if wrapped:
+            table.append((
+                (y + 1) % height * width + x,
+                (y - 1) % height * width + x,
+                y * width + (x - 1) % width,
+                y * width + (x + 1) % width,
+            ))
+            continue
+        table.append((
+            cell + width if y + 1 < height else -1,
+            cell - width if y > 0 else -1,
+            cell - 1 if x > 0 else -1,
+            cell + 1 if x + 1 < width else -1,
+        ))
+    return tuple(table)
+
+
+@lru_cache(maxsize=None)
+def neighbor_table(width: int, height: int, wrapped: bool = False) -> Tuple[Tuple[Tuple[str, int], ...], ...]:
+    """For every cell, the (move, cell) pairs that stay on the board"""
+    return tuple(
+        tuple((move, next_cell) for move, next_cell in zip(MOVES, steps) if next_cell >= 0)
+        for steps in step_table(width, height, wrapped)
+    )
+
+
+@lru_cache(maxsize=None)
+def adjacent_table(width: int, height: int, wrapped: bool = False) -> Tuple[Tuple[int, ...], ...]:
+    """For every cell, the cells next to it, for flood fills that don't care about move names"""
+    return tuple(
+        tuple(next_cell for next_cell in steps if next_cell >= 0) for steps in step_table(width, height, wrapped)
+    )
+
+
+@lru_cache(maxsize=None)
+def straight_first_table(width: int, height: int, wrapped: bool = False):
+    """
+    For every cell and every move (in MOVES order) that got us there, the (move, cell)
+    pairs out of it with carrying straight on first. Going straight keeps away from
+    our own body, so it's usually where a line that survives is found.
+    """
+    return tuple(
+        tuple(tuple(sorted(options, key=lambda option: option[0] != move)) for move in MOVES)
+        for options in neighbor_table(width, height, wrapped)
+    )
+
+
+class GameState:
+    __slots__ = ("width", "height", "ruleset", "steps", "neighbors", "adjacent", "occupied", "hazards", "food", "bodies",
+                 "ids", "health", "alive", "you", "hazard_damage", "keys", "hash")
+
+    def __init__(self, width: int, height: int, ruleset: Ruleset = STANDARD):
+        self.width = width
+        self.height = height
+        self.ruleset = ruleset
+        # Shared by every state of the same size and ruleset, built once per process
+        self.steps = step_table(width, height, ruleset.wrapped)
+        self.neighbors = neighbor_table(width, height, ruleset.wrapped)
+        self.adjacent = adjacent_table(width, height, ruleset.wrapped)
+        # How many body segments sit on each cell (stacked tails count more than once)
+        self.occupied = bytearray(width * height)
+        self.hazards = bytearray(width * height)
+        self.food = set()
+        # One deque per snake, head first. Used as a ring buffer: push the head, pop the tail.
+        self.bodies: List[deque] = []
+        self.ids: List[str] = []
+        self.health: List[int] = []
+        self.alive: List[bool] = []
+        self.you = -1
+        self.hazard_damage = DEFAULT_HAZARD_DAMAGE
+        self.keys = None
+        # Zobrist hash of bodies, food and health, kept up to date by move_snake/undo
+        self.hash = 0
+
+    @classmethod
+    def from_data(cls, data: dict) -> "GameState":
+        data_board = data['board']
+        ruleset = data['game'].get('ruleset', {})
+        state = cls(data_board['width'], data_board['height'], get_ruleset(ruleset.get('name', "standard")))
+        for snake in data_board['snakes']:
+            body = deque(state.cell(point) for point in snake['body'])
+            for cell in body:
+                state.occupied[cell] += 1
+            if snake['id'] == data['you']['id']:
+                state.you = len(state.bodies)
+            state.bodies.append(body)
+            state.ids.append(snake['id'])
+            state.health.append(snake['health'])
+            state.alive.append(True)
+        for point in data_board['hazards']:
+            state.hazards[state.cell(point)] = 1
+        settings = ruleset.get('settings', {})
+        state.hazard_damage = settings.get('hazardDamagePerTurn', DEFAULT_HAZARD_DAMAGE)
+        state.food = {state.cell(point) for point in data_board['food']}
+        state.rehash()
+        return state
+
+    def rehash(self) -> None:
+        keys = self.keys = zobrist_keys(len(self.occupied), len(self.bodies))
+        value = 0
+        for snake, body in enumerate(self.bodies):
+            if self.alive[snake]:
+                value ^= self.snake_hash(snake)
+        for cell in self.food:
+            value ^= keys.food[cell]
+        self.hash = value
+
+    def snake_hash(self, snake: int) -> int:
+        keys = self.keys
+        body = self.bodies[snake]
+        value = keys.head[snake][body[0]] ^ keys.length[snake][len(body)]
+        value ^= keys.health[snake][max(self.health[snake], 0)]
+        for cell in body:
+            value ^= keys.body[snake][cell]
+        return value
+
+    def cell(self, point: Dict[str, int]) -> int:
+        return point['y'] * self.width + point['x']
+
+    def point(self, cell: int) -> Dict[str, int]:
+        return {'x': cell % self.width, 'y': cell // self.width}
+
+    def head(self, snake: int) -> int:
+        return self.bodies[snake][0]
+
+    def neighbor(self, cell: int, move: str) -> int:
+        """The cell next to `cell` in the direction of `move`, or -1 if it's off the board"""
+        return self.steps[cell][MOVE_INDEX[move]]
+
+    def is_free(self, cell: int) -> bool:
+        # Whether hazards count as walls depends on the ruleset, see Ruleset
+        return not self.occupied[cell] and not (self.hazards[cell] and self.ruleset.hazards_are_walls)
+
+    def move_snake(self, snake: int, cell: int) -> Tuple[int, int, int, int]:
+        """
+        Moves the head of `snake` to `cell`, eating the food there if any.
+        Health is left alone, the search keeps track of ours.
+        Returns a record that undo() uses to put everything back.
+        """
+        keys = self.keys
+        previous_hash = self.hash
+        body = self.bodies[snake]
+        self.hash ^= keys.head[snake][body[0]] ^ keys.head[snake][cell] ^ keys.body[snake][cell]
+        body.appendleft(cell)
+        self.occupied[cell] += 1
+        if cell in self.food:
+            self.food.discard(cell)
+            length = len(body)
+            self.hash ^= keys.food[cell] ^ keys.length[snake][length - 1] ^ keys.length[snake][length]
+            return (snake, cell, ATE, previous_hash)
+        if self.ruleset.constrictor:
+            length = len(body)
+            self.hash ^= keys.length[snake][length - 1] ^ keys.length[snake][length]
+            return (snake, cell, GREW, previous_hash)
+        tail = body.pop()
+        self.occupied[tail] -= 1
+        self.hash ^= keys.body[snake][tail]
+        return (snake, cell, tail, previous_hash)
+
+    def undo(self, record: Tuple[int, int, int, int]) -> None:
+        snake, cell, tail, self.hash = record
+        body = self.bodies[snake]
+        body.popleft()
+        self.occupied[cell] -= 1
+        if tail == ATE:
+            self.food.add(cell)
+        elif tail >= 0:
+            body.append(tail)
+            self.occupied[tail] += 1
+
+    def step(self, moves: List[str]) -> tuple:
+        """
+        Resolves a whole turn with the standard rules: every living snake moves at once
+        (moves[i] is the move of snake i, ignored for dead snakes), loses one health,
+        takes hazard damage, eats (in constrictor everybody grows), and then snakes out
+        of bounds, out of health, on a body or losing a head-to-head are eliminated.
+        Returns a record that undo_step() uses to put everything back.
+        """
+        keys = self.keys
+        previous_hash = self.hash
+        occupied = self.occupied
+        moved = []
+        heads = {}
+        for snake, move in enumerate(moves):
+            if not self.alive[snake]:
+                continue
+            body = self.bodies[snake]
+            health = self.health[snake]
+            cell = self.steps[body[0]][MOVE_INDEX[move]]
+            if cell < 0:
+                moved.append([snake, -1, -1, health, False])
+                continue
+            tail = body.pop()
+            occupied[tail] -= 1
+            self.hash ^= keys.body[snake][tail] ^ keys.head[snake][body[0] if body else tail]
+            body.appendleft(cell)
+            occupied[cell] += 1
+            self.hash ^= keys.head[snake][cell] ^ keys.body[snake][cell]
+            new_health = health - 1
+            if self.hazards[cell] and cell not in self.food:
+                new_health -= self.hazard_damage
+            self._set_health(snake, new_health)
+            moved.append([snake, cell, tail, health, False])
+            heads.setdefault(cell, []).append(snake)
+
+        eaten = [cell for cell in heads if cell in self.food]
+        for cell in eaten:
+            self.food.discard(cell)
+            self.hash ^= keys.food[cell]
+        constrictor = self.ruleset.constrictor
+        if eaten or constrictor:
+            for entry in moved:
+                snake, cell = entry[0], entry[1]
+                if cell in eaten or (constrictor and cell >= 0):
+                    body = self.bodies[snake]
+                    length = len(body)
+                    body.append(body[-1])
+                    occupied[body[-1]] += 1
+                    self.hash ^= keys.body[snake][body[-1]] ^ keys.length[snake][length] ^ keys.length[snake][length + 1]
+                    self._set_health(snake, FULL_HEALTH)
+                    entry[4] = True
+
+        eliminated = []
+        for snake, cell, _, _, _ in moved:
+            if cell < 0 or self.health[snake] <= 0:
+                eliminated.append(snake)
+                continue
+            on_cell = heads[cell]
+            # Every head on the cell counts once, anything above that is a body segment
+            if occupied[cell] > len(on_cell):
+                eliminated.append(snake)
+                continue
+            if len(on_cell) > 1:
+                length = len(self.bodies[snake])
+                if any(len(self.bodies[other]) >= length for other in on_cell if other != snake):
+                    eliminated.append(snake)
+        for snake in eliminated:
+            self.hash ^= self.snake_hash(snake)
+            self.alive[snake] = False
+            for segment in self.bodies[snake]:
+                occupied[segment] -= 1
+
+        return (moved, eaten, eliminated, previous_hash)
+
+    def undo_step(self, record: tuple) -> None:
+        moved, eaten, eliminated, self.hash = record
+        occupied = self.occupied
+        for snake in eliminated:
+            self.alive[snake] = True
+            for segment in self.bodies[snake]:
+                occupied[segment] += 1
+        self.food.update(eaten)
+        for snake, cell, tail, health, grew in reversed(moved):
+            self.health[snake] = health
+            if cell < 0:
+                continue
+            body = self.bodies[snake]
+            if grew:
+                occupied[body.pop()] -= 1
+            body.popleft()
+            occupied[cell] -= 1
+            body.append(tail)
+            occupied[tail] += 1
+
+    def _set_health(self, snake: int, health: int) -> None:
+        health_keys = self.keys.health[snake]
+        self.hash ^= health_keys[max(self.health[snake], 0)] ^ health_keys[max(health, 0)]
+        self.health[snake] = health
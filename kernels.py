@@ -0,0 +1,169 @@
+from functools import lru_cache
+from typing import List
+
+from floodfill import free_after
+from game_state import GameState, adjacent_table
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, weight_for_food falls back to the scalar functions
+    np = None
+"""
+Batched NumPy versions of the food and enemy weights.
+
+Instead of looping over every food and snake for every candidate move, the
+candidate positions, food and enemy heads become arrays and all the distances
+are computed in one go. The results are the same numbers weight_by_min,
+weight_by_max, weight_by_sum and weight_enemies give.
+
+path_distances has the real distances on the board, a BFS around the bodies
+that are still there when we'd get to them, for every start cell at once. No
+weight uses it yet, they keep the squared Euclidean distances above.
+"""
+
+UNREACHABLE = -1
+# Same as server_logic.relative_movement, as (x, y)
+OFFSETS = {"up": (0, 1), "down": (0, -1), "right": (1, 0), "left": (-1, 0)}
+
+
+def available() -> bool:
+    return np is not None
+
+
+def candidate_positions(head: dict, possible_moves: List[str]):
+    offsets = np.array([OFFSETS[move] for move in possible_moves], dtype=np.int64).reshape(-1, 2)
+    return offsets + np.array([head['x'], head['y']], dtype=np.int64)
+
+
+def points_array(points: List[dict]):
+    return np.array([[point['x'], point['y']] for point in points], dtype=np.int64).reshape(-1, 2)
+
+
+def squared_distances(positions, points):
+    """(moves x points) matrix of distance_between for every pair"""
+    difference = positions[:, None, :] - points[None, :, :]
+    return (difference ** 2).sum(axis=2)
+
+
+def weights_by_min(distances):
+    if not distances.shape[1]:
+        return np.ones(distances.shape[0], dtype=np.int64)
+    return distances.min(axis=1)
+
+
+def weights_by_max(distances):
+    if not distances.shape[1]:
+        return np.ones(distances.shape[0], dtype=np.int64)
+    # weight_by_max goes negative at the first food further than the first one,
+    # after that every food replaces it, so it ends up as minus the last distance
+    further = (distances[:, 1:] > distances[:, :1]).any(axis=1)
+    return np.where(further, -distances[:, -1], distances[:, 0])
+
+
+def weights_by_sum(distances):
+    return distances.sum(axis=1) - 10000000 * (distances == 0).sum(axis=1)
+
+
+def weights_enemies(positions, data: dict):
+    enemies = [snake for snake in data['board']['snakes'] if snake['id'] != data['you']['id']]
+    if not enemies:
+        return np.zeros(len(positions), dtype=np.int64)
+    heads = points_array([snake['head'] for snake in enemies])
+    bigger = np.array([snake['length'] >= data['you']['length'] for snake in enemies])
+    reach = np.abs(positions[:, None, :] - heads[None, :, :]).sum(axis=2) <= 1
+    return (reach * np.where(bigger, 100, -50)).sum(axis=1)
+
+
+def food_and_enemy_weights(head: dict, possible_moves: List[str], food_data: List[dict], data: dict,
+                           get_food_now: bool) -> List[int]:
+    """The food + enemy part of weight_for_food for every move at once"""
+    positions = candidate_positions(head, possible_moves)
+    distances = squared_distances(positions, points_array(food_data))
+    weights = weights_by_min(distances) if get_food_now else weights_by_max(distances)
+    return (weights + weights_enemies(positions, data)).tolist()
+
+
+def batched_food_and_enemy_weights(batch: List[tuple]) -> List[List[int]]:
+    """
+    food_and_enemy_weights for several games in one go, batch holds the same
+    (head, possible_moves, food_data, data, get_food_now) arguments for each.
+    Moves, food and enemy heads are padded to the longest game and masked out.
+    """
+    if not batch:
+        return []
+    games = len(batch)
+    most_moves = max(max(len(moves) for _, moves, _, _, _ in batch), 1)
+    most_food = max(max(len(food) for _, _, food, _, _ in batch), 1)
+    enemies = [[snake for snake in data['board']['snakes'] if snake['id'] != data['you']['id']]
+               for _, _, _, data, _ in batch]
+    most_enemies = max(max(len(game) for game in enemies), 1)
+
+    positions = np.zeros((games, most_moves, 2), dtype=np.int64)
+    food = np.zeros((games, most_food, 2), dtype=np.int64)
+    food_count = np.zeros(games, dtype=np.int64)
+    heads = np.zeros((games, most_enemies, 2), dtype=np.int64)
+    enemy_weight = np.zeros((games, most_enemies), dtype=np.int64)
+    food_now = np.zeros(games, dtype=bool)
+    for game, (head, moves, food_data, data, get_food_now) in enumerate(batch):
+        if moves:
+            positions[game, :len(moves)] = candidate_positions(head, moves)
+        if food_data:
+            food[game, :len(food_data)] = points_array(food_data)
+        food_count[game] = len(food_data)
+        for index, snake in enumerate(enemies[game]):
+            heads[game, index] = (snake['head']['x'], snake['head']['y'])
+            enemy_weight[game, index] = 100 if snake['length'] >= data['you']['length'] else -50
+        food_now[game] = get_food_now
+
+    real_food = np.arange(most_food)[None, :] < food_count[:, None]
+    distances = ((positions[:, :, None, :] - food[:, None, :, :]) ** 2).sum(axis=3)
+    nearest = np.where(real_food[:, None, :], distances, np.iinfo(np.int64).max).min(axis=2)
+    # Same as weights_by_max: minus the last distance if any food is further than the first
+    first = distances[:, :, 0]
+    last = np.take_along_axis(distances, np.maximum(food_count - 1, 0)[:, None, None], axis=2)[:, :, 0]
+    further = ((distances[:, :, 1:] > first[:, :, None]) & real_food[:, None, 1:]).any(axis=2)
+    furthest = np.where(further, -last, first)
+    weights = np.where(food_now[:, None], nearest, furthest)
+    weights = np.where((food_count > 0)[:, None], weights, 1)
+    # Padded enemies have weight 0, they add nothing wherever they are
+    reach = np.abs(positions[:, :, None, :] - heads[:, None, :, :]).sum(axis=3) <= 1
+    weights = weights + (reach * enemy_weight[:, None, :]).sum(axis=2)
+    return [weights[game, :len(moves)].tolist() for game, (_, moves, _, _, _) in enumerate(batch)]
+
+
+
+@lru_cache(maxsize=None)
+def neighbor_array(width: int, height: int, wrapped: bool = False):
+    """adjacent_table as a (cells x 4) array, missing neighbours point at an extra cell past the board"""
+    cells = width * height
+    neighbors = np.full((cells, 4), cells, dtype=np.int64)
+    for cell, adjacent in enumerate(adjacent_table(width, height, wrapped)):
+        neighbors[cell, :len(adjacent)] = adjacent
+    return neighbors
+
+
+def path_distances(state: GameState, cells: List[int], targets: List[int]):
+    """
+    (cells x targets) matrix of BFS path lengths from each cell to each target,
+    going around bodies that are still there when we'd get to them.
+    UNREACHABLE where there's no path. All the searches grow one step at a time together.
+    """
+    free_at = np.array(free_after(state), dtype=np.int64)
+    size = len(free_at)
+    neighbors = neighbor_array(state.width, state.height, state.ruleset.wrapped)
+    starts = np.array(cells, dtype=np.int64).reshape(-1)
+    # One column more for the cell past the board, never reached
+    reached = np.zeros((len(starts), size + 1), dtype=bool)
+    rows = np.flatnonzero((starts >= 0) & (free_at[np.maximum(starts, 0)] <= 1))
+    reached[rows, starts[rows]] = True
+    distances = np.where(reached, 0, UNREACHABLE)
+    frontier = reached.copy()
+    distance = 0
+    while frontier.any():
+        distance += 1
+        # Steps are counted from the start cell, which we reach next turn
+        step = frontier[:, neighbors].any(axis=2) & ~reached[:, :size] & (free_at <= distance + 1)
+        frontier[:, :size] = step
+        reached[:, :size] |= step
+        distances[:, :size][step] = distance
+    return distances[:, np.array(targets, dtype=np.int64).reshape(-1)]
@@ -0,0 +1,202 @@
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+import urllib.parse
+from typing import Dict, List, NamedTuple
+
+import arena
+from game_state import MOVES
+from policies import first_safe_policy
+"""
+Load generator: how many games at once one server keeps under the timeout.
+
+Every simulated game plays /start, a /move per turn and /end against the
+server, like the engine does, with the server's snake against opponents
+moved by first_safe_policy on the client side. Concurrency ramps up level by
+level, at each level that many games run back to back for a few seconds, and
+the report has throughput, p50/p95/p99 latency and the share of moves that
+missed the timeout (or failed, a failed /start counts as one of those too) for
+every board size:
+
+    python loadtest.py http://localhost:8080 --concurrency 1,4,16,64 --seconds 20
+    python loadtest.py local --concurrency 1,2,4
+
+"local" calls the Flask app of server.py in this process with its test client,
+no network involved, and the load generator shares the GIL with the server.
+"""
+
+SIZES = (7, 11, 19)
+CONCURRENCY = (1, 2, 4, 8, 16)
+SECONDS = 10
+PLAYERS = 4
+
+
+class Sample(NamedTuple):
+    size: int
+    latency_ms: float
+    timed_out: bool
+
+
+class HttpClient:
+    """One keep-alive connection, every game thread gets its own"""
+
+    def __init__(self, url: str, timeout_ms: int):
+        parsed = urllib.parse.urlparse(url)
+        self.path = parsed.path.rstrip("/")
+        self.connection = http.client.HTTPConnection(parsed.netloc, timeout=timeout_ms / 1000 * 2)
+
+    def post(self, path: str, data: dict) -> bytes:
+        body = json.dumps(data)
+        try:
+            self.connection.request("POST", self.path + path, body, {'Content-Type': "application/json"})
+            response = self.connection.getresponse()
+            answer = response.read()
+        except (OSError, http.client.HTTPException):
+            # Reconnect on the next request
+            self.connection.close()
+            raise
+        if response.status != 200:
+            raise OSError(f"{path} answered {response.status}")
+        return answer
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class LocalClient:
+    def __init__(self, client):
+        self.client = client
+
+    def post(self, path: str, data: dict) -> bytes:
+        response = self.client.post(path, json=data)
+        if response.status_code != 200:
+            raise OSError(f"{path} answered {response.status_code}")
+        return response.data
+
+    def close(self) -> None:
+        pass
+
+
+def client_factory(target: str, timeout_ms: int):
+    if target != "local":
+        return lambda: HttpClient(target, timeout_ms)
+    # Only here, the HTTP mode doesn't need Flask installed
+    import server
+    return lambda: LocalClient(server.app.test_client())
+
+
+def play(client, game_id: str, size: int, players: int, timeout_ms: int, rng: random.Random,
+         stop: threading.Event, samples: List[Sample], max_turns: int = arena.MAX_TURNS) -> None:
+    """One game with the server playing snake 0, until it's over or `stop` is set"""
+    state = arena.new_game(players, size, rng)
+    latencies = [""] * players
+    started = time.perf_counter()
+    try:
+        client.post("/start", arena.request_data(state, 0, game_id, 0, timeout_ms, latencies))
+    except (OSError, http.client.HTTPException):
+        # The game goes on, like the engine's would
+        samples.append(Sample(size, (time.perf_counter() - started) * 1000, True))
+    turn = 0
+    while state.alive[0] and sum(state.alive) > 1 and turn < max_turns and not stop.is_set():
+        data = arena.request_data(state, 0, game_id, turn, timeout_ms, latencies)
+        started = time.perf_counter()
+        try:
+            move = json.loads(client.post("/move", data))['move']
+        except (OSError, http.client.HTTPException, ValueError, KeyError, TypeError):
+            move = None
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        failed = move not in MOVES
+        if failed:
+            # Counts as a timeout, a safe move keeps the game going
+            move = first_safe_policy(state, 0)
+        latencies[0] = str(int(elapsed_ms))
+        samples.append(Sample(size, elapsed_ms, failed or elapsed_ms > timeout_ms))
+        moves = [move] + [first_safe_policy(state, snake) if alive else None
+                          for snake, alive in enumerate(state.alive) if snake]
+        state.step(moves)
+        arena.spawn_food(state, rng)
+        turn += 1
+    try:
+        client.post("/end", arena.request_data(state, 0, game_id, turn, timeout_ms, latencies))
+    except (OSError, http.client.HTTPException):
+        pass
+
+
+def run_level(make_client, concurrency: int, seconds: float, sizes=SIZES, players: int = PLAYERS,
+              timeout_ms: int = arena.TIMEOUT_MS, seed: int = 0) -> List[Sample]:
+    """`concurrency` threads playing games back to back for `seconds`, the sizes taking turns"""
+    samples: List[Sample] = []
+    stop = threading.Event()
+
+    def games(worker: int) -> None:
+        rng = random.Random(seed * 1000 + worker)
+        client = make_client()
+        game = 0
+        try:
+            while not stop.is_set():
+                size = sizes[(worker + game) % len(sizes)]
+                play(client, f"load-{seed}-{concurrency}-{worker}-{game}", size, players, timeout_ms, rng, stop,
+                     samples)
+                game += 1
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=games, args=(worker,), name=f"load-{worker}", daemon=True)
+               for worker in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def summarize(samples: List[Sample], seconds: float) -> Dict[str, dict]:
+    """Per board size ("7x7", ...) and "all": moves, moves per second, latency percentiles and timeout rate"""
+    groups: Dict[str, List[Sample]] = {}
+    for sample in samples:
+        groups.setdefault(f"{sample.size}x{sample.size}", []).append(sample)
+    groups["all"] = samples
+    summary = {}
+    for name, group in groups.items():
+        latencies = [sample.latency_ms for sample in group]
+        summary[name] = {
+            'moves': len(group),
+            'moves_per_second': len(group) / seconds if seconds else 0.0,
+            'p50_ms': arena.percentile(latencies, 0.5),
+            'p95_ms': arena.percentile(latencies, 0.95),
+            'p99_ms': arena.percentile(latencies, 0.99),
+            'timeout_rate': sum(sample.timed_out for sample in group) / len(group) if group else 0.0,
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play many games at once against a snake server")
+    parser.add_argument("target", help="server URL, or local for server.py's app in this process")
+    parser.add_argument("--concurrency", default=",".join(map(str, CONCURRENCY)),
+                        help="games at once for every level of the ramp, comma separated")
+    parser.add_argument("--seconds", type=float, default=SECONDS, help="how long every level runs")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="board sizes, comma separated")
+    parser.add_argument("--players", type=int, default=PLAYERS)
+    parser.add_argument("--timeout", type=int, default=arena.TIMEOUT_MS, help="game timeout in ms")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    levels = [int(level) for level in args.concurrency.split(",")]
+    sizes = tuple(int(size) for size in args.sizes.split(","))
+    make_client = client_factory(args.target, args.timeout)
+    for level in levels:
+        samples = run_level(make_client, level, args.seconds, sizes, args.players, args.timeout, args.seed)
+        for name, result in summarize(samples, args.seconds).items():
+            print(f"{level:>4} games {name:>7}: {result['moves']} moves, {result['moves_per_second']:.1f} moves/s, "
+                  f"p50 {result['p50_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms, "
+                  f"{result['timeout_rate']:.1%} over the timeout")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import atexit
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional, TextIO
+"""
+Structured logs: one JSON object per line with the event name, its level, a
+timestamp and whatever fields the caller passes (game id, turn, move, depth,
+nodes, elapsed ms for every move).
+
+Logging a line only builds a dict and puts it in a queue, a background thread
+does the JSON encoding and the writes, so a slow stdout never holds up /move.
+When the queue is full lines are dropped (and counted in `dropped`) instead of
+waiting. SNAKE_LOG_LEVEL (debug, info, warning or error, default info) drops
+lower levels before anything is built, and SNAKE_LOG_SAMPLE keeps that fraction
+of the per-move lines, the ones logged with sampled=True. disabled() silences
+one thread, the warm-up's fake games don't belong in the logs.
+"""
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+LEVEL_NAMES = {number: name for name, number in LEVELS.items()}
+
+LEVEL = LEVELS.get(os.environ.get("SNAKE_LOG_LEVEL", "info").lower(), INFO)
+SAMPLE = float(os.environ.get("SNAKE_LOG_SAMPLE", "1"))
+QUEUE_SIZE = 10000
+
+
+class Logger:
+    def __init__(self, stream: Optional[TextIO] = None, level: int = LEVEL, sample: float = SAMPLE,
+                 queue_size: int = QUEUE_SIZE):
+        # None writes to whatever sys.stdout is at the time
+        self.stream = stream
+        self.level = level
+        self.sample = sample
+        self.queue_size = queue_size
+        self.queue = queue.Queue(queue_size)
+        self.dropped = 0
+        # The writer thread doesn't survive a fork, every process starts its own
+        self.pid = None
+        self.lock = threading.Lock()
+        # Per thread, see disabled()
+        self.local = threading.local()
+
+    def enabled(self, level: int) -> bool:
+        return level >= self.level and not getattr(self.local, "disabled", False)
+
+    @contextmanager
+    def disabled(self):
+        """Nothing logged from this thread inside the block gets written"""
+        disabled = getattr(self.local, "disabled", False)
+        self.local.disabled = True
+        try:
+            yield
+        finally:
+            self.local.disabled = disabled
+
+    def log(self, level: int, event: str, sampled: bool = False, **fields) -> None:
+        if level < self.level or getattr(self.local, "disabled", False):
+            return
+        if sampled and self.sample < 1 and random.random() >= self.sample:
+            return
+        if self.pid != os.getpid():
+            self.start()
+        line = {"time": time.time(), "level": level, "event": event}
+        line.update(fields)
+        try:
+            self.queue.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+
+    def debug(self, event: str, sampled: bool = False, **fields) -> None:
+        self.log(DEBUG, event, sampled, **fields)
+
+    def info(self, event: str, sampled: bool = False, **fields) -> None:
+        self.log(INFO, event, sampled, **fields)
+
+    def warning(self, event: str, sampled: bool = False, **fields) -> None:
+        self.log(WARNING, event, sampled, **fields)
+
+    def error(self, event: str, sampled: bool = False, **fields) -> None:
+        self.log(ERROR, event, sampled, **fields)
+
+    def start(self) -> None:
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            if self.pid is not None:
+                # Forked with the parent's queue, whose lock might have been taken mid put
+                self.queue = queue.Queue(self.queue_size)
+            self.pid = os.getpid()
+            threading.Thread(target=self.write_lines, name="logs", daemon=True).start()
+
+    def write_lines(self) -> None:
+        """The writer thread: everything waiting in the queue goes out in one write"""
+        log_queue = self.queue
+        while True:
+            lines = [log_queue.get()]
+            try:
+                while True:
+                    lines.append(log_queue.get_nowait())
+            except queue.Empty:
+                pass
+            for line in lines:
+                line["level"] = LEVEL_NAMES.get(line["level"], line["level"])
+            try:
+                stream = self.stream or sys.stdout
+                stream.write("".join(json.dumps(line, default=str) + "\n" for line in lines))
+                stream.flush()
+            except Exception:  # a closed or broken stream loses the lines, it can't stop the server
+                self.dropped += len(lines)
+            for _ in lines:
+                log_queue.task_done()
+
+    def flush(self, timeout: float = 1.0) -> bool:
+        """Waits until the writer is done with what's been logged, False if it took longer than `timeout`"""
+        if self.pid != os.getpid():
+            return True
+        log_queue = self.queue
+        deadline = time.monotonic() + timeout
+        with log_queue.all_tasks_done:
+            while log_queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                log_queue.all_tasks_done.wait(remaining)
+        return True
+
+
+logger = Logger()
+atexit.register(logger.flush)
@@ -0,0 +1,165 @@
+import math
+import random
+import time
+from typing import Dict, List, Optional
+
+import logs
+from game_state import GameState, MOVES
+from policies import Policy, random_policy, safe_moves_for
+"""
+Monte Carlo Tree Search engine, an alternative to the safety lookahead.
+
+The tree only branches on our own moves ("open loop"): the other snakes move
+with the playout policy every time a node is walked, so a node stands for a
+sequence of our moves rather than one exact position. That's also what lets us
+keep the tree between /move calls of the same game: after our move, the child
+for that move becomes the new root.
+"""
+
+EXPLORATION = 1.4
+# Turns simulated from the root, tree and playout together
+HORIZON = 20
+
+
+class Node:
+    __slots__ = ("children", "visits", "value")
+
+    def __init__(self):
+        self.children: Dict[str, "Node"] = {}
+        self.visits = 0
+        self.value = 0.0
+
+
+class MCTS:
+    def __init__(self, rng: Optional[random.Random] = None, playout_policy: Optional[Policy] = None,
+                 exploration: float = EXPLORATION, horizon: int = HORIZON):
+        self.rng = rng or random.Random()
+        self.playout_policy = playout_policy or random_policy(self.rng)
+        self.exploration = exploration
+        self.horizon = horizon
+        self.root = Node()
+        # Turn the root stands for, to know if the tree can be reused on the next call
+        self.turn = -1
+        self.playouts = 0
+        self.elapsed = 0.0
+
+    def run(self, state: GameState, deadline: float, max_playouts: Optional[int] = None) -> None:
+        started = time.perf_counter()
+        playouts = 0
+        while time.perf_counter() < deadline and (max_playouts is None or playouts < max_playouts):
+            self.iterate(state)
+            playouts += 1
+        self.playouts = playouts
+        self.elapsed = time.perf_counter() - started
+
+    def iterate(self, state: GameState) -> None:
+        you = state.you
+        node = self.root
+        path = [node]
+        records = []
+        # Selection, walking down while every move of the node has been tried
+        while state.alive[you] and len(records) < self.horizon and self.opponents_alive(state):
+            moves = self.our_moves(state)
+            untried = [move for move in moves if move not in node.children]
+            if untried:
+                # Expansion
+                move = self.rng.choice(untried)
+                node.children[move] = Node()
+                records.append(state.step(self.turn_moves(state, move)))
+                node = node.children[move]
+                path.append(node)
+                break
+            move = self.select(node, moves)
+            records.append(state.step(self.turn_moves(state, move)))
+            node = node.children[move]
+            path.append(node)
+
+        reward = self.playout(state, len(records))
+        for record in reversed(records):
+            state.undo_step(record)
+        for visited in path:
+            visited.visits += 1
+            visited.value += reward
+
+    def select(self, node: Node, moves: List[str]) -> str:
+        log_visits = math.log(node.visits or 1)
+        best_move, best_score = moves[0], -1.0
+        for move in moves:
+            child = node.children[move]
+            score = child.value / child.visits + self.exploration * math.sqrt(log_visits / child.visits)
+            if score > best_score:
+                best_move, best_score = move, score
+        return best_move
+
+    def playout(self, state: GameState, turns: int) -> float:
+        """Plays on with the playout policy for everyone and scores the result for us"""
+        you = state.you
+        records = []
+        while state.alive[you] and turns + len(records) < self.horizon and self.opponents_alive(state):
+            moves = [self.playout_policy(state, snake) if alive else None for snake, alive in enumerate(state.alive)]
+            records.append(state.step(moves))
+        reward = self.reward(state, turns + len(records))
+        for record in reversed(records):
+            state.undo_step(record)
+        return reward
+
+    def reward(self, state: GameState, turns: int) -> float:
+        if not state.alive[state.you]:
+            # Dying later is better than dying sooner, but always worse than living
+            return 0.5 * (turns - 1) / self.horizon
+        opponents = len(state.alive) - 1
+        if not opponents:
+            return 1.0
+        dead = opponents - sum(state.alive) + 1
+        return 0.75 + 0.25 * dead / opponents
+
+    def our_moves(self, state: GameState) -> List[str]:
+        moves = [move for move, _ in safe_moves_for(state, state.you)]
+        return moves or list(MOVES)
+
+    def turn_moves(self, state: GameState, move: str) -> List[Optional[str]]:
+        return [
+            move if snake == state.you else (self.playout_policy(state, snake) if alive else None)
+            for snake, alive in enumerate(state.alive)
+        ]
+
+    @staticmethod
+    def opponents_alive(state: GameState) -> bool:
+        return sum(state.alive) > 1 or len(state.alive) == 1
+
+    def best_move(self) -> Optional[str]:
+        if not self.root.children:
+            return None
+        return max(self.root.children.items(), key=lambda item: item[1].visits)[0]
+
+    def advance(self, move: str) -> None:
+        self.root = self.root.children.get(move) or Node()
+        self.turn += 1
+
+    def stats(self) -> dict:
+        return {
+            'playouts': self.playouts,
+            'elapsed_ms': self.elapsed * 1000,
+            'playouts_per_second': self.playouts / self.elapsed if self.elapsed else 0.0,
+            'root_visits': self.root.visits,
+        }
+
+
+def choose_move(game, data: dict, state: GameState, deadline: float) -> Optional[str]:
+    """
+    Runs the game's tree until the deadline. `game` is the game_cache.GameContext,
+    its tree is kept for the next turn so it can start from the subtree we already have.
+    """
+    game_id = data['game']['id']
+    tree = game.mcts
+    if tree is None or tree.turn != data['turn']:
+        tree = game.mcts = MCTS()
+        tree.turn = data['turn']
+
+    tree.run(state, deadline)
+    move = tree.best_move()
+    stats = tree.stats()
+    if move is not None:
+        tree.advance(move)
+    logs.logger.debug("mcts", sampled=True, game=game_id, turn=data['turn'], move=move, **stats)
+    return move
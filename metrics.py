@@ -0,0 +1,165 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+"""
+Latency and search counters, exposed by server.py on /metrics in the Prometheus
+text format.
+
+Turned on with SNAKE_METRICS=1. When it's off every timer is the same do-nothing
+context manager and observe()/inc() return right away, so leaving the calls in
+the hot path costs next to nothing. disabled() turns it off for one thread only,
+for work that isn't serving a game, like the warm-up.
+
+Metrics live in the process, with several gunicorn workers each one reports its own.
+"""
+
+ENABLED = os.environ.get("SNAKE_METRICS", "0") == "1"
+
+# Seconds, from half a millisecond to a whole (too slow) second
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+COUNT_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000)
+
+# Per thread, see disabled()
+_local = threading.local()
+
+
+def enabled() -> bool:
+    return ENABLED and not getattr(_local, "disabled", False)
+
+
+@contextmanager
+def disabled():
+    """Nothing is recorded from this thread inside the block, other threads carry on"""
+    was_disabled = getattr(_local, "disabled", False)
+    _local.disabled = True
+    try:
+        yield
+    finally:
+        _local.disabled = was_disabled
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+                 label: Optional[str] = None):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.label = label
+        # label value -> [bucket counts..., over the last bucket, sum, count]
+        self.series: Dict[str, list] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, label_value: str = "") -> None:
+        if not enabled():
+            return
+        with self.lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = self.series[label_value] = [0] * (len(self.buckets) + 3)
+            series[bisect_left(self.buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for label_value, series in sorted(self.series.items()):
+                labels = f'{self.label}="{label_value}",' if self.label else ""
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+                lines.append(f'{self.name}_bucket{{{labels}le="+Inf"}} {series[-1]}')
+                braces = f"{{{labels[:-1]}}}" if labels else ""
+                lines.append(f"{self.name}_sum{braces} {series[-2]}")
+                lines.append(f"{self.name}_count{braces} {series[-1]}")
+        return "\n".join(lines)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        if not enabled():
+            return
+        with self.lock:
+            self.value += amount
+
+    def render(self) -> str:
+        return f"# HELP {self.name} {self.help_text}\n# TYPE {self.name} counter\n{self.name} {self.value}"
+
+
+class Gauge:
+    """A value read when /metrics is rendered, like a cache's size"""
+
+    def __init__(self, name: str, help_text: str, read):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def render(self) -> str:
+        return f"# HELP {self.name} {self.help_text}\n# TYPE {self.name} gauge\n{self.name} {self.read()}"
+
+
+class _Timer:
+    __slots__ = ("histogram", "label_value", "started")
+
+    def __init__(self, histogram: Histogram, label_value: str):
+        self.histogram = histogram
+        self.label_value = label_value
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, self.label_value)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(histogram: Histogram, label_value: str = ""):
+    """with timer(PHASE_SECONDS, "parse"): ... records how long the block took"""
+    if not enabled():
+        return _NULL_TIMER
+    return _Timer(histogram, label_value)
+
+
+PHASE_SECONDS = Histogram("snake_phase_seconds", "Time spent in each phase of a /move", label="phase")
+DEPTH_SECONDS = Histogram("snake_search_depth_seconds", "Time spent on each iterative deepening depth",
+                          label="depth")
+MOVE_SECONDS = Histogram("snake_move_seconds", "Total time choose_move took")
+MOVE_NODES = Histogram("snake_search_nodes", "Search nodes visited per move", COUNT_BUCKETS)
+NODES = Counter("snake_search_nodes_total", "Search nodes visited")
+TABLE_HITS = Counter("snake_tt_hits_total", "Transposition table hits")
+TABLE_MISSES = Counter("snake_tt_misses_total", "Transposition table misses")
+DEADLINE_STOPS = Counter("snake_search_timeouts_total", "Searches stopped by the deadline")
+POSITION_HITS = Counter("snake_position_cache_hits_total", "Moves found in the position cache")
+POSITION_MISSES = Counter("snake_position_cache_misses_total", "Position cache lookups that found nothing")
+
+# Gauges get added by the modules whose state they read
+REGISTRY = [PHASE_SECONDS, DEPTH_SECONDS, MOVE_SECONDS, MOVE_NODES, NODES, TABLE_HITS, TABLE_MISSES,
+            DEADLINE_STOPS, POSITION_HITS, POSITION_MISSES]
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
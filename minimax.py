@@ -0,0 +1,154 @@
+import math
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from floodfill import free_after, voronoi
+from game_state import GameState
+from search import SearchTimeout
+"""
+Alpha-beta minimax for endgames with few snakes left.
+
+Moves are simultaneous, so every turn is searched as our move (max) followed by
+each opponent's move (min) and only then resolved with GameState.step. With more
+than one opponent the search is "paranoid": every opponent is assumed to play
+against us, which turns the game back into a two player one.
+
+Children are ordered by killer moves (the last move that caused a cutoff at the
+same ply) and a history table, and the root moves come in the order of the
+weight_for_food heuristic.
+"""
+
+# Run when at most this many snakes (us included) are alive, 0 turns it off
+MAX_SNAKES = int(os.environ.get("SNAKE_MINIMAX_SNAKES", "3"))
+MAX_DEPTH = 20
+WIN = 1_000_000
+TERRITORY_WEIGHT = 10
+LENGTH_WEIGHT = 30
+
+
+def applies(state: GameState) -> bool:
+    return 2 <= sum(state.alive) <= MAX_SNAKES
+
+
+class Minimax:
+    def __init__(self, state: GameState, deadline: Optional[float] = None):
+        self.state = state
+        self.deadline = deadline
+        self.nodes = 0
+        self.killers: Dict[int, str] = {}
+        self.history: Dict[Tuple[int, str], int] = {}
+        self.opponents = [snake for snake, alive in enumerate(state.alive) if alive and snake != state.you]
+
+    def search(self, root_moves: List[str], max_depth: int = MAX_DEPTH) -> Tuple[Optional[str], int, float]:
+        """
+        Iterative deepening over whole turns. Returns the best move of the deepest
+        finished iteration, that depth and its score.
+        """
+        best_move, best_depth, best_score = None, 0, -math.inf
+        moves = list(root_moves)
+        for depth in range(1, max_depth + 1):
+            try:
+                move, score = self.root(moves, depth)
+            except SearchTimeout:
+                break
+            best_move, best_depth, best_score = move, depth, score
+            # Look at the best move first next time, it makes the cutoffs come sooner
+            moves.remove(move)
+            moves.insert(0, move)
+            if abs(score) >= WIN - MAX_DEPTH:
+                # Won or lost for sure, deeper won't change that
+                break
+        return best_move, best_depth, best_score
+
+    def root(self, moves: List[str], depth: int) -> Tuple[str, float]:
+        alpha = -math.inf
+        best_move = moves[0]
+        for move in moves:
+            score = self.min_node(move, 0, [None] * len(self.state.alive), depth, alpha, math.inf, 0)
+            if score > alpha:
+                alpha, best_move = score, move
+        return best_move, alpha
+
+    def max_node(self, depth: int, alpha: float, beta: float, ply: int) -> float:
+        state = self.state
+        terminal = self.terminal(ply)
+        if terminal is not None:
+            return terminal
+        if depth == 0:
+            return self.evaluate()
+        value = -math.inf
+        for move in self.ordered(state.you, ply):
+            value = max(value, self.min_node(move, 0, [None] * len(state.alive), depth, alpha, beta, ply))
+            if value >= beta:
+                self.cutoff(state.you, move, depth, ply)
+                return value
+            alpha = max(alpha, value)
+        return value
+
+    def min_node(self, our_move: str, index: int, moves: List[Optional[str]], depth: int,
+                 alpha: float, beta: float, ply: int) -> float:
+        state = self.state
+        if index == len(self.opponents):
+            moves[state.you] = our_move
+            self.nodes += 1
+            # Every turn, unlike the lookahead: one leaf here costs a full board Voronoi
+            if self.deadline is not None and time.perf_counter() > self.deadline:
+                raise SearchTimeout()
+            record = state.step(moves)
+            try:
+                return self.max_node(depth - 1, alpha, beta, ply + 1)
+            finally:
+                state.undo_step(record)
+
+        snake = self.opponents[index]
+        if not state.alive[snake]:
+            return self.min_node(our_move, index + 1, moves, depth, alpha, beta, ply)
+        value = math.inf
+        for move in self.ordered(snake, ply):
+            moves[snake] = move
+            value = min(value, self.min_node(our_move, index + 1, moves, depth, alpha, beta, ply))
+            if value <= alpha:
+                self.cutoff(snake, move, depth, ply)
+                break
+            beta = min(beta, value)
+        moves[snake] = None
+        return value
+
+    def ordered(self, snake: int, ply: int) -> List[str]:
+        """Moves that stay on the board, killer move first, then by history, then free cells first"""
+        state = self.state
+        killer = self.killers.get(ply) if snake == state.you else None
+        history = self.history
+
+        def key(option):
+            move, cell = option
+            return (move != killer, -history.get((snake, move), 0), not state.is_free(cell))
+
+        options = sorted(state.neighbors[state.head(snake)], key=key)
+        return [move for move, _ in options] or ["up"]
+
+    def cutoff(self, snake: int, move: str, depth: int, ply: int) -> None:
+        if snake == self.state.you:
+            self.killers[ply] = move
+        self.history[(snake, move)] = self.history.get((snake, move), 0) + depth * depth
+
+    def terminal(self, ply: int) -> Optional[float]:
+        state = self.state
+        opponents_alive = any(state.alive[snake] for snake in self.opponents)
+        if not state.alive[state.you]:
+            # Dying later beats dying sooner, a draw beats both
+            return 0 if not opponents_alive else -WIN + ply
+        if not opponents_alive:
+            return WIN - ply
+        return None
+
+    def evaluate(self) -> float:
+        state = self.state
+        territory = voronoi(state, free_after(state))
+        alive = [snake for snake in self.opponents if state.alive[snake]]
+        our_length = len(state.bodies[state.you])
+        return (
+            TERRITORY_WEIGHT * (territory[state.you] - max(territory[snake] for snake in alive))
+            + LENGTH_WEIGHT * (our_length - max(len(state.bodies[snake]) for snake in alive))
+        )
@@ -0,0 +1,174 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+
+from game_state import GameState
+from policies import get_policy
+from search import MAX_DEPTH, Search, SearchTimeout
+from transposition import TranspositionTable
+"""
+Optional process pool that evaluates the root moves of the safety lookahead in
+parallel, one move per worker, so we're not stuck on a single core by the GIL.
+
+The pool is started once at server boot (set SNAKE_WORKERS) and warmed up so the
+first move doesn't pay for forking and imports. Deadlines travel as wall clock
+time, every worker converts it to its own perf_counter deadline. With more root
+moves than workers the moves queue up, so each one only gets its slot of the
+time: the budget over the rounds it takes the workers to get through them all.
+"""
+
+WORKERS = int(os.environ.get("SNAKE_WORKERS", "0"))
+# Extra time we wait for workers after the deadline before giving up on them
+DEADLINE_SLACK = 0.005
+
+_pool: Optional[ProcessPoolExecutor] = None
+_workers = 0
+
+
+def _warm_up_worker() -> int:
+    # Builds the Zobrist keys for the usual board sizes so the first search in this worker is hot
+    for size in (7, 11, 19):
+        data = {
+            'game': {'ruleset': {}},
+            'board': {'width': size, 'height': size, 'food': [], 'hazards': [], 'snakes': [
+                {'id': 'warm-up', 'health': 100, 'body': [{'x': 0, 'y': 0}]},
+            ]},
+            'you': {'id': 'warm-up'},
+        }
+        state = GameState.from_data(data)
+        Search(state).safe_moves(state.head(state.you), ["up", "right"], 3)
+    return os.getpid()
+
+
+def start_pool(workers: int = WORKERS) -> bool:
+    global _pool, _workers
+    if _pool is not None or workers < 1:
+        return _pool is not None
+    _pool = ProcessPoolExecutor(max_workers=workers)
+    _workers = workers
+    # One warm up per worker, waiting for them forces every process to start now
+    wait([_pool.submit(_warm_up_worker) for _ in range(workers)])
+    return True
+
+
+def stop_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def pool_running() -> bool:
+    return _pool is not None
+
+
+def survival_depth(data: dict, move: str, wall_deadline: float, opponent_policy: Optional[str] = None,
+                   max_depth: int = MAX_DEPTH, seconds: Optional[float] = None) -> Tuple[str, int]:
+    """
+    Runs in a worker: how many turns our snake lasts after `move`, deepening
+    until it dies, reaches max_depth or runs out of time. That's `seconds` from
+    when the worker picks it up, never past `wall_deadline`.
+    """
+    deadline = time.perf_counter() + (wall_deadline - time.time())
+    if seconds is not None:
+        deadline = min(deadline, time.perf_counter() + seconds)
+    survived, _ = deepen(local_search(data, opponent_policy, deadline), move, max_depth)
+    return move, survived
+
+
+def local_search(data: dict, opponent_policy: Optional[str], deadline: float) -> Search:
+    policy = get_policy(opponent_policy) if opponent_policy else None
+    return Search(GameState.from_data(data), deadline, TranspositionTable(), policy)
+
+
+def deepen(search: Search, move: str, max_depth: int = MAX_DEPTH) -> Tuple[int, bool]:
+    """How many turns `move` survives, and True if that's because it dies then (not max_depth or the clock)"""
+    state = search.state
+    head = state.head(state.you)
+    survived = 0
+    for depth in range(1, max_depth + 1):
+        try:
+            if not search.survives(head, move, depth):
+                return survived, True
+        except SearchTimeout:
+            break
+        survived = depth
+    return survived, False
+
+
+def parallel_safe_moves(data: dict, possible_moves: List[str], deadline: float,
+                        opponent_policy: Optional[str] = None) -> Tuple[List[str], int]:
+    """
+    Same answer shape as Search.iterative_deepening: the moves that last the longest
+    and how many turns that is. Moves whose worker misses the deadline are
+    cancelled, see settle() for what happens to them.
+    """
+    return batch_safe_moves([(data, possible_moves, deadline)], opponent_policy)[0]
+
+
+def batch_safe_moves(jobs: List[Tuple[dict, List[str], float]],
+                     opponent_policy: Optional[str] = None) -> List[Tuple[List[str], int]]:
+    """
+    parallel_safe_moves for several games at once, (data, possible_moves, deadline)
+    each: every root move of every game goes to the pool in one dispatch and we
+    wait once, for the latest deadline.
+    """
+    now = time.perf_counter()
+    # How many times over the workers have to go through the queue
+    rounds = max(-(-sum(len(possible_moves) for _, possible_moves, _ in jobs) // _workers), 1)
+    futures = []
+    for data, possible_moves, deadline in jobs:
+        wall_deadline = time.time() + (deadline - now)
+        seconds = max(deadline - now, 0) / rounds
+        futures.append([_pool.submit(survival_depth, data, move, wall_deadline, opponent_policy, MAX_DEPTH, seconds)
+                        for move in possible_moves])
+    latest = max((deadline for _, _, deadline in jobs), default=time.perf_counter())
+    done, late = wait([future for game in futures for future in game],
+                      timeout=max(latest - time.perf_counter(), 0) + DEADLINE_SLACK)
+    for future in late:
+        future.cancel()
+
+    results = []
+    for (data, possible_moves, _), game in zip(jobs, futures):
+        depths = dict(future.result() for future in game if future in done)
+        results.append(settle(data, possible_moves, depths, opponent_policy))
+    return results
+
+
+def settle(data: dict, possible_moves: List[str], depths: Dict[str, int],
+           opponent_policy: Optional[str] = None) -> Tuple[List[str], int]:
+    """
+    The best moves from the `depths` the workers came back with. A game none of
+    whose moves got a worker in time is searched here instead, shallow, rather
+    than coming back unfiltered. Single moves no worker got to get a quick look
+    here, and since that's cut short they stay unknown: kept next to the best
+    moves, at the best moves' depth, unless it sees them die first.
+    """
+    if not depths:
+        return local_safe_moves(data, possible_moves, opponent_policy)
+    best_depth = max(depths.values())
+    # Moves no worker got to: their look here is cut short, so they're kept unless it sees them die before the best
+    unknown: Dict[str, int] = {}
+    unevaluated = [move for move in possible_moves if move not in depths]
+    if unevaluated:
+        search = local_search(data, opponent_policy, time.perf_counter())
+        for move in unevaluated:
+            search.deadline = time.perf_counter() + DEADLINE_SLACK / len(unevaluated)
+            depth, died = deepen(search, move)
+            if depth >= best_depth or not died:
+                unknown[move] = depth
+    if not best_depth:
+        # Whatever the workers saw dies right away
+        surviving = [move for move in possible_moves if unknown.get(move)]
+        if not surviving:
+            return possible_moves, 0
+        return surviving, max(unknown[move] for move in surviving)
+    return [move for move in possible_moves if depths.get(move) == best_depth or move in unknown], best_depth
+
+
+def local_safe_moves(data: dict, possible_moves: List[str], opponent_policy: Optional[str] = None,
+                     seconds: float = DEADLINE_SLACK) -> Tuple[List[str], int]:
+    """Search.iterative_deepening in this process for `seconds`, one turn deep at least"""
+    search = local_search(data, opponent_policy, time.perf_counter() + seconds)
+    return search.iterative_deepening(search.state.head(search.state.you), possible_moves)
@@ -0,0 +1,63 @@
+import random
+from typing import Callable, Dict
+
+from game_state import GameState, MOVES
+"""
+Opponent policies: how we expect the other snakes to move when the search
+simulates whole turns with GameState.step.
+
+A policy takes the state and a snake index and returns that snake's move. The
+ones used inside the search should be deterministic, otherwise the same position
+can lead to different outcomes and the transposition table gets confused.
+"""
+
+Policy = Callable[[GameState, int], str]
+
+
+def safe_moves_for(state: GameState, snake: int):
+    return [(move, cell) for move, cell in state.neighbors[state.head(snake)] if state.is_free(cell)]
+
+
+def first_safe_policy(state: GameState, snake: int) -> str:
+    """The first move that doesn't hit anything right away"""
+    moves = safe_moves_for(state, snake)
+    return moves[0][0] if moves else "up"
+
+
+def greedy_food_policy(state: GameState, snake: int) -> str:
+    """A safe move that gets closest (Manhattan) to the nearest food"""
+    moves = safe_moves_for(state, snake)
+    if not moves:
+        return "up"
+    if not state.food:
+        return moves[0][0]
+    width = state.width
+
+    def food_distance(cell):
+        x, y = cell % width, cell // width
+        return min(abs(x - food % width) + abs(y - food // width) for food in state.food)
+
+    return min(moves, key=lambda option: food_distance(option[1]))[0]
+
+
+def random_policy(rng: random.Random = None) -> Policy:
+    """A random safe move. Meant for playouts, not for the lookahead"""
+    rng = rng or random.Random()
+
+    def policy(state: GameState, snake: int) -> str:
+        moves = safe_moves_for(state, snake)
+        return rng.choice(moves)[0] if moves else rng.choice(MOVES)
+
+    return policy
+
+
+POLICIES: Dict[str, Policy] = {
+    'first_safe': first_safe_policy,
+    'greedy': greedy_food_policy,
+}
+
+
+def get_policy(name: str) -> Policy:
+    if name == 'random':
+        return random_policy()
+    return POLICIES[name]
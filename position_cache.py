@@ -0,0 +1,116 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional, Tuple
+
+import metrics
+from game_state import MOVE_INDEX, MOVES, GameState
+from symmetry import Symmetry, canonical_key, move_from_canonical, move_to_canonical, stable_hash
+"""
+Moves we already worked out, for every game this process plays.
+
+Positions are keyed by their canonical hash from symmetry.py, so a position
+and its rotations and reflections share one entry, and the move is stored in
+the canonical orientation and turned back for whoever looks it up. Unlike the
+transposition tables in game_cache this one isn't per game: the same openings
+and the same corners keep coming back in different games.
+
+It keeps at most SNAKE_POSITION_CACHE_ENTRIES positions (default 100000, 0
+turns it off), dropping the ones used least recently.
+"""
+
+MAX_ENTRIES = int(os.environ.get("SNAKE_POSITION_CACHE_ENTRIES", "100000"))
+# Roughly what an entry takes besides the dict slot: a 64 bit key and a (move, depth) tuple
+ENTRY_BYTES = sys.getsizeof(1 << 63) + sys.getsizeof((0, 0))
+
+
+def position_key(state: GameState, variant: tuple = ()) -> Tuple[int, Symmetry]:
+    """
+    The canonical key, mixed with `variant` for whatever else picks the move (the
+    arena plays engines and opponent policies against each other in one process)
+    """
+    key, symmetry = canonical_key(state)
+    return stable_hash((key,) + variant) if variant else key, symmetry
+
+
+class PositionCache:
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        # canonical key -> (index of the canonical move, depth it was searched to)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # gunicorn's threads share it
+        self.lock = threading.Lock()
+        # Per thread, see disabled()
+        self.local = threading.local()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and not getattr(self.local, "disabled", False)
+
+    @contextmanager
+    def disabled(self):
+        """Moves chosen in this thread inside the block neither use the cache nor go in it"""
+        disabled = getattr(self.local, "disabled", False)
+        self.local.disabled = True
+        try:
+            yield
+        finally:
+            self.local.disabled = disabled
+
+    def get(self, key: int, symmetry: Symmetry) -> Optional[Tuple[str, int]]:
+        """(move, depth) for the position in its own orientation, None if we don't have it"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        move, depth = entry
+        return move_from_canonical(MOVES[move], symmetry), depth
+
+    def put(self, key: int, symmetry: Symmetry, move: str, depth: int) -> None:
+        entry = (MOVE_INDEX[move_to_canonical(move, symmetry)], depth)
+        with self.lock:
+            stored = self.entries.get(key)
+            # A shallower search doesn't replace a deeper one
+            if stored is None or stored[1] <= depth:
+                self.entries[key] = entry
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def memory_bytes(self) -> int:
+        return sys.getsizeof(self.entries) + len(self.entries) * ENTRY_BYTES
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'memory_bytes': self.memory_bytes(),
+        }
+
+
+# Shared by every game this process plays
+positions = PositionCache()
+metrics.REGISTRY.append(metrics.Gauge("snake_position_cache_entries", "Positions in the position cache",
+                                      lambda: len(positions)))
+metrics.REGISTRY.append(metrics.Gauge("snake_position_cache_bytes", "Rough memory the position cache takes",
+                                      positions.memory_bytes))
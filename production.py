@@ -0,0 +1,64 @@
+import os
+
+import parallel
+import warmup
+"""
+Production serving for server.py: a gunicorn prefork server with threaded workers.
+
+Every worker is its own process, so a long search for one game can't hold up
+/move for the games handled by the others, and keep-alive connections from the
+engine are reused instead of reconnecting every turn. Run with `python server.py`
+as usual, it's used whenever gunicorn is installed and SNAKE_DEBUG isn't set.
+
+Keep in mind each worker has its own game_cache, a game whose moves land on
+different workers just gets fewer cache hits.
+"""
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # gunicorn is only in requirements.txt, server.py falls back to Flask's server
+    BaseApplication = None
+
+# Not os.cpu_count(): on a dyno that's the host's CPUs, and every worker keeps its own games' transposition
+# tables (up to SNAKE_GAME_CACHE_MB) and position cache. Heroku-style hosts size WEB_CONCURRENCY for the dyno
+DEFAULT_HTTP_WORKERS = 2
+HTTP_WORKERS = int(os.environ.get("SNAKE_HTTP_WORKERS") or os.environ.get("WEB_CONCURRENCY")
+                   or DEFAULT_HTTP_WORKERS)
+HTTP_THREADS = int(os.environ.get("SNAKE_HTTP_THREADS", "4"))
+# The engine keeps connections open between turns, a bit longer than a turn is enough
+KEEPALIVE_SECONDS = int(os.environ.get("SNAKE_KEEPALIVE_SECONDS", "75"))
+
+
+def available() -> bool:
+    return BaseApplication is not None
+
+
+def post_fork(server, worker):
+    # Process pools and caches don't survive a fork, every worker starts and warms up its own
+    parallel.start_pool()
+    warmup.start()
+
+
+def options(port: int) -> dict:
+    return {
+        'bind': f"0.0.0.0:{port}",
+        'workers': HTTP_WORKERS,
+        'worker_class': 'gthread',
+        'threads': HTTP_THREADS,
+        'keepalive': KEEPALIVE_SECONDS,
+        'timeout': 30,
+        'post_fork': post_fork,
+        'accesslog': None,
+    }
+
+
+def run(app, port: int) -> None:
+    class SnakeApplication(BaseApplication):
+        def load_config(self):
+            for key, value in options(port).items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    SnakeApplication().run()
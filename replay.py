@@ -0,0 +1,178 @@
+import argparse
+import atexit
+import glob
+import gzip
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # not on Windows, where there's only ever the one process of Flask's server
+    fcntl = None
+
+import game_cache
+import position_cache
+import server_logic
+from arena import percentile
+"""
+Game recorder and replay benchmark.
+
+With SNAKE_RECORD_DIR set, server.py records every /start, /move and /end
+payload (plus the move we answered) to <dir>/<game id>.jsonl.gz. Lines are
+buffered per game and appended as a new gzip member every FLUSH_EVERY lines, at
+/end, once the game has been idle for IDLE_SECONDS (its /end can get lost) and
+when the process exits, so a file is only ever appended to and gzip reads it as
+one stream. With several gunicorn workers every one of them buffers the moves it
+answered and appends to the same file, under a file lock so members don't mix.
+
+The replay tool feeds the recorded positions back through choose_move, to catch
+latency regressions on real games and to see how often we still pick the same move:
+
+    python replay.py recordings/ --repeat 3
+"""
+
+RECORD_DIR = os.environ.get("SNAKE_RECORD_DIR")
+FLUSH_EVERY = 50
+IDLE_SECONDS = 60
+
+
+class Recorder:
+    def __init__(self, directory: str, flush_every: int = FLUSH_EVERY, idle_seconds: float = IDLE_SECONDS):
+        self.directory = directory
+        self.flush_every = flush_every
+        self.idle_seconds = idle_seconds
+        self.buffers: Dict[str, List[bytes]] = {}
+        # When every buffered game got its last line
+        self.last_record: Dict[str, float] = {}
+        self.next_sweep = time.monotonic() + idle_seconds
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, game_id: str) -> str:
+        # Game ids come from the engine, keep them from going anywhere but our directory
+        safe_id = "".join(char if char.isalnum() or char in "-_" else "_" for char in game_id)
+        return os.path.join(self.directory, f"{safe_id}.jsonl.gz")
+
+    def record(self, kind: str, data: dict, response: Optional[dict] = None) -> None:
+        game_id = data['game']['id']
+        line = json.dumps({'kind': kind, 'data': data, 'response': response}, separators=(",", ":")).encode()
+        now = time.monotonic()
+        writes = []
+        with self.lock:
+            buffer = self.buffers.setdefault(game_id, [])
+            buffer.append(line)
+            self.last_record[game_id] = now
+            if kind == "end" or len(buffer) >= self.flush_every:
+                writes.append((game_id, self.buffers.pop(game_id)))
+                del self.last_record[game_id]
+            if now >= self.next_sweep:
+                writes.extend(self.take_idle(now))
+        for game_id, lines in writes:
+            self.write(game_id, lines)
+
+    def take_idle(self, now: float) -> List[tuple]:
+        """Buffers of the games nothing was recorded for in idle_seconds, called holding the lock"""
+        self.next_sweep = now + self.idle_seconds
+        idle = [game_id for game_id, last in self.last_record.items() if now - last >= self.idle_seconds]
+        for game_id in idle:
+            del self.last_record[game_id]
+        return [(game_id, self.buffers.pop(game_id)) for game_id in idle]
+
+    def write(self, game_id: str, lines: List[bytes]) -> None:
+        with open(self.path(game_id), "ab") as recording:
+            if fcntl is not None:
+                # Other workers append to the same file
+                fcntl.flock(recording, fcntl.LOCK_EX)
+            try:
+                with gzip.GzipFile(fileobj=recording, mode="ab") as member:
+                    member.write(b"\n".join(lines) + b"\n")
+                recording.flush()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(recording, fcntl.LOCK_UN)
+
+    def flush(self) -> None:
+        with self.lock:
+            buffers, self.buffers = self.buffers, {}
+            self.last_record.clear()
+        for game_id, lines in buffers.items():
+            self.write(game_id, lines)
+
+
+recorder = Recorder(RECORD_DIR) if RECORD_DIR else None
+if recorder:
+    atexit.register(recorder.flush)
+
+
+def read_recording(path: str) -> List[dict]:
+    with gzip.open(path, "rb") as recording:
+        return [json.loads(line) for line in recording if line.strip()]
+
+
+def recorded_moves(path: str) -> List[dict]:
+    moves = [record for record in read_recording(path) if record['kind'] == "move"]
+    return sorted(moves, key=lambda record: (record['data']['you']['id'], record['data']['turn']))
+
+
+def replay(paths: List[str], repeat: int = 1, engine: Optional[str] = None) -> dict:
+    """
+    Plays every recorded /move through choose_move `repeat` times. Returns latencies
+    by board size, how often we matched the recorded move, and how often all the
+    repeats agreed with each other. The position cache is off, otherwise every
+    repeat after the first would only measure the cache.
+    """
+    latencies: Dict[str, List[float]] = {}
+    positions = matches = stable = 0
+    for path in paths:
+        records = recorded_moves(path)
+        answers = [[] for _ in records]
+        for _ in range(repeat):
+            for index, record in enumerate(records):
+                data = record['data']
+                if index == 0 or data['turn'] <= records[index - 1]['data']['turn']:
+                    game_cache.games.start(data)
+                started = time.perf_counter()
+                with position_cache.positions.disabled():
+                    move, _ = server_logic.choose_move(data, engine)
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                size = f"{data['board']['width']}x{data['board']['height']}"
+                latencies.setdefault(size, []).append(elapsed_ms)
+                answers[index].append(move)
+        for record, moves in zip(records, answers):
+            positions += 1
+            recorded = (record.get('response') or {}).get('move')
+            matches += sum(1 for move in moves if move == recorded) / len(moves)
+            stable += len(set(moves)) == 1
+
+    return {
+        'positions': positions,
+        'latencies': latencies,
+        'same_as_recorded': matches / positions if positions else 0.0,
+        'stable': stable / positions if positions else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded games through choose_move")
+    parser.add_argument("paths", nargs="+", help="recordings, or directories of them")
+    parser.add_argument("--repeat", type=int, default=1, help="times every position is replayed")
+    parser.add_argument("--engine", help="engine to replay with, default is what choose_move would use")
+    args = parser.parse_args()
+
+    files = []
+    for path in args.paths:
+        files.extend(sorted(glob.glob(os.path.join(path, "*.jsonl.gz"))) if os.path.isdir(path) else [path])
+    result = replay(files, args.repeat, args.engine)
+
+    print(f"{result['positions']} positions from {len(files)} games")
+    for size, values in sorted(result['latencies'].items()):
+        print(f"{size}: mean {sum(values) / len(values):.1f} ms, p50 {percentile(values, 0.5):.1f} ms, "
+              f"p99 {percentile(values, 0.99):.1f} ms")
+    print(f"same move as recorded: {result['same_as_recorded']:.1%}, stable across repeats: {result['stable']:.1%}")
+
+
+if __name__ == "__main__":
+    main()
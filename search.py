@@ -0,0 +1,207 @@
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+from game_state import FULL_HEALTH, MOVE_INDEX, GameState, straight_first_table
+from floodfill import BLOCKED
+from policies import Policy
+from transposition import TranspositionTable
+"""
+Safety lookahead: which moves let our snake keep moving for the next N turns.
+
+choose_move runs it with iterative deepening, going one turn deeper at a time
+until the time budget for the move is spent, and keeps the answer from the
+deepest iteration that finished.
+"""
+
+# Fraction of game.timeout we allow ourselves to spend searching
+TIME_BUDGET_FRACTION = float(os.environ.get("SNAKE_TIME_BUDGET_FRACTION", "0.5"))
+# Used until we have a latency measurement for the game (first turn)
+DEFAULT_NETWORK_OVERHEAD_MS = float(os.environ.get("SNAKE_NETWORK_OVERHEAD_MS", "150"))
+DEFAULT_TIMEOUT_MS = 500
+MAX_DEPTH = 40
+# Only look at the clock every this many nodes, perf_counter isn't free
+DEADLINE_CHECK_MASK = 0xFF
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+def time_budget(data: dict, network_overhead_ms: Optional[float] = None) -> float:
+    """
+    Seconds we can spend searching for this move: a fraction of the game timeout,
+    minus what the round trip to the engine costs.
+    """
+    timeout_ms = data['game'].get('timeout') or DEFAULT_TIMEOUT_MS
+    if network_overhead_ms is None:
+        network_overhead_ms = DEFAULT_NETWORK_OVERHEAD_MS
+    budget_ms = timeout_ms * TIME_BUDGET_FRACTION - network_overhead_ms
+    # Always allow something, a shallow answer beats no answer
+    return max(budget_ms, timeout_ms * 0.05) / 1000
+
+
+def network_overhead(data: dict, last_elapsed_ms: Optional[float]) -> Optional[float]:
+    """
+    The engine reports the round trip of our previous move as `latency`. Whatever
+    of it wasn't spent in choose_move was spent on the network.
+    """
+    latency = data['you'].get('latency')
+    if not latency or last_elapsed_ms is None:
+        return None
+    return max(float(latency) - last_elapsed_ms, 0.0)
+
+
+def opponent_timings(state: GameState) -> Tuple[List[int], bytearray]:
+    """
+    For the frozen lookahead: the turn every cell frees up as far as opponents and
+    hazard walls go (like floodfill.free_after), and how many opponent segments sit
+    on each cell, which tells them apart from ours in state.occupied. An opponent
+    next to food might eat and keep its tail one more turn, so it gets one extra.
+    """
+    free_at = [0] * len(state.occupied)
+    counts = bytearray(len(state.occupied))
+    if state.ruleset.hazards_are_walls:
+        for cell, hazard in enumerate(state.hazards):
+            if hazard:
+                free_at[cell] = BLOCKED
+    for snake, body in enumerate(state.bodies):
+        if not state.alive[snake] or snake == state.you:
+            continue
+        length = len(body)
+        may_eat = any(cell in state.food for cell in state.adjacent[body[0]])
+        for index, cell in enumerate(body):
+            counts[cell] += 1
+            free_at[cell] = max(free_at[cell], length - index + may_eat)
+    return free_at, counts
+
+
+class Search:
+    def __init__(self, state: GameState, deadline: Optional[float] = None,
+                 table: Optional[TranspositionTable] = None, opponent_policy: Optional[Policy] = None,
+                 moving_tails: bool = True):
+        self.state = state
+        self.deadline = deadline
+        self.table = table
+        # Without a policy opponents stay where they are, otherwise whole turns are simulated
+        self.opponent_policy = opponent_policy
+        self.children = straight_first_table(state.width, state.height, state.ruleset.wrapped)
+        self.nodes = 0
+        # Frozen opponents still lose their tail segments as turns go by, unless moving_tails is off
+        self.moving_tails = moving_tails
+        if moving_tails and opponent_policy is None:
+            self.free_at, self.opponents_on = opponent_timings(state)
+
+    def survives(self, head: int, move: str, turns: int) -> bool:
+        """
+        True if our snake can make `move` from `head` and then keep moving for the rest
+        of the `turns` without hitting anything or starving. Moves are applied and
+        undone in place.
+        """
+        state = self.state
+        return self.enter(move, state.neighbor(head, move), turns, state.health[state.you], 1)
+
+    def enter(self, move: str, cell: int, turns: int, health: int, turn: int) -> bool:
+        """
+        survives() for the move that takes our head to `cell` (-1 if that's off the
+        board) on the `turn`-th move from the root, with `health` left before it
+        """
+        if turns == 0:
+            return True
+        self.nodes += 1
+        if self.deadline is not None and not self.nodes & DEADLINE_CHECK_MASK \
+                and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+        state = self.state
+        if self.opponent_policy is None:
+            if cell < 0:
+                return False
+            if self.moving_tails:
+                # Anything above the opponent segments is ours, opponents are gone once their turn comes
+                if state.occupied[cell] > self.opponents_on[cell] or self.free_at[cell] > turn:
+                    return False
+            elif not state.is_free(cell):
+                return False
+            # Frozen opponents don't need health, ours is tracked here instead of in the state
+            if cell in state.food or state.ruleset.constrictor:
+                health = FULL_HEALTH
+            else:
+                health -= 1 + (state.hazard_damage if state.hazards[cell] else 0)
+                if health <= 0:
+                    return False
+            record = state.move_snake(state.you, cell)
+            undo = state.undo
+            key = state.hash ^ state.keys.health[state.you][health]
+            if self.moving_tails:
+                # What's free depends on how many turns in we are
+                key ^= state.keys.turn[turn]
+        else:
+            record = state.step(self.turn_moves(move))
+            undo = state.undo_step
+            if not state.alive[state.you]:
+                undo(record)
+                return False
+            cell = state.head(state.you)
+            health = state.health[state.you]
+            key = state.hash
+        try:
+            if turns == 1:
+                return True
+            table = self.table
+            if table is not None:
+                safe = table.probe(key, turns - 1)
+                if safe is not None:
+                    return safe
+            safe = False
+            for next_move, next_cell in self.children[cell][MOVE_INDEX[move]]:
+                if self.enter(next_move, next_cell, turns - 1, health, turn + 1):
+                    safe = True
+                    break
+            if table is not None:
+                table.store(key, turns - 1, safe)
+            return safe
+        finally:
+            undo(record)
+
+    def turn_moves(self, move: str) -> List[Optional[str]]:
+        state = self.state
+        policy = self.opponent_policy
+        return [
+            move if snake == state.you else (policy(state, snake) if alive else None)
+            for snake, alive in enumerate(state.alive)
+        ]
+
+    def safe_moves(self, head: int, possible_moves: List[str], turns: int) -> List[str]:
+        return [move for move in possible_moves if self.survives(head, move, turns)]
+
+    def survival_depths(self, head: int, possible_moves: List[str], max_depth: int = MAX_DEPTH) -> Dict[str, int]:
+        """
+        How many turns each move is known to survive, deepening one turn at a time until
+        the deadline. Only the moves that survived the last depth go on to the next one,
+        and we stop once a single move is left since deeper can't change the choice.
+        """
+        depths = dict.fromkeys(possible_moves, 0)
+        moves = possible_moves
+        for depth in range(1, max_depth + 1):
+            try:
+                with metrics.timer(metrics.DEPTH_SECONDS, str(depth)):
+                    moves = self.safe_moves(head, moves, depth)
+            except SearchTimeout:
+                metrics.DEADLINE_STOPS.inc()
+                break
+            for move in moves:
+                depths[move] = depth
+            if len(moves) <= 1:
+                break
+        return depths
+
+    def iterative_deepening(self, head: int, possible_moves: List[str],
+                            max_depth: int = MAX_DEPTH) -> Tuple[List[str], int]:
+        """
+        The moves that survive the longest and for how many turns. If nothing survives
+        even one turn that's all of possible_moves at depth 0.
+        """
+        depths = self.survival_depths(head, possible_moves, max_depth)
+        best_depth = max(depths.values(), default=0)
+        return [move for move in possible_moves if depths[move] == best_depth], best_depth
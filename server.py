@@ -2,12 +2,39 @@ import logging
 import os
 
 from flask import Flask
+from flask import Response
+from flask import jsonify
 from flask import request
 
+import game_cache
+import logs
+import metrics
+import parallel
+import production
+import replay
 import server_logic
+import warmup
+
+try:
+    import orjson
+except ImportError:  # optional, Flask's json does the same job a bit slower
+    orjson = None
 
 
 app = Flask(__name__)
+DEBUG = os.environ.get("SNAKE_DEBUG") == "1"
+
+
+def read_json() -> dict:
+    if orjson is not None:
+        return orjson.loads(request.get_data())
+    return request.get_json()
+
+
+def json_response(payload):
+    if orjson is not None:
+        return Response(orjson.dumps(payload), mimetype="application/json")
+    return jsonify(payload)
 
 
 @app.get("/")
@@ -20,14 +47,17 @@ def handle_info():
     For customization options, see https://docs.battlesnake.com/references/personalization
 
     TIP: If you open your Battlesnake URL in browser you should see this data.
+
+    "ready" is ours, not part of the API: false while the warm-up is still running.
     """
-    print("INFO")
+    logs.logger.debug("info")
     return {
         "apiversion": "1",
         "author": "GGGelo",  # TODO: Your Battlesnake Username
         "color": "#eb0000",  # TODO: Personalize
         "head": "fang",  # TODO: Personalize
         "tail": "hook",  # TODO: Personalize
+        "ready": warmup.ready.is_set(),
     }
 
 
@@ -37,9 +67,18 @@ def handle_start():
     This function is called everytime your snake is entered into a game.
     request.json contains information about the game that's about to be played.
     """
-    data = request.get_json()
-
-    print(f"{data['game']['id']} START")
+    data = read_json()
+    game_cache.games.start(data)
+    # Not part of the API: tournament runners can pick the engine for the game
+    if data.get('engine'):
+        try:
+            server_logic.select_engine(data, data['engine'])
+        except ValueError as error:
+            return {"error": str(error)}, 400
+    if replay.recorder:
+        replay.recorder.record("start", data)
+
+    logs.logger.info("start", game=data['game']['id'])
     return "ok"
 
 
@@ -49,12 +88,46 @@ def handle_move():
     This function is called on every turn of a game. It's how your snake decides where to move.
     Valid moves are "up", "down", "left", or "right".
     """
-    data = request.get_json()
+    with metrics.timer(metrics.PHASE_SECONDS, "parse"):
+        data = read_json()
 
     # TODO - look at the server_logic.py file to see how we decide what move to return!
     move, shout = server_logic.choose_move(data)
+    if replay.recorder:
+        replay.recorder.record("move", data, {"move": move, "shout": shout})
+
+    with metrics.timer(metrics.PHASE_SECONDS, "serialize"):
+        return json_response({"move": move, "shout": shout})
+
 
-    return {"move": move, "shout": shout}
+@app.post("/move/batch")
+def handle_move_batch():
+    """
+    Not part of the Battlesnake API: a JSON list of /move requests from different
+    games, answered together with a list of {"move", "shout"} in the same order.
+    For tournament runners that have many games going at once.
+    """
+    with metrics.timer(metrics.PHASE_SECONDS, "parse"):
+        batch = read_json()
+
+    answers = [{"move": move, "shout": shout} for move, shout in server_logic.choose_moves(batch)]
+    if replay.recorder:
+        for data, answer in zip(batch, answers):
+            replay.recorder.record("move", data, answer)
+
+    with metrics.timer(metrics.PHASE_SECONDS, "serialize"):
+        return json_response(answers)
+
+
+@app.get("/metrics")
+def handle_metrics():
+    """
+    Latency histograms and search counters in the Prometheus text format.
+    Only there when the server runs with SNAKE_METRICS=1.
+    """
+    if not metrics.ENABLED:
+        return "metrics are disabled, set SNAKE_METRICS=1", 404
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 
 @app.post("/end")
@@ -63,15 +136,26 @@ def end():
     This function is called when a game your snake was in ends.
     It's purely for informational purposes, you don't have to make any decisions here.
     """
-    data = request.get_json()
+    data = read_json()
+    game_cache.games.end(data)
+    if replay.recorder:
+        replay.recorder.record("end", data)
 
-    print(f"{data['game']['id']} END")
+    logs.logger.info("end", game=data['game']['id'], turn=data['turn'])
     return "ok"
 
 
 if __name__ == "__main__":
     logging.getLogger("werkzeug").setLevel(logging.ERROR)
 
-    print("Starting Battlesnake Server...")
     port = int(os.environ.get("PORT", "8080"))
-    app.run(host="0.0.0.0", port=port, debug=True)
+    logs.logger.info("starting", port=port)
+    if production.available() and not DEBUG:
+        logs.logger.info("serving", workers=production.HTTP_WORKERS, threads=production.HTTP_THREADS)
+        production.run(app, port)
+    else:
+        if parallel.start_pool():
+            logs.logger.info("pool", workers=parallel.WORKERS)
+        warmup.start()
+        # The reloader would start everything twice, only use it while debugging
+        app.run(host="0.0.0.0", port=port, debug=DEBUG, threaded=True)
@@ -1,6 +1,22 @@
+import os
 import random
-from typing import List, Dict, Tuple
-import copy
+import time
+from typing import List, Dict, Optional, Tuple
+
+import book
+import evaluation
+import game_cache
+import kernels
+import logs
+import mcts
+import metrics
+import minimax
+import parallel
+import position_cache
+from floodfill import free_after, reachable_area
+from game_state import MOVE_INDEX, GameState
+from policies import get_policy
+from search import Search, network_overhead, time_budget
 """
 This file can be a nice home for your move logic, and to write helper functions.
 
@@ -72,50 +88,10 @@ def remove_immediate_hazards(my_head, board, full_board_data, possible_moves):
     return new_possible_moves
 
 def remove_next_hazards(my_head, board, full_data, possible_moves, turns=1):
-    # TODO The number of next turns should be passed here so this can do every turn with a cache
-    # TODO Also the food positions may be necessary
-    if turns == 0:
-        return possible_moves
-    possible_moves = remove_immediate_hazards(my_head, board, full_data['board'], possible_moves)
-    new_possible_moves = []
-    for move in possible_moves:
-        next_possible_moves = ["up", "down", "left", "right"]
-        # remove current hazards
-
-        # remove future hazards
-        move_relative_movement = relative_movement[move]
-        new_head = {
-            "x": my_head['x'] + move_relative_movement['x'],
-            "y": my_head['y'] + move_relative_movement['y'],
-        }
-        new_full_data, new_board = get_next_turn_board(new_head, full_data)
-        next_possible_moves = remove_next_hazards(new_head, new_board, new_full_data, next_possible_moves, turns-1)
-        if next_possible_moves:
-            new_possible_moves.append(move)
-    return new_possible_moves
-
-def move_player_to(new_head: dict, full_data: dict) -> None:
-    for snake in full_data['board']['snakes']:
-        if snake['id'] == full_data['you']['id']:
-            # TODO check if you are eating
-            snake['body'].insert(0, new_head)
-            if new_head in full_data['board']['food']:
-                index = full_data['board']['food'].index(new_head)
-                del full_data['board']['food'][index]
-                snake['length'] += 1
-            else:
-                del snake['body'][-1]
-        #TODO check what other snakes do
-
-
-def get_next_turn_board(new_head:dict, full_data:dict) -> Tuple[dict, dict]:
-    # TODO At some point I'll cave in and make this function work correctly
-    new_full_data = copy.deepcopy(full_data)
-    move_player_to(new_head, new_full_data)
-    board = create_empty_board(new_full_data['board'])
-    fill_board_with_snakes(board, new_full_data['board'])
-
-    return new_full_data, board 
+    # `board` is kept for callers that already built it, the search runs on a GameState
+    state = GameState.from_data(full_data)
+    # Opponents stay exactly where they are here, tails included, like fill_board_with_snakes has them
+    return Search(state, moving_tails=False).safe_moves(state.cell(my_head), possible_moves, turns)
 
 
 def get_board_size(board):
@@ -172,19 +148,46 @@ def weight_enemies(new_pos, data):
              
 
 
-def weight_for_food(head, possible_moves, food_data, data):
+# Use the batched NumPy weights when numpy is installed
+VECTORIZED = kernels.available() and os.environ.get("SNAKE_VECTORIZE", "1") != "0"
+# For one game NumPy's setup costs more than the loops save until there's about this much food,
+# choose_moves always uses it since the setup is paid once for the whole batch
+VECTORIZE_MIN_FOOD = 64
+
+# Added for every cell of room we're missing to fit our body after a move
+TRAPPED_WEIGHT = 1000
+
+def weight_space(cell, state, free_at, length):
+    # Moving into a pocket smaller than us is how we keep dying, make that expensive.
+    # Off the board (cell -1) there's no room at all.
+    area = reachable_area(state, cell, free_at, limit=length)
+    return TRAPPED_WEIGHT * (length - area)
+
+def weight_for_food(head, possible_moves, food_data, data, food_weights=None):
+    # food_weights: the food + enemy weights when choose_moves already worked them out for the whole batch
+    state = GameState.from_data(data)
+    free_at = free_after(state)
+    length = data['you']['length']
+    get_food_now = should_get_food_now(data)
+    if food_weights is None and VECTORIZED and possible_moves and len(food_data) >= VECTORIZE_MIN_FOOD:
+        food_weights = kernels.food_and_enemy_weights(head, possible_moves, food_data, data, get_food_now)
+    head_steps = state.steps[state.cell(head)]
     weighted_possible_moves = []
-    for move in possible_moves:
-        move_relative_movement = relative_movement[move]
-        new_pos = {
-            "x": head['x'] + move_relative_movement['x'],
-            "y": head['y'] + move_relative_movement['y'],
-        }
-        if should_get_food_now(data):
-            weight = weight_by_min(new_pos, food_data)
+    for index, move in enumerate(possible_moves):
+        if food_weights is not None:
+            weight = food_weights[index]
         else:
-            weight = weight_by_max(new_pos, food_data)
-        weight += weight_enemies(new_pos, data)
+            move_relative_movement = relative_movement[move]
+            new_pos = {
+                "x": head['x'] + move_relative_movement['x'],
+                "y": head['y'] + move_relative_movement['y'],
+            }
+            if get_food_now:
+                weight = weight_by_min(new_pos, food_data)
+            else:
+                weight = weight_by_max(new_pos, food_data)
+            weight += weight_enemies(new_pos, data)
+        weight += weight_space(head_steps[MOVE_INDEX[move]], state, free_at, length)
 
         weighted_possible_moves.append({'move': move, 'weight': weight})
 
@@ -204,10 +207,168 @@ def should_get_food_now(data):
 
 
 
-def choose_move(data: dict) -> str:
+# How the lookahead expects opponents to move, "frozen" keeps them where they are
+OPPONENT_POLICY = os.environ.get("SNAKE_OPPONENT_POLICY", "frozen")
+
+# Which engine picks the move: "lookahead" (safety search + food heuristic) or "mcts"
+ENGINE = os.environ.get("SNAKE_ENGINE", "lookahead")
+ENGINES = ("lookahead", "mcts")
+
+# Share of the time budget the safety search gets when minimax runs after it
+MINIMAX_SAFETY_SHARE = 0.3
+
+
+def select_engine(data: dict, engine: str) -> None:
+    """Overrides ENGINE for the game of `data` (a /start or /move request), until its /end"""
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine}, expected one of {ENGINES}")
+    game_cache.games.get(data).engine = engine
+
+
+class Decision:
+    """
+    One game's /move on its way through choose_move or choose_moves: both run the
+    same steps over it, choose_moves just runs each step for all its games together.
+    """
+    __slots__ = ("data", "game", "state", "started", "deadline", "engine", "policy_name", "use_minimax",
+                 "moves", "weighted", "depth", "nodes", "position")
+
+    def __init__(self, data: dict, engine: Optional[str], opponent_policy: Optional[str], started: float):
+        self.data = data
+        self.started = started
+        self.game = game_cache.games.get(data)
+        # What we spent on our previous move tells our own time apart from network time
+        overhead_ms = network_overhead(data, self.game.last_elapsed_ms)
+        self.deadline = started + time_budget(data, overhead_ms)
+        with metrics.timer(metrics.PHASE_SECONDS, "board"):
+            self.state = GameState.from_data(data)
+        self.engine = engine or self.game.engine or ENGINE
+        opponent_policy = opponent_policy or OPPONENT_POLICY
+        self.policy_name = None if opponent_policy == "frozen" else opponent_policy
+        # With few snakes left minimax gets most of the time, the safety search only narrows its moves
+        self.use_minimax = self.engine != "mcts" and minimax.applies(self.state)
+        self.moves = ["up", "down", "left", "right"]
+        self.weighted = None
+        self.depth = 0
+        self.nodes = 0
+        # (canonical key, symmetry) when the move goes in the position cache
+        self.position = None
+        with metrics.timer(metrics.PHASE_SECONDS, "book"):
+            book_move = book.lookup(self.state, data['turn'])
+        if book_move:
+            self.moves = self.weighted = [book_move]
+            self.depth = "book"
+        elif self.engine != "mcts" and position_cache.positions.enabled:
+            with metrics.timer(metrics.PHASE_SECONDS, "position_cache"):
+                self.look_up_position()
+
+    def look_up_position(self) -> None:
+        state = self.state
+        self.position = position_cache.position_key(state, (self.engine, self.policy_name))
+        cached = position_cache.positions.get(*self.position)
+        if cached is None:
+            metrics.POSITION_MISSES.inc()
+            return
+        move, _ = cached
+        cell = state.neighbor(state.head(state.you), move)
+        if cell >= 0 and state.is_free(cell):
+            metrics.POSITION_HITS.inc()
+            self.moves = self.weighted = [move]
+            self.depth = "cache"
+
+    @property
+    def searching(self) -> bool:
+        """False once the book or MCTS already settled the move"""
+        return self.weighted is None
+
+    def safety_deadline(self, deadline: float) -> float:
+        if not self.use_minimax:
+            return deadline
+        now = time.perf_counter()
+        return now + (deadline - now) * MINIMAX_SAFETY_SHARE
+
+    def search(self, deadline: float) -> None:
+        """MCTS, or the safety lookahead in this process, until `deadline`"""
+        state, game = self.state, self.game
+        with metrics.timer(metrics.PHASE_SECONDS, "search"):
+            if self.engine == "mcts":
+                mcts_move = mcts.choose_move(game, self.data, state, deadline)
+                if mcts_move:
+                    self.moves = self.weighted = [mcts_move]
+                else:
+                    # No time left for the tree, the moves that don't kill us right away get weighed instead
+                    self.moves = Search(state).safe_moves(state.head(state.you), self.moves, 1) or self.moves
+                return
+            policy = get_policy(self.policy_name) if self.policy_name else None
+            search = Search(state, self.safety_deadline(deadline), game.table, policy)
+            hits, misses = game.table.hits, game.table.misses
+            self.moves, self.depth = search.iterative_deepening(state.head(state.you), self.moves)
+        self.nodes += search.nodes
+        metrics.MOVE_NODES.observe(search.nodes)
+        metrics.NODES.inc(search.nodes)
+        metrics.TABLE_HITS.inc(game.table.hits - hits)
+        metrics.TABLE_MISSES.inc(game.table.misses - misses)
+
+    def food_weights_args(self) -> tuple:
+        data = self.data
+        return (data['you']['head'], self.moves, data['board']['food'], data, should_get_food_now(data))
+
+    def weigh(self, food_weights: Optional[List[int]] = None, scores: Optional[List[float]] = None) -> None:
+        # scores: the learned evaluation's, best first, instead of the hand-tuned weights
+        data = self.data
+        with metrics.timer(metrics.PHASE_SECONDS, "weighting"):
+            if scores is not None:
+                self.weighted = evaluation.rank(self.moves, scores)
+            else:
+                self.weighted = weight_for_food(data['you']['head'], self.moves, data['board']['food'], data,
+                                                food_weights)
+
+    def run_minimax(self, deadline: float) -> None:
+        if not self.use_minimax or len(self.weighted) < 2:
+            return
+        with metrics.timer(metrics.PHASE_SECONDS, "minimax"):
+            duel = minimax.Minimax(self.state, deadline)
+            best_move, minimax_depth, _ = duel.search(self.weighted)
+        self.nodes += duel.nodes
+        metrics.NODES.inc(duel.nodes)
+        if best_move:
+            self.weighted.remove(best_move)
+            self.weighted.insert(0, best_move)
+        logs.logger.debug("minimax", sampled=True, game=self.data['game']['id'], turn=self.data['turn'],
+                          move=best_move, depth=minimax_depth, nodes=duel.nodes)
+
+    def finish(self) -> Tuple[str, str]:
+        data, game = self.data, self.game
+        # Choose a random direction from the remaining possible_moves to move in, and then return that move
+        shout = 'Well I may have a ssssurprise for you'
+        if self.weighted:
+            move = self.weighted[0]
+            shout = "It'ssss over my friend"
+        else:
+            move = 'up'
+            shout = "Oh lord ssssspare my life"
+
+        if self.position is not None and self.weighted and isinstance(self.depth, int):
+            position_cache.positions.put(*self.position, move, self.depth)
+
+        game.turn = data['turn']
+        elapsed = time.perf_counter() - self.started
+        game.last_elapsed_ms = elapsed * 1000
+        metrics.MOVE_SECONDS.observe(elapsed)
+
+        logs.logger.info("move", sampled=True, game=data['game']['id'], turn=data['turn'], move=move,
+                         moves=self.moves, depth=self.depth, nodes=self.nodes, elapsed_ms=round(elapsed * 1000, 3),
+                         engine=self.engine)
+
+        return move, shout
+
+
+def choose_move(data: dict, engine: Optional[str] = None, opponent_policy: Optional[str] = None) -> Tuple[str, str]:
     """
     data: Dictionary of all Game Board data as received from the Battlesnake Engine.
     For a full example of 'data', see https://docs.battlesnake.com/references/api/sample-move-request
+    engine, opponent_policy: override ENGINE/select_engine() and OPPONENT_POLICY, the arena uses
+    them to play different versions against each other in one process.
 
     return: A String, the single move to make. One of "up", "down", "left" or "right".
 
@@ -216,35 +377,77 @@ def choose_move(data: dict) -> str:
     for each move of the game.
 
     """
-    board = create_empty_board(data['board'])
-    fill_board_with_snakes(board, data['board'])
-        
-    my_head = data["you"]["head"]  # A dictionary of x/y coordinates like {"x": 0, "y": 0}
-
-    possible_moves = ["up", "down", "left", "right"]
-    latency = int(data["you"]['latency']) if data["you"]['latency'] else 400
-    if latency > 400:
-        turns_ahead = 2
-    elif latency > 100:
-        turns_ahead = 3
-    else:
-        turns_ahead = 3
-    print(turns_ahead)
-    possible_moves_next = remove_next_hazards(my_head, board, data, possible_moves, turns_ahead)
-    if len(possible_moves_next) == 0:
-        possible_moves_next = possible_moves
-
-    possible_moves_weighted = weight_for_food(my_head, possible_moves_next, data['board']['food'], data)
-
-    # Choose a random direction from the remaining possible_moves to move in, and then return that move
-    shout = 'Well I may have a ssssurprise for you'
-    if possible_moves_weighted:
-        move = possible_moves_weighted[0]
-        shout = "It'ssss over my friend"
+    decision = Decision(data, engine, opponent_policy, time.perf_counter())
+    if decision.searching:
+        if decision.engine != "mcts" and parallel.pool_running():
+            with metrics.timer(metrics.PHASE_SECONDS, "search"):
+                decision.moves, decision.depth = parallel.parallel_safe_moves(
+                    data, decision.moves, decision.safety_deadline(decision.deadline), decision.policy_name)
+        else:
+            decision.search(decision.deadline)
+    if decision.searching:
+        if evaluation.loaded is not None and decision.moves:
+            with metrics.timer(metrics.PHASE_SECONDS, "evaluation"):
+                [scores] = evaluation.score_moves([(decision.state, decision.moves)])
+            decision.weigh(scores=scores)
+        else:
+            decision.weigh()
+        decision.run_minimax(decision.deadline)
+    return decision.finish()
+
+
+def choose_moves(batch: List[dict], engine: Optional[str] = None,
+                 opponent_policy: Optional[str] = None) -> List[Tuple[str, str]]:
+    """
+    choose_move for the positions of several games at once, answers in the same order.
+
+    With the worker pool running, the safety search of every game goes out in a
+    single dispatch, and the food and enemy weights of all games are one NumPy
+    call (or, with a learned evaluation model, one pass through the model). Searches that run in this process take turns, each gets its share of
+    the time its game has left.
+    """
+    started = time.perf_counter()
+    decisions = [Decision(data, engine, opponent_policy, started) for data in batch]
+    searching = [decision for decision in decisions if decision.searching]
+
+    pooled = [decision for decision in searching if decision.engine != "mcts"] if parallel.pool_running() else []
+    if pooled:
+        with metrics.timer(metrics.PHASE_SECONDS, "search"):
+            results = parallel.batch_safe_moves(
+                [(decision.data, decision.moves, decision.safety_deadline(decision.deadline)) for decision in pooled],
+                pooled[0].policy_name)
+        for decision, (moves, depth) in zip(pooled, results):
+            decision.moves, decision.depth = moves, depth
+    local = [decision for decision in searching if decision not in pooled]
+    for index, decision in enumerate(local):
+        decision.search(_share(decision.deadline, len(local) - index))
+
+    weighing = [decision for decision in decisions if decision.searching]
+    hand_tuned = weighing
+    if evaluation.loaded is not None:
+        # Every game's moves through the model together
+        scored = [decision for decision in weighing if decision.moves]
+        with metrics.timer(metrics.PHASE_SECONDS, "evaluation"):
+            scores = evaluation.score_moves([(decision.state, decision.moves) for decision in scored])
+        for decision, move_scores in zip(scored, scores):
+            decision.weigh(scores=move_scores)
+        hand_tuned = [decision for decision in weighing if not decision.moves]
+    if VECTORIZED and hand_tuned:
+        with metrics.timer(metrics.PHASE_SECONDS, "weighting"):
+            food_weights = kernels.batched_food_and_enemy_weights(
+                [decision.food_weights_args() for decision in hand_tuned])
     else:
-        move = 'up'
-        shout = "Oh lord ssssspare my life"
+        food_weights = [None] * len(hand_tuned)
+    for decision, weights in zip(hand_tuned, food_weights):
+        decision.weigh(weights)
+    dueling = [decision for decision in weighing if decision.use_minimax]
+    for index, decision in enumerate(dueling):
+        decision.run_minimax(_share(decision.deadline, len(dueling) - index))
+
+    return [decision.finish() for decision in decisions]
 
-    print(f"{data['game']['id']} MOVE {data['turn']}: {move} picked from all valid options in {possible_moves}")
 
-    return move, shout
+def _share(deadline: float, games_left: int) -> float:
+    """Deadline for one of `games_left` games that still have to run before `deadline`, in turns"""
+    now = time.perf_counter()
+    return now + max(deadline - now, 0) / games_left
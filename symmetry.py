@@ -0,0 +1,126 @@
+import hashlib
+from functools import lru_cache
+from typing import Iterable, List, NamedTuple, Tuple
+
+from game_state import GameState
+"""
+Board symmetries: rotations and reflections that turn a position into an
+equivalent one, so positions we have seen in some orientation can be looked up
+in any other.
+
+Square boards have 8 of them, rectangular ones only the 4 that keep the width
+and height where they are. A position's canonical form is its smallest encoding
+over all the symmetries, and moves found in the canonical orientation are mapped
+back with move_from_canonical.
+"""
+
+# Direction every move goes in, up is +y like the API
+VECTORS = {"up": (0, 1), "down": (0, -1), "left": (-1, 0), "right": (1, 0)}
+MOVE_FOR_VECTOR = {vector: move for move, vector in VECTORS.items()}
+
+
+class Symmetry(NamedTuple):
+    # Swap x and y first, then flip the resulting axes
+    swap: bool
+    flip_x: bool
+    flip_y: bool
+
+
+SYMMETRIES = tuple(Symmetry(swap, flip_x, flip_y)
+                   for swap in (False, True) for flip_x in (False, True) for flip_y in (False, True))
+IDENTITY = SYMMETRIES[0]
+
+
+def symmetries_for(width: int, height: int) -> Tuple[Symmetry, ...]:
+    return SYMMETRIES if width == height else tuple(symmetry for symmetry in SYMMETRIES if not symmetry.swap)
+
+
+def transform_point(symmetry: Symmetry, x: int, y: int, width: int, height: int) -> Tuple[int, int]:
+    if symmetry.swap:
+        x, y, width, height = y, x, height, width
+    if symmetry.flip_x:
+        x = width - 1 - x
+    if symmetry.flip_y:
+        y = height - 1 - y
+    return x, y
+
+
+def move_to_canonical(move: str, symmetry: Symmetry) -> str:
+    dx, dy = VECTORS[move]
+    if symmetry.swap:
+        dx, dy = dy, dx
+    return MOVE_FOR_VECTOR[(-dx if symmetry.flip_x else dx, -dy if symmetry.flip_y else dy)]
+
+
+def move_from_canonical(move: str, symmetry: Symmetry) -> str:
+    # The same steps backwards: flips first, then the swap
+    dx, dy = VECTORS[move]
+    dx, dy = (-dx if symmetry.flip_x else dx), (-dy if symmetry.flip_y else dy)
+    if symmetry.swap:
+        dx, dy = dy, dx
+    return MOVE_FOR_VECTOR[(dx, dy)]
+
+
+@lru_cache(maxsize=None)
+def cell_maps(width: int, height: int) -> Tuple[Tuple[Symmetry, Tuple[int, ...]], ...]:
+    """For every symmetry of the board, where every cell ends up"""
+    maps = []
+    for symmetry in symmetries_for(width, height):
+        mapped_width = height if symmetry.swap else width
+        cells = []
+        for cell in range(width * height):
+            x, y = transform_point(symmetry, cell % width, cell // width, width, height)
+            cells.append(y * mapped_width + x)
+        maps.append((symmetry, tuple(cells)))
+    return tuple(maps)
+
+
+def position_encoding(state: GameState, cells: Tuple[int, ...]) -> tuple:
+    """Everything that matters for picking our move, with every cell sent through `cells`"""
+    opponents = sorted(
+        (tuple(cells[cell] for cell in state.bodies[snake]), state.health[snake])
+        for snake, alive in enumerate(state.alive) if alive and snake != state.you
+    )
+    return (
+        tuple(cells[cell] for cell in state.bodies[state.you]),
+        state.health[state.you],
+        tuple(opponents),
+        tuple(sorted(cells[cell] for cell in state.food)),
+        tuple(sorted(cells[cell] for cell, hazard in enumerate(state.hazards) if hazard)),
+    )
+
+
+def canonical(state: GameState) -> Tuple[tuple, Symmetry]:
+    """The smallest encoding of the position over all symmetries, and the symmetry that gives it"""
+    return min(((position_encoding(state, cells), symmetry) for symmetry, cells in cell_maps(state.width, state.height)),
+               key=lambda option: option[0])
+
+
+def stable_hash(parts: Iterable) -> int:
+    """64 bit hash that's the same in every process, unlike hash() on strings"""
+    return int.from_bytes(hashlib.blake2b(repr(tuple(parts)).encode(), digest_size=8).digest(), "little")
+
+
+def canonical_key(state: GameState) -> Tuple[int, Symmetry]:
+    encoding, symmetry = canonical(state)
+    return stable_hash((state.width, state.height, state.ruleset.name, state.hazard_damage, encoding)), symmetry
+
+
+def local_canonical(points: List[Tuple[int, int, tuple]]) -> Tuple[tuple, Symmetry]:
+    """
+    Like canonical() for a shape that can sit anywhere on the board: (x, y, value)
+    points, moved so the smallest x and y are 0 after every symmetry.
+    """
+    width = max(x for x, _, _ in points) + 1
+    height = max(y for _, y, _ in points) + 1
+    # Any square containing the shape has all 8 symmetries, the translation undoes the offset
+    side = max(width, height)
+    best = None
+    for symmetry in SYMMETRIES:
+        mapped = [(transform_point(symmetry, x, y, side, side), value) for x, y, value in points]
+        min_x = min(x for (x, _), _ in mapped)
+        min_y = min(y for (_, y), _ in mapped)
+        encoding = tuple(sorted((x - min_x, y - min_y, value) for (x, y), value in mapped))
+        if best is None or encoding < best[0]:
+            best = (encoding, symmetry)
+    return best
@@ -10,9 +10,38 @@ in the folder where this file exists:
     python tests.py -v
 
 """
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
 import unittest
+from collections import deque
 
-from server_logic import avoid_my_neck, choose_move, create_empty_board, fill_board_with_snakes, get_board_size, remove_immediate_hazards, remove_next_hazards, weight_for_food
+import arena
+import book
+import evaluation
+import game_cache
+import kernels
+import loadtest
+import logs
+import mcts
+import metrics
+import minimax
+import parallel
+import position_cache
+import replay
+import server_logic
+import warmup
+from floodfill import BLOCKED, free_after, reachable_area, voronoi
+from game_state import MOVE_INDEX, GameState, neighbor_table, step_table, straight_first_table
+from policies import first_safe_policy, greedy_food_policy
+from search import Search, network_overhead, opponent_timings, time_budget
+from symmetry import SYMMETRIES, canonical_key, move_from_canonical, move_to_canonical
+from transposition import TranspositionTable
+from server_logic import avoid_my_neck, choose_move, choose_moves, create_empty_board, fill_board_with_snakes, get_board_size, in_board_limits, relative_movement, remove_immediate_hazards, remove_next_hazards, select_engine, weight_by_max, weight_by_min, weight_by_sum, weight_enemies, weight_for_food
 
 def get_full_test_json():
     return {
@@ -138,6 +167,17 @@ def get_full_test_json():
         }
     }
 
+_logger = logs.logger
+
+
+def setUpModule():
+    # choose_move logs every move, keep the lines out of the test output
+    logs.logger = logs.Logger(io.StringIO())
+
+
+def tearDownModule():
+    logs.logger = _logger
+
 class AvoidNeckTest(unittest.TestCase):
     def test_avoid_neck_all(self):
         """
@@ -372,5 +412,1361 @@ class MoveTest(unittest.TestCase):
         move, shout = choose_move(get_full_test_json())
         assert move == 'up'
 
+    def test_choose_moves_for_several_games(self):
+        first = get_full_test_json()
+        second = SearchTest().third_move_position()
+        second['game']['id'] = "batch-second"
+        second['you']['body'] = second['board']['snakes'][0]['body']
+        second['you']['head'] = second['you']['body'][0]
+        answers = choose_moves([first, second, first])
+        assert [move for move, _ in answers] == ['up', 'left', 'up']
+
+class GameStateTest(unittest.TestCase):
+    def test_from_data(self):
+        state = GameState.from_data(get_full_test_json())
+        assert state.ids[state.you] == "snake-508e96ac-94ad-11ea-bb37"
+        assert state.head(state.you) == state.cell({'x': 0, 'y': 0})
+        assert not state.is_free(state.cell({'x': 2, 'y': 0}))
+        assert not state.is_free(state.cell({'x': 6, 'y': 2}))
+        assert not state.is_free(state.cell({'x': 3, 'y': 2}))
+        assert state.is_free(state.cell({'x': 0, 'y': 1}))
+
+    def test_neighbors_stay_on_board(self):
+        state = GameState.from_data(get_full_test_json())
+        corner = state.cell({'x': 0, 'y': 0})
+        assert state.neighbor(corner, "left") == -1
+        assert state.neighbor(corner, "down") == -1
+        assert state.neighbor(corner, "up") == state.cell({'x': 0, 'y': 1})
+        assert state.neighbor(corner, "right") == state.cell({'x': 1, 'y': 0})
+        top_right = state.cell({'x': 10, 'y': 10})
+        assert state.neighbor(top_right, "up") == -1
+        assert state.neighbor(top_right, "right") == -1
+
+    def test_move_and_undo(self):
+        state = GameState.from_data(get_full_test_json())
+        occupied = bytes(state.occupied)
+        body = list(state.bodies[state.you])
+
+        record = state.move_snake(state.you, state.cell({'x': 0, 'y': 1}))
+        assert state.head(state.you) == state.cell({'x': 0, 'y': 1})
+        assert state.is_free(state.cell({'x': 2, 'y': 0}))
+        state.undo(record)
+
+        assert bytes(state.occupied) == occupied
+        assert list(state.bodies[state.you]) == body
+
+    def test_move_and_undo_eating(self):
+        data = get_full_test_json()
+        data['board']['food'].append({'x': 0, 'y': 1})
+        state = GameState.from_data(data)
+        food = set(state.food)
+
+        record = state.move_snake(state.you, state.cell({'x': 0, 'y': 1}))
+        assert len(state.bodies[state.you]) == 4
+        assert not state.is_free(state.cell({'x': 2, 'y': 0}))
+        assert state.cell({'x': 0, 'y': 1}) not in state.food
+        state.undo(record)
+
+        assert len(state.bodies[state.you]) == 3
+        assert state.food == food
+
+class SearchTest(unittest.TestCase):
+    def third_move_position(self):
+        full_data = get_full_test_json()
+        full_data["board"]['snakes'][0]['body'] = [{"x": 2, "y": 2}, {"x": 2, "y": 3}, {"x": 2, "y": 4}]
+        full_data["board"]['snakes'][1]['body'] = [
+            {"x": 3, "y": 1}, {"x": 3, "y": 0}, {"x": 2, "y": 0}, {"x": 1, "y": 0},
+            {"x": 0, "y": 0}, {"x": 0, "y": 1}, {"x": 0, "y": 2}, {"x": 1, "y": 2},
+        ]
+        full_data["board"]['food'] = [{'x': 1, 'y': 1}]
+        full_data["board"]['hazards'] = []
+        return full_data
+
+    def test_time_budget_uses_game_timeout(self):
+        data = get_full_test_json()
+        assert abs(time_budget(data, 100) - 0.15) < 1e-9
+        data['game']['timeout'] = 1000
+        assert abs(time_budget(data, 100) - 0.4) < 1e-9
+        # Never goes to zero even with a terrible connection
+        assert time_budget(data, 5000) > 0
+
+    def test_network_overhead(self):
+        data = get_full_test_json()
+        assert network_overhead(data, None) is None
+        assert network_overhead(data, 11) == 100
+        data['you']['latency'] = ""
+        assert network_overhead(data, 11) is None
+
+    def test_iterative_deepening_stops_when_choice_is_made(self):
+        state = GameState.from_data(self.third_move_position())
+        head = state.cell({"x": 2, "y": 2})
+        moves, depth = Search(state, moving_tails=False).iterative_deepening(head, ["up", "down", "left", "right"])
+        assert moves == ['right']
+        assert depth == 3
+
+    def test_survival_depth_per_move(self):
+        state = GameState.from_data(self.third_move_position())
+        head = state.cell({"x": 2, "y": 2})
+        depths = Search(state, moving_tails=False).survival_depths(head, ["up", "down", "left", "right"])
+        assert depths == {'up': 0, 'down': 2, 'left': 0, 'right': 3}
+
+    def test_opponent_tails_move_away(self):
+        # The long snake's tail at (1, 2) is gone by the time we get there, and so is the rest of the pocket
+        state = GameState.from_data(self.third_move_position())
+        head = state.cell({"x": 2, "y": 2})
+        depths = Search(state).survival_depths(head, ["up", "down", "left", "right"], max_depth=10)
+        assert depths == {'up': 0, 'down': 10, 'left': 10, 'right': 10}
+
+    def test_opponent_next_to_food_keeps_its_tail(self):
+        data = self.third_move_position()
+        data['board']['food'] = [{'x': 4, 'y': 1}]
+        state = GameState.from_data(data)
+        free_at, counts = opponent_timings(state)
+        tail = state.cell({'x': 1, 'y': 2})
+        assert free_at[tail] == 2
+        assert counts[tail] == 1
+        assert counts[state.head(state.you)] == 0
+
+    def test_children_go_straight_first(self):
+        table = straight_first_table(11, 11)
+        cell = 5 * 11 + 5
+        for move in ("up", "down", "left", "right"):
+            assert table[cell][MOVE_INDEX[move]][0][0] == move
+            assert sorted(table[cell][MOVE_INDEX[move]]) == sorted(neighbor_table(11, 11)[cell])
+        # Against the wall straight on isn't there, the rest still is
+        assert [move for move, _ in table[0][MOVE_INDEX["left"]]] == ["up", "right"]
+
+    def test_iterative_deepening_keeps_last_completed_depth(self):
+        data = get_full_test_json()
+        data['board']['snakes'][0]['body'] = [{"x": 8, "y": 8}, {"x": 8, "y": 9}, {"x": 8, "y": 10}]
+        state = GameState.from_data(data)
+        head = state.cell({"x": 8, "y": 8})
+        # A deadline in the past stops the search at the first clock check
+        search = Search(state, deadline=0)
+        moves, depth = search.iterative_deepening(head, ["up", "down", "left", "right"])
+        assert 0 < depth < 40
+        assert set(moves) == set(["down", "left", "right"])
+
+class NeighborTableTest(unittest.TestCase):
+    def test_step_table(self):
+        table = step_table(3, 2)
+        # 3 4 5
+        # 0 1 2
+        assert table[0] == (3, -1, -1, 1)
+        assert table[4] == (-1, 1, 3, 5)
+        assert table[5] == (-1, 2, 4, -1)
+
+    def test_neighbor_table_skips_off_board(self):
+        table = neighbor_table(3, 2)
+        assert table[0] == (("up", 3), ("right", 1))
+        assert table[1] == (("up", 4), ("left", 0), ("right", 2))
+
+    def test_tables_are_built_once(self):
+        assert step_table(11, 11) is step_table(11, 11)
+        first = GameState.from_data(get_full_test_json())
+        second = GameState.from_data(get_full_test_json())
+        assert first.neighbors is second.neighbors
+
+    def test_neighbor_matches_relative_movement(self):
+        state = GameState.from_data(get_full_test_json())
+        for cell in range(11 * 11):
+            point = state.point(cell)
+            for move, offset in relative_movement.items():
+                where_to = {'x': point['x'] + offset['x'], 'y': point['y'] + offset['y']}
+                expected = state.cell(where_to) if in_board_limits(get_full_test_json()['board'], where_to) else -1
+                assert state.neighbor(cell, move) == expected
+
+class TranspositionTest(unittest.TestCase):
+    def test_hash_is_restored_by_undo(self):
+        data = get_full_test_json()
+        data['board']['food'].append({'x': 0, 'y': 1})
+        state = GameState.from_data(data)
+        initial = state.hash
+
+        first = state.move_snake(state.you, state.cell({'x': 0, 'y': 1}))
+        second = state.move_snake(state.you, state.cell({'x': 0, 'y': 2}))
+        assert state.hash != initial
+        state.undo(second)
+        state.undo(first)
+
+        assert state.hash == initial
+
+    def test_incremental_hash_matches_full_hash(self):
+        state = GameState.from_data(get_full_test_json())
+        state.move_snake(state.you, state.cell({'x': 0, 'y': 1}))
+        state.move_snake(state.you, state.cell({'x': 1, 'y': 1}))
+        incremental = state.hash
+        state.rehash()
+        assert state.hash == incremental
+
+    def test_move_orders_reach_same_hash(self):
+        data = get_full_test_json()
+        data['board']['snakes'][0]['body'] = [{"x": 8, "y": 8}]
+        up_left = GameState.from_data(data)
+        up_left.move_snake(up_left.you, up_left.cell({'x': 8, 'y': 9}))
+        up_left.move_snake(up_left.you, up_left.cell({'x': 7, 'y': 9}))
+        left_up = GameState.from_data(data)
+        left_up.move_snake(left_up.you, left_up.cell({'x': 7, 'y': 8}))
+        left_up.move_snake(left_up.you, left_up.cell({'x': 7, 'y': 9}))
+        assert up_left.bodies[0] == left_up.bodies[0]
+        assert up_left.hash == left_up.hash
+
+    def test_probe_depth_rules(self):
+        table = TranspositionTable()
+        table.store(1, 5, True)
+        table.store(2, 3, False)
+        assert table.probe(1, 4) is True
+        assert table.probe(1, 6) is None
+        assert table.probe(2, 4) is False
+        assert table.probe(2, 2) is None
+        assert table.hits == 2
+        assert table.misses == 2
+
+    def test_lru_eviction(self):
+        table = TranspositionTable(max_entries=2)
+        table.store(1, 1, True)
+        table.store(2, 1, True)
+        table.probe(1, 1)
+        table.store(3, 1, True)
+        assert len(table) == 2
+        assert table.probe(2, 1) is None
+        assert table.probe(1, 1) is True
+
+    def test_search_with_table_gives_same_answer(self):
+        state = GameState.from_data(get_full_test_json())
+        head = state.cell({"x": 0, "y": 0})
+        moves = ["up", "down", "left", "right"]
+        table = TranspositionTable()
+        with_table = Search(state, table=table)
+        assert with_table.safe_moves(head, moves, 5) == Search(state).safe_moves(head, moves, 5)
+        assert table.stats()['entries'] > 0
+
+class StepTest(unittest.TestCase):
+    def duel(self, me, them, food=()):
+        data = get_full_test_json()
+        data['board']['snakes'][0]['body'] = [{'x': x, 'y': y} for x, y in me]
+        data['board']['snakes'][1]['body'] = [{'x': x, 'y': y} for x, y in them]
+        data['board']['food'] = [{'x': x, 'y': y} for x, y in food]
+        data['board']['hazards'] = []
+        return GameState.from_data(data)
+
+    def snapshot(self, state):
+        return (bytes(state.occupied), [list(body) for body in state.bodies], list(state.health),
+                list(state.alive), set(state.food), state.hash)
+
+    def test_moves_everyone_and_decays_health(self):
+        state = self.duel([(1, 1), (1, 0), (0, 0)], [(5, 5), (5, 4), (5, 3)])
+        state.step(["up", "right"])
+        assert state.head(0) == state.cell({'x': 1, 'y': 2})
+        assert state.head(1) == state.cell({'x': 6, 'y': 5})
+        assert state.health == [53, 15]
+        assert state.alive == [True, True]
+        assert state.is_free(state.cell({'x': 0, 'y': 0}))
+
+    def test_eating_grows_and_heals(self):
+        state = self.duel([(1, 1), (1, 0), (0, 0)], [(5, 5), (5, 4), (5, 3)], food=[(1, 2)])
+        state.step(["up", "up"])
+        assert len(state.bodies[0]) == 4
+        assert state.health[0] == 100
+        assert not state.food
+        assert not state.is_free(state.cell({'x': 1, 'y': 0}))
+
+    def test_head_to_head_smaller_dies(self):
+        state = self.duel([(1, 1), (1, 0), (0, 0)], [(3, 1), (4, 1), (5, 1), (6, 1)])
+        state.step(["right", "left"])
+        assert state.alive == [False, True]
+
+    def test_head_to_head_same_length_both_die(self):
+        state = self.duel([(1, 1), (1, 0), (0, 0)], [(3, 1), (4, 1), (5, 1)])
+        state.step(["right", "left"])
+        assert state.alive == [False, False]
+
+    def test_body_collision_and_walls(self):
+        state = self.duel([(0, 1), (0, 0), (1, 0)], [(1, 2), (1, 1), (2, 1), (3, 1)])
+        state.step(["left", "up"])
+        assert state.alive == [False, True]
+        state = self.duel([(2, 0), (3, 0), (4, 0)], [(1, 2), (1, 1), (2, 1), (3, 1)])
+        state.step(["up", "up"])
+        assert state.alive == [False, True]
+
+    def test_following_a_tail_is_fine(self):
+        state = self.duel([(2, 3), (1, 3), (0, 3)], [(3, 1), (2, 1), (2, 2)])
+        state.step(["down", "down"])
+        assert state.alive == [True, True]
+
+    def test_hazard_damage(self):
+        data = get_full_test_json()
+        data['game']['ruleset']['settings'] = {'hazardDamagePerTurn': 20}
+        state = GameState.from_data(data)
+        state.step(["up", "right"])
+        state.step(["up", "up"])
+        state.step(["right", "up"])
+        state.step(["right", "up"])
+        state.step(["right", "up"])
+        # (3, 2) is a hazard: one from moving, twenty from the hazard
+        assert state.head(0) == state.cell({'x': 3, 'y': 2})
+        assert state.health[0] == 54 - 5 - 20
+
+    def test_undo_step(self):
+        state = self.duel([(1, 1), (1, 0), (0, 0)], [(3, 1), (4, 1), (5, 1), (6, 1)], food=[(2, 1)])
+        before = self.snapshot(state)
+        first = state.step(["up", "left"])
+        second = state.step(["right", "down"])
+        incremental = state.hash
+        state.rehash()
+        assert state.hash == incremental
+        state.undo_step(second)
+        state.undo_step(first)
+        assert self.snapshot(state) == before
+
+    def test_policies_pick_safe_moves(self):
+        state = self.duel([(0, 1), (0, 0), (1, 0)], [(5, 5), (5, 4), (5, 3)], food=[(8, 5)])
+        assert first_safe_policy(state, 0) == "up"
+        assert greedy_food_policy(state, 1) == "right"
+
+    def test_search_with_opponent_policy(self):
+        state = GameState.from_data(get_full_test_json())
+        search = Search(state, opponent_policy=greedy_food_policy)
+        moves = search.safe_moves(state.head(state.you), ["up", "down", "left", "right"], 4)
+        assert moves == ["up"]
+
+class MinimaxTest(unittest.TestCase):
+    duel = StepTest.duel
+    snapshot = StepTest.snapshot
+
+    def test_kills_trapped_opponent_head_to_head(self):
+        # They are in the corner and can only go to (1, 0), we are longer and get there too
+        state = self.duel([(2, 0), (3, 0), (4, 0), (5, 0)], [(0, 0), (0, 1), (0, 2)])
+        search = minimax.Minimax(state)
+        move, depth, score = search.search(["up", "left", "right"], max_depth=4)
+        assert move == "left"
+        assert score == minimax.WIN - 1
+        assert depth == 1
+
+    def test_avoids_longer_snake(self):
+        state = self.duel([(3, 3), (3, 2), (3, 1)], [(5, 3), (6, 3), (7, 3), (8, 3)])
+        move, _, _ = minimax.Minimax(state).search(["right", "up", "left"], max_depth=2)
+        assert move != "right"
+
+    def test_restores_state_and_counts_nodes(self):
+        state = self.duel([(3, 3), (3, 2), (3, 1)], [(7, 7), (7, 6), (7, 5)], food=[(5, 5)])
+        before = self.snapshot(state)
+        search = minimax.Minimax(state, deadline=time.perf_counter() + 0.05)
+        move, depth, _ = search.search(["up", "down", "left", "right"])
+        assert move in ("up", "down", "left", "right")
+        assert depth >= 1
+        assert search.nodes > 0
+        assert self.snapshot(state) == before
+
+    def test_keeps_to_the_deadline_on_big_boards(self):
+        # Every leaf is a full board Voronoi, checking the clock every few hundred nodes overshot by tens of ms
+        state = arena.new_game(3, 19, random.Random(0))
+        minimax.Minimax(state).evaluate()
+        started = time.perf_counter()
+        minimax.Minimax(state, deadline=started + 0.01).search(["up", "down", "left", "right"])
+        assert time.perf_counter() - started < 0.03
+
+    def test_skips_dead_opponents(self):
+        state = arena.new_game(3, 11, random.Random(0))
+        search = minimax.Minimax(state)
+        state.alive[2] = False
+        ordered = search.ordered
+        searched = set()
+
+        def recording(snake, ply):
+            searched.add(snake)
+            return ordered(snake, ply)
+
+        search.ordered = recording
+        search.search(["up", "down", "left", "right"], max_depth=2)
+        assert searched == {0, 1}
+
+    def test_applies_with_few_snakes(self):
+        state = GameState.from_data(get_full_test_json())
+        assert minimax.applies(state)
+        state.alive[1] = False
+        assert not minimax.applies(state)
+
+class RulesetTest(unittest.TestCase):
+    def game(self, ruleset, **settings):
+        data = get_full_test_json()
+        data['game']['ruleset'] = {'name': ruleset, 'version': "v1", 'settings': settings}
+        return GameState.from_data(data)
+
+    def test_wrapped_moves_come_back_on_the_other_side(self):
+        state = self.game("wrapped")
+        corner = state.cell({'x': 0, 'y': 0})
+        assert state.neighbor(corner, "left") == state.cell({'x': 10, 'y': 0})
+        assert state.neighbor(corner, "down") == state.cell({'x': 0, 'y': 10})
+        assert len(state.neighbors[corner]) == 4
+        state.step(["down", "right"])
+        assert state.alive[state.you]
+        assert state.head(state.you) == state.cell({'x': 0, 'y': 10})
+
+    def test_royale_walks_through_hazards(self):
+        state = self.game("royale", hazardDamagePerTurn=14)
+        hazard = state.cell({'x': 3, 'y': 2})
+        assert state.is_free(hazard)
+        assert not self.game("standard").is_free(hazard)
+        assert free_after(state)[hazard] == 0
+
+    def test_search_pays_hazard_damage(self):
+        data = get_full_test_json()
+        data['game']['ruleset'] = {'name': "royale", 'version': "v1", 'settings': {'hazardDamagePerTurn': 14}}
+        # Up is the only way out of the corner
+        data['board']['hazards'] = [{'x': 0, 'y': 1}]
+        state = GameState.from_data(data)
+        head = state.head(state.you)
+        assert Search(state).safe_moves(head, ["up"], 3) == ["up"]
+        state.health[state.you] = 15
+        assert Search(state).safe_moves(head, ["up"], 3) == []
+
+    def test_constrictor_always_grows(self):
+        state = self.game("constrictor")
+        lengths = [len(body) for body in state.bodies]
+        record = state.step(["up", "right"])
+        assert [len(body) for body in state.bodies] == [length + 1 for length in lengths]
+        assert state.health == [100, 100]
+        state.undo_step(record)
+        assert [len(body) for body in state.bodies] == lengths
+        move = state.move_snake(state.you, state.cell({'x': 0, 'y': 1}))
+        assert len(state.bodies[state.you]) == lengths[state.you] + 1
+        state.undo(move)
+        assert [len(body) for body in state.bodies] == lengths
+
+    def test_search_sees_starving(self):
+        data = get_full_test_json()
+        data['board']['snakes'][0]['health'] = 2
+        data['board']['snakes'][0]['body'] = [{"x": 8, "y": 8}, {"x": 8, "y": 7}, {"x": 8, "y": 6}]
+        state = GameState.from_data(data)
+        assert Search(state).safe_moves(state.head(state.you), ["up", "left", "right"], 1) == ["up", "left", "right"]
+        assert Search(state).safe_moves(state.head(state.you), ["up", "left", "right"], 2) == []
+
+class BookTest(unittest.TestCase):
+    def mirrored(self, data):
+        """The same position flipped left to right"""
+        mirrored = get_full_test_json()
+        width = data['board']['width']
+        for snake, original in zip(mirrored['board']['snakes'], data['board']['snakes']):
+            snake['body'] = [{'x': width - 1 - point['x'], 'y': point['y']} for point in original['body']]
+        for key in ('food', 'hazards'):
+            mirrored['board'][key] = [{'x': width - 1 - point['x'], 'y': point['y']} for point in data['board'][key]]
+        return mirrored
+
+    def pocket(self):
+        # We're stacked at (2, 0) with hazards walling off a dead end to the left
+        # and a 2x2 room we can loop around in to the right
+        data = get_full_test_json()
+        data['board']['snakes'][0]['body'] = [{'x': 2, 'y': 0}] * 3
+        data['board']['snakes'][1]['body'] = [{'x': 8, 'y': 8}, {'x': 8, 'y': 7}, {'x': 8, 'y': 6}]
+        data['board']['food'] = []
+        walls = [(x, 1) for x in range(4)] + [(4, 2), (5, 2), (6, 0), (6, 1)]
+        data['board']['hazards'] = [{'x': x, 'y': y} for x, y in walls]
+        return data
+
+    def test_moves_go_back_through_every_symmetry(self):
+        for symmetry in SYMMETRIES:
+            for move in ("up", "down", "left", "right"):
+                assert move_from_canonical(move_to_canonical(move, symmetry), symmetry) == move
+
+    def test_mirrored_positions_share_a_key(self):
+        data = get_full_test_json()
+        key, symmetry = canonical_key(GameState.from_data(data))
+        mirrored_key, mirrored_symmetry = canonical_key(GameState.from_data(self.mirrored(data)))
+        assert key == mirrored_key
+        # A move stored for one comes back mirrored for the other
+        stored = move_to_canonical("right", symmetry)
+        assert move_from_canonical(stored, mirrored_symmetry) == "left"
+
+    def test_book_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "book.bin")
+            book.write_book(path, {5: "up", 1: "left", 3: "down"})
+            opened = book.Book(path)
+            assert len(opened) == 3
+            assert [opened.get(key) for key in (1, 3, 5)] == ["left", "down", "up"]
+            assert opened.get(2) is None
+            opened.close()
+
+    def test_opening_lookup_mirrored(self):
+        data = get_full_test_json()
+        data['turn'] = 0
+        key, symmetry = book.opening_key(GameState.from_data(data))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "book.bin")
+            book.write_book(path, {key: move_to_canonical("up", symmetry)})
+            opened = book.Book(path)
+            assert book.lookup(GameState.from_data(self.mirrored(data)), 0, opened) == "up"
+            # Past the opening only the endgame part is looked at
+            assert book.lookup(GameState.from_data(data), 50, opened) is None
+            opened.close()
+
+    def test_endgame_region_is_solved(self):
+        state = GameState.from_data(self.pocket())
+        free_at = free_after(state)
+        region = book.sealed_region(state, free_at)
+        assert len(region) == 7
+        turns = book.survival_turns(state, region, free_at)
+        assert turns == {'left': 2, 'right': book.HORIZON}
+        assert book.best_endgame_move(state, region, free_at) == "right"
+
+    def test_endgame_lookup_anywhere_on_the_board(self):
+        state = GameState.from_data(self.pocket())
+        free_at = free_after(state)
+        region = book.sealed_region(state, free_at)
+        key, symmetry = book.endgame_key(state, region, free_at)
+        mirrored = GameState.from_data(self.mirrored(self.pocket()))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "book.bin")
+            book.write_book(path, {key: move_to_canonical("right", symmetry)})
+            opened = book.Book(path)
+            assert book.lookup(mirrored, 50, opened) == "left"
+            opened.close()
+
+    def test_endgame_key_knows_whose_segments(self):
+        data = self.pocket()
+        data['board']['snakes'][0]['body'] = [{'x': 2, 'y': 0}, {'x': 3, 'y': 0}, {'x': 3, 'y': 0}]
+        ours = GameState.from_data(data)
+        free_at = free_after(ours)
+        region = book.sealed_region(ours, free_at)
+        assert ours.cell({'x': 3, 'y': 0}) in region
+        # Same timings, but (3, 0) is an opponent's
+        data['board']['snakes'][0]['body'] = [{'x': 2, 'y': 0}] * 3
+        theirs = GameState.from_data(data)
+        assert book.endgame_key(ours, region, free_at)[0] != book.endgame_key(theirs, region, free_at)[0]
+
+    def test_open_board_is_not_sealed(self):
+        state = GameState.from_data(get_full_test_json())
+        assert book.sealed_region(state, free_after(state)) is None
+
+class ParallelTest(unittest.TestCase):
+    def test_survival_depth(self):
+        data = SearchTest().third_move_position()
+        deadline = time.time() + 1
+        assert parallel.survival_depth(data, "up", deadline) == ("up", 0)
+        assert parallel.survival_depth(data, "down", deadline, max_depth=5) == ("down", 5)
+        assert parallel.survival_depth(data, "right", deadline, max_depth=5) == ("right", 5)
+
+    def test_parallel_safe_moves(self):
+        assert parallel.start_pool(2)
+        try:
+            data = SearchTest().third_move_position()
+            moves, depth = parallel.parallel_safe_moves(
+                data, ["up", "down", "left", "right"], time.perf_counter() + 0.2)
+            assert moves == ["down", "left", "right"]
+            assert depth > 2
+        finally:
+            parallel.stop_pool()
+        assert not parallel.pool_running()
+    def test_batch_safe_moves(self):
+        assert parallel.start_pool(2)
+        try:
+            data = SearchTest().third_move_position()
+            deadline = time.perf_counter() + 0.2
+            results = parallel.batch_safe_moves([
+                (data, ["up", "down", "left", "right"], deadline),
+                (get_full_test_json(), ["up", "right"], deadline),
+            ])
+            assert results[0][0] == ["down", "left", "right"]
+            assert results[1][0] == ["up"]
+        finally:
+            parallel.stop_pool()
+
+    def crowded_games(self, games):
+        rng = random.Random(3)
+        batch = []
+        while len(batch) < games:
+            state = arena.new_game(8, 19, rng)
+            for _ in range(8):
+                state.step([first_safe_policy(state, snake) if alive else None
+                            for snake, alive in enumerate(state.alive)])
+            if state.alive[0]:
+                batch.append(arena.request_data(state, 0, f"crowded-{len(batch)}", 8, 500, [""] * 8))
+        return batch
+
+    def test_more_moves_than_workers(self):
+        # 48 root moves for 2 workers, every game still has its moves searched
+        batch = self.crowded_games(12)
+        assert parallel.start_pool(2)
+        try:
+            deadline = time.perf_counter() + 0.03
+            results = parallel.batch_safe_moves([(data, ["up", "down", "left", "right"], deadline) for data in batch])
+        finally:
+            parallel.stop_pool()
+        for data, (moves, depth) in zip(batch, results):
+            state = GameState.from_data(data)
+            safe = Search(state).safe_moves(state.head(state.you), ["up", "down", "left", "right"], 1)
+            assert depth >= 1
+            assert set(moves) <= set(safe)
+
+    def test_settle_keeps_unevaluated_moves(self):
+        data = SearchTest().third_move_position()
+        # Only "down" came back from the pool, "up" hits a wall, "left" and "right" are unknown but don't
+        assert parallel.settle(data, ["up", "down", "left", "right"], {"down": 3}) == (["down", "left", "right"], 3)
+        assert parallel.settle(data, ["up", "down", "left", "right"], {"up": 0, "down": 3}) == (["down", "left", "right"], 3)
+        moves, depth = parallel.settle(data, ["up", "down", "left", "right"], {"up": 0})
+        assert moves == ["down", "left", "right"] and depth >= 1
+        # Nothing came back, it's all searched here
+        moves, depth = parallel.settle(data, ["up", "down", "left", "right"], {})
+        assert moves == ["down", "left", "right"] and depth >= 1
+
+class MCTSTest(unittest.TestCase):
+    def test_goes_for_the_food_it_needs(self):
+        data = get_full_test_json()
+        data['board']['snakes'][0]['body'] = [{"x": 8, "y": 8}, {"x": 8, "y": 7}, {"x": 8, "y": 6}]
+        data['board']['snakes'][0]['health'] = 1
+        data['board']['food'] = [{"x": 7, "y": 8}]
+        state = GameState.from_data(data)
+        tree = mcts.MCTS(random.Random(1))
+        tree.run(state, time.perf_counter() + 5, max_playouts=300)
+        assert tree.best_move() == "left"
+        assert tree.stats()['playouts'] == 300
+        assert tree.stats()['playouts_per_second'] > 0
+
+    def test_run_leaves_state_untouched(self):
+        state = GameState.from_data(get_full_test_json())
+        before = StepTest().snapshot(state)
+        mcts.MCTS(random.Random(2)).run(state, time.perf_counter() + 5, max_playouts=50)
+        assert StepTest().snapshot(state) == before
+
+    def test_tree_is_reused_on_next_turn(self):
+        data = get_full_test_json()
+        data['game']['id'] = 'mcts-reuse'
+        state = GameState.from_data(data)
+        game = game_cache.GameContext('mcts-reuse')
+        move = mcts.choose_move(game, data, state, time.perf_counter() + 0.05)
+        assert move == "up"
+        tree = game.mcts
+        assert tree.turn == data['turn'] + 1
+        assert tree.root.visits > 0
+
+        data['turn'] += 1
+        mcts.choose_move(game, data, state, time.perf_counter() + 0.01)
+        assert game.mcts is tree
+
+    def test_engine_is_selected_per_game(self):
+        data = get_full_test_json()
+        data['game']['id'] = 'mcts-engine'
+        select_engine(data, 'mcts')
+        move, shout = choose_move(data)
+        assert move == 'up'
+        assert game_cache.games.get(data).mcts is not None
+        with self.assertRaises(ValueError):
+            select_engine(data, 'magic')
+        # Gone with the game
+        game_cache.games.end(data)
+        assert game_cache.games.get(data).engine is None
+
+    def test_no_time_left_still_avoids_walls(self):
+        data = SearchTest().third_move_position()
+        decision = server_logic.Decision(data, "mcts", None, time.perf_counter())
+        decision.search(time.perf_counter() - 1)
+        assert decision.searching
+        assert decision.moves == ["down", "left", "right"]
+
+class FloodFillTest(unittest.TestCase):
+    def test_free_after(self):
+        state = GameState.from_data(get_full_test_json())
+        free_at = free_after(state)
+        assert free_at[state.cell({'x': 0, 'y': 0})] == 3
+        assert free_at[state.cell({'x': 2, 'y': 0})] == 1
+        assert free_at[state.cell({'x': 5, 'y': 4})] == 4
+        assert free_at[state.cell({'x': 3, 'y': 2})] == BLOCKED
+        assert free_at[state.cell({'x': 0, 'y': 1})] == 0
+
+    def test_stacked_tail_frees_with_last_segment(self):
+        data = get_full_test_json()
+        data['board']['snakes'][0]['body'] = [{"x": 1, "y": 1}, {"x": 1, "y": 2}, {"x": 1, "y": 2}]
+        state = GameState.from_data(data)
+        assert free_after(state)[state.cell({'x': 1, 'y': 2})] == 2
+
+    def test_reachable_area_counts_tails_moving_away(self):
+        # Our own body closes the corner pocket, but the tail is gone by the time we'd get there
+        data = get_full_test_json()
+        data['board']['snakes'][0]['body'] = [
+            {"x": 1, "y": 1}, {"x": 1, "y": 2}, {"x": 0, "y": 2}, {"x": 0, "y": 3}]
+        data['board']['hazards'] = []
+        state = GameState.from_data(data)
+        free_at = free_after(state)
+        pocket = state.cell({'x': 0, 'y': 1})
+        assert reachable_area(state, pocket, free_at) > 100
+        assert reachable_area(state, pocket, free_at, limit=10) == 10
+        assert reachable_area(state, state.cell({'x': 1, 'y': 2}), free_at) == 0
+        assert reachable_area(state, -1, free_at) == 0
+
+    def test_reachable_area_sees_dead_ends(self):
+        data = SearchTest().third_move_position()
+        data['board']['snakes'][1]['body'].extend([{"x": 1, "y": 3}, {"x": 1, "y": 4}, {"x": 1, "y": 5}])
+        state = GameState.from_data(data)
+        free_at = free_after(state)
+        # Down goes into the pocket around the food, right has the whole board
+        assert reachable_area(state, state.cell({'x': 2, 'y': 1}), free_at) == 2
+        assert reachable_area(state, state.cell({'x': 3, 'y': 2}), free_at) > 50
+
+    def test_voronoi(self):
+        state = GameState.from_data(get_full_test_json())
+        territory = voronoi(state)
+        assert len(territory) == 2
+        # We're stuck in the corner, the other snake sits in the middle
+        assert territory[1] > territory[0] > 0
+        # Heads and the hazard belong to nobody
+        assert sum(territory) <= 11 * 11 - 3
+
+    def test_weight_for_food_avoids_pockets(self):
+        data = SearchTest().third_move_position()
+        data['board']['snakes'][1]['body'].extend([{"x": 1, "y": 3}, {"x": 1, "y": 4}, {"x": 1, "y": 5}])
+        data['you']['length'] = 3
+        data['you']['body'] = data['board']['snakes'][0]['body']
+        moves = weight_for_food({"x": 2, "y": 2}, ["down", "right"], data['board']['food'], data)
+        # The food is down there, but so is a dead end
+        assert moves == ["right", "down"]
+
+@unittest.skipUnless(kernels.available(), "numpy is not installed")
+class KernelsTest(unittest.TestCase):
+    def random_points(self, rng, count):
+        return [{'x': rng.randrange(11), 'y': rng.randrange(11)} for _ in range(count)]
+
+    def test_same_weights_as_scalar_functions(self):
+        rng = random.Random(7)
+        moves = ["up", "down", "left", "right"]
+        for _ in range(200):
+            head = self.random_points(rng, 1)[0]
+            food = self.random_points(rng, rng.randrange(6))
+            positions = kernels.candidate_positions(head, moves)
+            distances = kernels.squared_distances(positions, kernels.points_array(food))
+            new_positions = [{'x': int(x), 'y': int(y)} for x, y in positions]
+            assert kernels.weights_by_min(distances).tolist() == [weight_by_min(pos, food) for pos in new_positions]
+            assert kernels.weights_by_max(distances).tolist() == [weight_by_max(pos, food) for pos in new_positions]
+            assert kernels.weights_by_sum(distances).tolist() == [weight_by_sum(pos, food) for pos in new_positions]
+
+    def test_same_enemy_weights(self):
+        data = get_full_test_json()
+        moves = ["up", "down", "left", "right"]
+        for head in ({'x': 5, 'y': 6}, {'x': 4, 'y': 4}, {'x': 6, 'y': 5}, {'x': 0, 'y': 0}):
+            positions = kernels.candidate_positions(head, moves)
+            new_positions = [{'x': int(x), 'y': int(y)} for x, y in positions]
+            assert kernels.weights_enemies(positions, data).tolist() == [weight_enemies(pos, data) for pos in new_positions]
+
+    def test_path_distances(self):
+        state = GameState.from_data(get_full_test_json())
+        starts = [state.cell({'x': 0, 'y': 1}), state.cell({'x': 1, 'y': 0}), -1]
+        targets = [state.cell({'x': 0, 'y': 3}), state.cell({'x': 9, 'y': 0})]
+        distances = kernels.path_distances(state, starts, targets)
+        assert distances.shape == (3, 2)
+        assert distances[0].tolist() == [2, 10]
+        # Our own neck, can't go there
+        assert distances[1].tolist() == [kernels.UNREACHABLE] * 2
+        assert distances[2].tolist() == [kernels.UNREACHABLE] * 2
+
+    def test_one_game_only_vectorized_with_lots_of_food(self):
+        data = get_full_test_json()
+        calls = []
+        original = kernels.food_and_enemy_weights
+
+        def counting(*args):
+            calls.append(len(args[2]))
+            return original(*args)
+
+        kernels.food_and_enemy_weights = counting
+        try:
+            weight_for_food(data['you']['head'], ["up", "down"], data['board']['food'], data)
+            lots = [{'x': x, 'y': y} for x in range(8) for y in range(8)]
+            weights = weight_for_food(data['you']['head'], ["up", "down"], lots,
+                                      dict(data, board=dict(data['board'], food=lots)))
+        finally:
+            kernels.food_and_enemy_weights = original
+        assert calls == ([64] if server_logic.VECTORIZED else [])
+        assert len(weights) == 2
+
+    def test_batched_weights_match_one_game_at_a_time(self):
+        rng = random.Random(3)
+        all_moves = ["up", "down", "left", "right"]
+        batch = []
+        for _ in range(30):
+            data = get_full_test_json()
+            data['board']['food'] = self.random_points(rng, rng.randrange(6))
+            data['board']['snakes'][1]['head'] = self.random_points(rng, 1)[0]
+            data['you']['length'] = rng.choice([3, 4, 5])
+            moves = rng.sample(all_moves, rng.randrange(1, 5))
+            batch.append((self.random_points(rng, 1)[0], moves, data['board']['food'], data, rng.random() < 0.5))
+        expected = [kernels.food_and_enemy_weights(*args) for args in batch]
+        assert kernels.batched_food_and_enemy_weights(batch) == expected
+
+class GameCacheTest(unittest.TestCase):
+    def game(self, game_id):
+        data = get_full_test_json()
+        data['game']['id'] = game_id
+        return data
+
+    def test_start_get_end(self):
+        cache = game_cache.GameCache()
+        data = self.game('cache-a')
+        started = cache.start(data)
+        assert cache.get(data) is started
+        cache.end(data)
+        assert game_cache.game_key(data) not in cache
+
+    def test_unknown_games_are_created(self):
+        cache = game_cache.GameCache()
+        data = self.game('cache-b')
+        assert cache.get(data).key == 'cache-b/snake-508e96ac-94ad-11ea-bb37'
+        assert len(cache) == 1
+
+    def test_snakes_in_the_same_game_are_kept_apart(self):
+        cache = game_cache.GameCache()
+        data = self.game('cache-c')
+        ours = cache.get(data)
+        data['you'] = data['board']['snakes'][1]
+        assert cache.get(data) is not ours
+
+    def test_least_recently_used_game_is_dropped(self):
+        cache = game_cache.GameCache(max_games=2)
+        cache.start(self.game('cache-1'))
+        cache.start(self.game('cache-2'))
+        cache.get(self.game('cache-1'))
+        cache.start(self.game('cache-3'))
+        assert game_cache.game_key(self.game('cache-1')) in cache
+        assert game_cache.game_key(self.game('cache-2')) not in cache
+        assert cache.stats()['games'] == 2
+
+    def test_idle_games_are_dropped(self):
+        cache = game_cache.GameCache(idle_seconds=60)
+        cache.start(self.game('cache-idle'))
+        cache.get(self.game('cache-idle')).last_used -= 61
+        cache.start(self.game('cache-busy'))
+        assert game_cache.game_key(self.game('cache-idle')) not in cache
+        assert game_cache.game_key(self.game('cache-busy')) in cache
+
+    def test_memory_cap(self):
+        # Room for about 1.5 tables of 1000 entries
+        cache = game_cache.GameCache(max_memory_mb=1.5 * 1000 * game_cache.TABLE_ENTRY_BYTES / 1024 / 1024)
+        for name in ('cache-big-1', 'cache-big-2'):
+            game = cache.get(self.game(name))
+            for key in range(1000):
+                game.table.store(key, 1, True)
+        cache.get(self.game('cache-big-2'))
+        assert game_cache.game_key(self.game('cache-big-1')) not in cache
+        assert cache.stats()['memory_bytes'] == 1000 * game_cache.TABLE_ENTRY_BYTES
+
+    def test_choose_move_keeps_game_state(self):
+        data = self.game('cache-move')
+        choose_move(data)
+        game = game_cache.games.get(data)
+        assert game.turn == data['turn']
+        assert game.last_elapsed_ms is not None
+        game_cache.games.end(data)
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.enabled = metrics.ENABLED
+        metrics.ENABLED = True
+
+    def tearDown(self):
+        metrics.ENABLED = self.enabled
+
+    def test_histogram(self):
+        histogram = metrics.Histogram("test_seconds", "A test", buckets=(0.1, 1.0), label="phase")
+        histogram.observe(0.05, "parse")
+        histogram.observe(0.1, "parse")
+        histogram.observe(5, "parse")
+        text = histogram.render()
+        assert 'test_seconds_bucket{phase="parse",le="0.1"} 2' in text
+        assert 'test_seconds_bucket{phase="parse",le="1.0"} 2' in text
+        assert 'test_seconds_bucket{phase="parse",le="+Inf"} 3' in text
+        assert 'test_seconds_count{phase="parse"} 3' in text
+        assert 'test_seconds_sum{phase="parse"} 5.15' in text
+
+    def test_unlabelled_histogram_and_counter(self):
+        histogram = metrics.Histogram("test_nodes", "A test", buckets=(10,))
+        histogram.observe(3)
+        counter = metrics.Counter("test_total", "A test")
+        counter.inc(2)
+        assert 'test_nodes_count 1' in histogram.render()
+        assert counter.render().endswith("test_total 2")
+
+    def test_disabled_records_nothing(self):
+        metrics.ENABLED = False
+        histogram = metrics.Histogram("test_off", "A test")
+        with metrics.timer(histogram, "phase"):
+            pass
+        histogram.observe(1)
+        assert not histogram.series
+
+    def test_disabled_only_in_its_thread(self):
+        histogram = metrics.Histogram("test_thread", "A test")
+        with metrics.disabled():
+            histogram.observe(1)
+            thread = threading.Thread(target=histogram.observe, args=(2,))
+            thread.start()
+            thread.join()
+        histogram.observe(3)
+        assert histogram.series[""][-1] == 2
+
+    def test_choose_move_is_instrumented(self):
+        moves = metrics.MOVE_SECONDS.series.get("", [0])[-1]
+        choose_move(get_full_test_json())
+        assert metrics.MOVE_SECONDS.series[""][-1] == moves + 1
+        assert "board" in metrics.PHASE_SECONDS.series
+        assert "snake_search_nodes_total" in metrics.render()
+
+class ArenaTest(unittest.TestCase):
+    duel = StepTest.duel
+
+    def setUp(self):
+        self.enabled = metrics.ENABLED
+
+    def tearDown(self):
+        metrics.ENABLED = self.enabled
+
+    def test_new_game(self):
+        state = arena.new_game(4, 11, random.Random(0))
+        assert len(state.bodies) == 4
+        assert all(len(body) == 3 and len(set(body)) == 1 for body in state.bodies)
+        assert len(state.food) == 5
+        data = arena.request_data(state, 2, "arena-test", 0, 500, [""] * 4)
+        assert data['you']['id'] == "snake-2"
+        assert GameState.from_data(data).hash == state.hash
+
+    def test_play_game(self):
+        result = arena.play_game(["lookahead", "lookahead:greedy"], seed=3, timeout=20, max_turns=15)
+        assert 0 < result['turns'] <= 15
+        assert [player['spec'] for player in result['players']] == ["lookahead", "lookahead:greedy"]
+        assert all(player['latencies'] for player in result['players'])
+        assert result['players'][0]['nodes'] > 0
+
+    def test_games_leave_the_position_cache_alone(self):
+        stats = position_cache.positions.stats()
+        arena.play_game(["lookahead", "lookahead"], seed=1, timeout=20, max_turns=5)
+        assert position_cache.positions.stats() == stats
+
+    def test_metrics_are_only_on_during_the_game(self):
+        metrics.ENABLED = False
+        arena.play_game(["lookahead", "lookahead"], seed=1, timeout=20, max_turns=2)
+        assert not metrics.ENABLED
+
+    def test_unreachable_server_misses_its_moves(self):
+        # Nothing listens on port 9, every move goes straight on instead of ending the run
+        result = arena.play_game(["lookahead", "http://127.0.0.1:9"], seed=3, timeout=20, max_turns=5)
+        server = result['players'][1]
+        assert server['missed'] == len(server['latencies']) > 0
+        assert result['players'][0]['missed'] == 0
+
+    def test_self_play(self):
+        [(moves, death_turns)] = list(arena.self_play(1, size=7, players=2, play_timeout=20, max_turns=30))
+        assert moves[0].turn == 0 and {move.snake for move in moves} == {0, 1}
+        last_turns = [max(move.turn for move in moves if move.snake == snake) for snake in range(2)]
+        for snake, death_turn in enumerate(death_turns):
+            assert death_turn is None or death_turn == last_turns[snake] + 1
+        assert not any(key.startswith("self-play") for key in game_cache.games.games)
+
+    def test_straight_on(self):
+        state = self.duel([(3, 3), (3, 2), (3, 1)], [(7, 7), (6, 7), (5, 7)])
+        assert arena.straight_on(state, 0) == "up"
+        assert arena.straight_on(state, 1) == "right"
+
+    def test_summary(self):
+        results = [
+            {'winner': "a", 'players': [{'spec': "a", 'latencies': [10.0, 30.0], 'nodes': 400},
+                                        {'spec': "b", 'latencies': [20.0], 'nodes': 0}]},
+            {'winner': None, 'players': [{'spec': "a", 'latencies': [20.0], 'nodes': 200},
+                                         {'spec': "b", 'latencies': [20.0], 'nodes': 0}]},
+        ]
+        summary = arena.summarize(["a", "b"], results)
+        assert summary['a']['wins'] == 1
+        assert summary['a']['win_rate'] == 0.5
+        assert summary['a']['mean_ms'] == 20.0
+        assert summary['a']['p99_ms'] == 30.0
+        assert summary['a']['nodes_per_second'] == 10000
+        assert summary['b']['wins'] == 0
+        assert summary['draws'] == 1
+
+    def test_wilson_interval(self):
+        low, high = arena.wilson_interval(50, 100)
+        assert 0.40 < low < 0.41 and 0.59 < high < 0.60
+        assert arena.wilson_interval(0, 0) == (0.0, 0.0)
+
+class ReplayTest(unittest.TestCase):
+    def record_game(self, directory, turns=3):
+        recorder = replay.Recorder(directory, flush_every=2)
+        data = get_full_test_json()
+        data['game']['id'] = "replay/../game"
+        recorder.record("start", data)
+        for turn in range(turns):
+            data['turn'] = turn
+            recorder.record("move", data, {"move": "up", "shout": ""})
+        recorder.record("end", data)
+        return recorder.path(data['game']['id'])
+
+    def test_recording_is_appended_and_readable(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.record_game(directory)
+            assert os.path.dirname(path) == directory
+            records = replay.read_recording(path)
+            assert [record['kind'] for record in records] == ["start", "move", "move", "move", "end"]
+            assert records[1]['response'] == {"move": "up", "shout": ""}
+            assert [record['data']['turn'] for record in replay.recorded_moves(path)] == [0, 1, 2]
+
+    def test_flush_writes_pending_games(self):
+        with tempfile.TemporaryDirectory() as directory:
+            recorder = replay.Recorder(directory)
+            data = get_full_test_json()
+            recorder.record("start", data)
+            recorder.flush()
+            assert len(replay.read_recording(recorder.path(data['game']['id']))) == 1
+
+    def test_idle_games_are_written(self):
+        with tempfile.TemporaryDirectory() as directory:
+            recorder = replay.Recorder(directory, idle_seconds=0)
+            data = get_full_test_json()
+            recorder.record("start", data)
+            other = dict(data, game=dict(data['game'], id="other-game"))
+            # The next record after idle_seconds writes out every game that went quiet, itself included
+            recorder.record("start", other)
+            assert len(replay.read_recording(recorder.path(data['game']['id']))) == 1
+            assert not recorder.buffers and not recorder.last_record
+
+    def test_workers_append_to_the_same_game(self):
+        with tempfile.TemporaryDirectory() as directory:
+            workers = [replay.Recorder(directory), replay.Recorder(directory)]
+            data = get_full_test_json()
+            for turn in range(6):
+                workers[turn % 2].record("move", dict(data, turn=turn), {"move": "up", "shout": ""})
+            workers[1].record("end", data)
+            workers[0].flush()
+            path = workers[0].path(data['game']['id'])
+            assert [record['data']['turn'] for record in replay.recorded_moves(path)] == list(range(6))
+
+    def test_replay(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = self.record_game(directory)
+            result = replay.replay([path], repeat=2)
+        assert result['positions'] == 3
+        assert len(result['latencies']['11x11']) == 6
+        assert result['same_as_recorded'] == 1.0
+        assert result['stable'] == 1.0
+
+    def test_replay_searches_every_repeat(self):
+        stats = position_cache.positions.stats()
+        with tempfile.TemporaryDirectory() as directory:
+            replay.replay([self.record_game(directory)], repeat=3)
+        assert position_cache.positions.stats() == stats
+
+class WarmUpTest(unittest.TestCase):
+    def test_warm_up(self):
+        warmup.ready.clear()
+        position_cache.positions.clear()
+        choose_move(get_full_test_json())
+        before = position_cache.positions.stats()
+        warmup.warm_up()
+        # Real games' entries and stats are left alone, and nothing of the warm-up's goes in
+        assert position_cache.positions.stats() == before
+        assert warmup.ready.is_set()
+        assert straight_first_table.cache_info().currsize >= 2 * len(warmup.SIZES)
+        # The synthetic games don't stay in the cache
+        assert not any(key.startswith("warm-up") for key in game_cache.games.games)
+
+    def test_warm_up_is_not_in_metrics_or_logs(self):
+        enabled, logger = metrics.ENABLED, logs.logger
+        metrics.ENABLED = True
+        logs.logger = logs.Logger(io.StringIO(), level=logs.DEBUG)
+        try:
+            before = metrics.render()
+            warmup.warm_up()
+            assert metrics.render() == before
+            assert logs.logger.flush() and not logs.logger.stream.getvalue()
+        finally:
+            metrics.ENABLED, logs.logger = enabled, logger
+
+
+class EvaluationTest(unittest.TestCase):
+    def positions(self, count, size=11):
+        rng = random.Random(3)
+        return [GameState.from_data(arena.request_data(arena.new_game(2, size, rng), 0, "evaluation", 0, 500, ["", ""]))
+                for _ in range(count)]
+
+    def eats_model(self, weight):
+        # Linear, only looks at whether the move eats
+        weights = evaluation.np.zeros((evaluation.FEATURES, 1), dtype=evaluation.np.float32)
+        weights[-1] = weight
+        return evaluation.Model([(weights, evaluation.np.zeros(1, dtype=evaluation.np.float32))], 0, 1)
+
+    def test_features(self):
+        moves = ["up", "down", "left", "right"]
+        for size in (7, 19):
+            [state] = self.positions(1, size)
+            rows = evaluation.features(state, moves)
+            assert rows.shape == (4, evaluation.FEATURES)
+        # Snakes start next to the bottom left corner at (1, 1), with food at (2, 2)
+        state = GameState.from_data(arena.request_data(arena.new_game(1, 11, random.Random(0)), 0, "evaluation", 0,
+                                                       500, [""]))
+        assert state.head(state.you) == state.cell({'x': 1, 'y': 1})
+        planes = evaluation.board_planes(state, free_after(state))
+        padding = evaluation.PADDING
+        assert planes[0, padding - 1, padding + 1] == 1  # below the board
+        assert planes[0, padding + 1, padding + 1] == 1  # our body
+        assert planes[1, padding + 2, padding + 2] == 1  # the food
+        state.food.add(state.cell({'x': 1, 'y': 2}))
+        assert evaluation.features(state, ["up", "right"])[:, -1].tolist() == [1, 0]
+
+    def test_moves_off_the_board(self):
+        # Head on the left edge and on the top right corner, every move gets a whole row
+        for head in ({'x': 0, 'y': 5}, {'x': 10, 'y': 10}):
+            state = GameState(11, 11)
+            cell = state.cell(head)
+            state.bodies.append(deque([cell] * 3))
+            state.occupied[cell] += 3
+            state.ids.append("you")
+            state.health.append(100)
+            state.alive.append(True)
+            rows = evaluation.features(state, ["up", "down", "left", "right"])
+            assert rows.shape == (4, evaluation.FEATURES)
+        # The window of the move off the right edge: its left column is on the board, the rest is wall
+        side = evaluation.WINDOW * evaluation.WINDOW
+        blocked = rows[3, :side].reshape(evaluation.WINDOW, evaluation.WINDOW)
+        assert blocked[:, evaluation.RADIUS:].all()
+
+    def test_choose_move_trapped_on_the_edge(self):
+        # Nothing is safe, the lookahead gives back all four moves and the model scores moves off the board
+        data = get_full_test_json()
+        you = dict(data['you'], head={'x': 0, 'y': 5}, health=100,
+                   body=[{'x': 0, 'y': 5}, {'x': 1, 'y': 5}, {'x': 1, 'y': 4}, {'x': 0, 'y': 4},
+                         {'x': 0, 'y': 3}, {'x': 1, 'y': 3}, {'x': 2, 'y': 3}, {'x': 2, 'y': 4},
+                         {'x': 2, 'y': 5}, {'x': 2, 'y': 6}, {'x': 1, 'y': 6}, {'x': 0, 'y': 6},
+                         {'x': 0, 'y': 7}])
+        you['length'] = len(you['body'])
+        data = dict(data, you=you, board=dict(data['board'], snakes=[you], hazards=[], food=[]),
+                    game=dict(data['game'], id="evaluation-trapped"))
+        loaded = evaluation.loaded
+        evaluation.loaded = self.eats_model(1)
+        try:
+            move, _ = choose_move(data)
+        finally:
+            evaluation.loaded = loaded
+        assert move in ("up", "down", "left", "right")
+
+    def test_batched_scores(self):
+        model = evaluation.train(evaluation.np.random.default_rng(0).random((50, evaluation.FEATURES)),
+                                 evaluation.np.random.default_rng(1).random(50), hidden=8, epochs=20)
+        positions = [(state, ["up", "right", "left"]) for state in self.positions(3)]
+        batched = evaluation.score_moves(positions, model)
+        single = [evaluation.score_moves([position], model)[0] for position in positions]
+        assert [len(scores) for scores in batched] == [3, 3, 3]
+        assert evaluation.np.allclose(batched, single, atol=1e-5)
+
+    def test_train(self):
+        rng = evaluation.np.random.default_rng(0)
+        rows = rng.random((400, evaluation.FEATURES)).astype(evaluation.np.float32)
+        targets = 0.8 * rows[:, -3] + 0.1
+        for hidden in (0, 16):
+            model = evaluation.train(rows, targets, hidden=hidden, epochs=300)
+            error = evaluation.np.abs(model.score(rows) - targets).mean()
+            assert error < 0.05, (hidden, error)
+
+    def test_save_and_load(self):
+        model = evaluation.train(evaluation.np.random.default_rng(0).random((30, evaluation.FEATURES)),
+                                 evaluation.np.arange(30) / 30, hidden=4, epochs=5)
+        rows = evaluation.np.random.default_rng(1).random((5, evaluation.FEATURES))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "eval.npz")
+            model.save(path)
+            assert evaluation.np.allclose(evaluation.load(path).score(rows), model.score(rows))
+
+    def test_choose_move_uses_model(self):
+        # Four snakes so minimax stays out of it, food right above our head
+        state = arena.new_game(4, 11, random.Random(0))
+        head = state.head(0)
+        state.food.add(head + state.width)
+        data = arena.request_data(state, 0, "evaluation-move", 0, 500, [""] * 4)
+        loaded = evaluation.loaded
+        try:
+            for weight, eats in ((1, True), (-1, False)):
+                position_cache.positions.clear()
+                evaluation.loaded = self.eats_model(weight)
+                move, _ = choose_move(dict(data, game=dict(data['game'], id=f"evaluation-{weight}")))
+                [batched, _] = [move for move, _ in choose_moves([data, data])]
+                assert (move == "up") == eats and (batched == "up") == eats
+        finally:
+            evaluation.loaded = loaded
+
+
+class PositionCacheTest(unittest.TestCase):
+    def mirrored(self, data):
+        """The same request with the board flipped left to right"""
+        width = data['board']['width']
+
+        def flip(point):
+            return {'x': width - 1 - point['x'], 'y': point['y']}
+
+        def flip_snake(snake):
+            return dict(snake, head=flip(snake['head']), body=[flip(point) for point in snake['body']])
+
+        board = dict(data['board'], food=[flip(point) for point in data['board']['food']],
+                     hazards=[flip(point) for point in data['board']['hazards']],
+                     snakes=[flip_snake(snake) for snake in data['board']['snakes']])
+        return dict(data, board=board, you=flip_snake(data['you']))
+
+    def test_move_goes_through_the_symmetry(self):
+        data = get_full_test_json()
+        cache = position_cache.PositionCache(10)
+        key, symmetry = position_cache.position_key(GameState.from_data(data))
+        cache.put(key, symmetry, "left", 5)
+        mirrored_key, mirrored_symmetry = position_cache.position_key(GameState.from_data(self.mirrored(data)))
+        assert mirrored_key == key
+        assert cache.get(mirrored_key, mirrored_symmetry) == ("right", 5)
+        assert cache.get(key, symmetry) == ("left", 5)
+        # Something else picking the move is another entry
+        assert position_cache.position_key(GameState.from_data(data), ("mcts", None))[0] != key
+
+    def test_size_and_stats(self):
+        cache = position_cache.PositionCache(2)
+        for key in range(3):
+            cache.put(key, SYMMETRIES[0], "up", 3)
+        cache.put(2, SYMMETRIES[0], "down", 1)
+        assert len(cache) == 2
+        assert cache.get(0, SYMMETRIES[0]) is None
+        # The shallower search didn't replace the deeper one
+        assert cache.get(2, SYMMETRIES[0]) == ("up", 3)
+        stats = cache.stats()
+        assert stats['hits'] == 1 and stats['misses'] == 1 and stats['hit_rate'] == 0.5
+        assert stats['memory_bytes'] > 0
+
+    def test_disabled_only_in_its_thread(self):
+        cache = position_cache.PositionCache(10)
+        seen = []
+        with cache.disabled():
+            assert not cache.enabled
+            thread = threading.Thread(target=lambda: seen.append(cache.enabled))
+            thread.start()
+            thread.join()
+            with cache.disabled():
+                pass
+            # Still off after a nested block
+            assert not cache.enabled
+        assert seen == [True] and cache.enabled
+
+    def test_choose_move_shares_positions_between_games(self):
+        position_cache.positions.clear()
+        data = get_full_test_json()
+        move, _ = choose_move(data)
+        mirrored = self.mirrored(data)
+        mirrored_move, _ = choose_move(dict(mirrored, game=dict(data['game'], id="mirrored-game")))
+        assert position_cache.positions.stats()['hits'] == 1
+        assert mirrored_move == {"left": "right", "right": "left"}.get(move, move)
+
+
+class LoadTestTest(unittest.TestCase):
+    class Client:
+        """Answers like server.py would, without Flask"""
+
+        def __init__(self, paths):
+            self.paths = paths
+
+        def post(self, path, data):
+            self.paths.append(path)
+            if path == "/move":
+                move, shout = choose_move(data)
+                return json.dumps({'move': move, 'shout': shout}).encode()
+            return b"ok"
+
+        def close(self):
+            pass
+
+    def test_run_level(self):
+        paths = []
+        samples = loadtest.run_level(lambda: self.Client(paths), 2, 0.3, sizes=(7, 11), players=2, timeout_ms=50)
+        assert {sample.size for sample in samples} == {7, 11}
+        assert paths.count("/start") == paths.count("/end") >= 2
+        assert paths.count("/move") == len(samples)
+
+    def test_failed_moves_time_out(self):
+        class Broken(self.Client):
+            def post(self, path, data):
+                if path == "/move":
+                    raise OSError("connection refused")
+                return b"ok"
+
+        samples = []
+        stop = threading.Event()
+        loadtest.play(Broken([]), "load-broken", 7, 2, 500, random.Random(0), stop, samples, max_turns=3)
+        assert len(samples) == 3 and all(sample.timed_out for sample in samples)
+
+    def test_failed_start_and_bad_moves_are_counted(self):
+        class Confused(self.Client):
+            def post(self, path, data):
+                if path == "/start":
+                    raise OSError("connection refused")
+                return b'{"move": "sideways"}' if path == "/move" else b"ok"
+
+        samples = []
+        stop = threading.Event()
+        loadtest.play(Confused([]), "load-confused", 7, 2, 500, random.Random(0), stop, samples, max_turns=3)
+        assert len(samples) == 4 and all(sample.timed_out for sample in samples)
+
+    def test_dead_server(self):
+        # Nothing listens on port 9
+        samples = loadtest.run_level(loadtest.client_factory("http://127.0.0.1:9", 50), 1, 0.1, sizes=(7,), players=2)
+        assert samples and loadtest.summarize(samples, 0.1)['all']['timeout_rate'] == 1.0
+
+    def test_summary(self):
+        samples = [loadtest.Sample(7, latency, latency > 500) for latency in range(1, 101)]
+        samples.append(loadtest.Sample(11, 600.0, True))
+        summary = loadtest.summarize(samples, 10)
+        assert summary['7x7']['moves'] == 100 and summary['7x7']['moves_per_second'] == 10
+        assert summary['7x7']['p50_ms'] == 51 and summary['7x7']['p95_ms'] == 96 and summary['7x7']['p99_ms'] == 100
+        assert summary['7x7']['timeout_rate'] == 0
+        assert summary['11x11']['timeout_rate'] == 1
+        assert summary['all']['moves'] == 101
+
+
+class LogsTest(unittest.TestCase):
+    # Levels and sampling are passed in, SNAKE_LOG_LEVEL and SNAKE_LOG_SAMPLE in the environment don't matter
+    def lines(self, logger):
+        assert logger.flush()
+        return [json.loads(line) for line in logger.stream.getvalue().splitlines()]
+
+    def test_json_lines(self):
+        logger = logs.Logger(io.StringIO(), level=logs.INFO)
+        logger.info("move", game="game-id", turn=3, move="up", moves=["up", "left"], depth=4, nodes=120, elapsed_ms=1.5)
+        logger.info("end", game="game-id")
+        move, end = self.lines(logger)
+        assert move["event"] == "move" and move["level"] == "info"
+        assert move["game"] == "game-id" and move["turn"] == 3 and move["moves"] == ["up", "left"]
+        assert move["depth"] == 4 and move["nodes"] == 120 and move["elapsed_ms"] == 1.5
+        assert end["event"] == "end" and end["time"] >= move["time"]
+
+    def test_level(self):
+        logger = logs.Logger(io.StringIO(), level=logs.WARNING)
+        logger.debug("minimax")
+        logger.info("move")
+        logger.error("oops")
+        assert [line["event"] for line in self.lines(logger)] == ["oops"]
+
+    def test_sampling(self):
+        logger = logs.Logger(io.StringIO(), level=logs.INFO, sample=0)
+        logger.info("move", sampled=True)
+        logger.info("start")
+        assert [line["event"] for line in self.lines(logger)] == ["start"]
+
+    def test_full_queue_drops(self):
+        logger = logs.Logger(io.StringIO(), level=logs.INFO, queue_size=1)
+        # No writer thread, nothing takes lines out of the queue
+        logger.pid = os.getpid()
+        logger.info("move")
+        logger.info("move")
+        assert logger.dropped == 1
+
+    def test_choose_move_logs(self):
+        logger = logs.logger
+        logs.logger = logs.Logger(io.StringIO(), level=logs.INFO, sample=1)
+        position_cache.positions.clear()
+        try:
+            data = arena.request_data(arena.new_game(2, 11, random.Random(0)), 0, "logs-test", 0, 100, ["", ""])
+            move, _ = choose_move(data)
+            [line] = [line for line in self.lines(logs.logger) if line["event"] == "move"]
+        finally:
+            logs.logger = logger
+        assert line["game"] == "logs-test" and line["move"] == move
+        assert line["nodes"] > 0 and line["elapsed_ms"] > 0
+
 if __name__ == "__main__":
     unittest.main()
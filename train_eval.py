@@ -0,0 +1,83 @@
+import argparse
+import glob
+import os
+from typing import List, Optional, Tuple
+
+import arena
+import evaluation
+import replay
+from game_state import GameState
+"""
+Trains the learned evaluation that evaluation.py loads, from self-play games,
+recorded games (the ones server.py writes with SNAKE_RECORD_DIR) or both:
+
+    python train_eval.py --games 200 --recordings recordings/ --out eval.npz
+
+Every move played is a training row, its target is how long the snake lasted
+after it: 1 for snakes still alive when the game ended, 1 - DISCOUNT ** turns
+for the ones that died `turns` turns later.
+"""
+
+# More random moves than book_builder.py's games, without bad moves there's nothing to learn from
+EXPLORE = 0.2
+DISCOUNT = 0.8
+
+
+def target(turn: int, death_turn: Optional[int]) -> float:
+    return 1.0 if death_turn is None else 1 - DISCOUNT ** (death_turn - turn)
+
+
+def self_play(games: int, size: int = arena.SIZE, players: int = 4, play_timeout: int = 100,
+              explore: float = EXPLORE, seed: int = 0) -> Tuple[list, List[float]]:
+    rows, targets = [], []
+    for moves, death_turns in arena.self_play(games, size, players, play_timeout, explore, seed, name="train"):
+        for played in moves:
+            rows.append(evaluation.features(GameState.from_data(played.data), [played.move])[0])
+            targets.append(target(played.turn, death_turns[played.snake]))
+    return rows, targets
+
+
+def from_recordings(paths: List[str]) -> Tuple[list, List[float]]:
+    """Our own moves in the recorded games, we died right after the last one unless /end still had us"""
+    rows, targets = [], []
+    for path in paths:
+        records = replay.read_recording(path)
+        ends = [record['data'] for record in records if record['kind'] == "end"]
+        moves = [record for record in replay.recorded_moves(path) if record.get('response')]
+        if not ends or not moves:
+            continue
+        you = moves[-1]['data']['you']['id']
+        survived = any(snake['id'] == you for snake in ends[-1]['board']['snakes'])
+        death_turn = None if survived else moves[-1]['data']['turn'] + 1
+        for record in moves:
+            data = record['data']
+            rows.append(evaluation.features(GameState.from_data(data), [record['response']['move']])[0])
+            targets.append(target(data['turn'], death_turn))
+    return rows, targets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the learned move evaluation")
+    parser.add_argument("--games", type=int, default=100, help="self-play games to learn from")
+    parser.add_argument("--recordings", help="directory of recorded games to learn from too")
+    parser.add_argument("--size", type=int, default=arena.SIZE)
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--explore", type=float, default=EXPLORE, help="chance of a random move in self-play")
+    parser.add_argument("--hidden", type=int, default=32, help="hidden units, 0 for a linear model")
+    parser.add_argument("--epochs", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=evaluation.MODEL_PATH)
+    args = parser.parse_args()
+
+    rows, targets = self_play(args.games, args.size, args.players, explore=args.explore, seed=args.seed)
+    if args.recordings:
+        recorded_rows, recorded_targets = from_recordings(sorted(glob.glob(os.path.join(args.recordings, "*.jsonl.gz"))))
+        rows += recorded_rows
+        targets += recorded_targets
+    model = evaluation.train(rows, targets, args.hidden, args.epochs, seed=args.seed)
+    model.save(args.out)
+    print(f"Trained on {len(rows)} moves, written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import os
+import random
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional
+"""
+Zobrist hashing and a transposition table for the lookahead.
+
+Up-then-left and left-then-up usually end in the same position, so the search
+caches what it learned about a position under its Zobrist hash and answers the
+second visit from the table instead of exploring it again.
+"""
+
+DEFAULT_MAX_ENTRIES = int(os.environ.get("SNAKE_TT_ENTRIES", "200000"))
+MAX_HEALTH = 100
+# Turns from the root of a search, deeper than any search goes
+MAX_TURNS = 64
+
+
+class ZobristKeys:
+    """Random 64 bit keys for every (snake, cell), food cell, snake length, health and search turn"""
+
+    def __init__(self, cells: int, snakes: int, seed: int = 0x5EED):
+        rng = random.Random(seed)
+
+        def table(size):
+            return [rng.getrandbits(64) for _ in range(size)]
+
+        self.body = [table(cells) for _ in range(snakes)]
+        self.head = [table(cells) for _ in range(snakes)]
+        # Stacked tails can make a snake longer than the board has cells
+        self.length = [table(cells + 8) for _ in range(snakes)]
+        self.health = [table(MAX_HEALTH + 1) for _ in range(snakes)]
+        self.food = table(cells)
+        self.turn = table(MAX_TURNS + 1)
+
+
+@lru_cache(maxsize=32)
+def zobrist_keys(cells: int, snakes: int) -> ZobristKeys:
+    return ZobristKeys(cells, snakes)
+
+
+class TranspositionTable:
+    """
+    LRU-bounded map of position hash -> (depth, safe): whether our snake can keep
+    moving for `depth` more turns from that position.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def probe(self, key: int, depth: int) -> Optional[bool]:
+        entry = self.entries.get(key)
+        if entry is not None:
+            stored_depth, safe = entry
+            # Surviving deeper means surviving less deep, dying sooner means dying later too
+            if (safe and stored_depth >= depth) or (not safe and stored_depth <= depth):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return safe
+        self.misses += 1
+        return None
+
+    def store(self, key: int, depth: int, safe: bool) -> None:
+        self.entries[key] = (depth, safe)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,84 @@
+import os
+import random
+import threading
+import time
+
+import arena
+import game_cache
+import logs
+import metrics
+import position_cache
+import server_logic
+from game_state import RULESETS, adjacent_table, straight_first_table
+from transposition import zobrist_keys
+"""
+Warm-up at server boot, so the first real /move after a restart isn't the one
+paying for imports, lookup tables and first calls.
+
+It builds the board tables for the usual sizes and rulesets and plays a few
+synthetic moves through choose_move, which also takes the NumPy kernels and the
+minimax/flood fill code through their first calls. It runs in a background
+thread so the server answers right away, `ready` tells when it's done and
+server.py reports it on `/`.
+"""
+
+ENABLED = os.environ.get("SNAKE_WARMUP", "1") != "0"
+SIZES = (7, 11, 19)
+# Snakes per synthetic game: a duel takes the minimax path, four the plain lookahead
+PLAYERS = (2, 4)
+TIMEOUT_MS = 100
+MAX_SNAKES = 8
+
+ready = threading.Event()
+
+
+def build_tables() -> None:
+    for size in SIZES:
+        for wrapped in (False, True):
+            # neighbor_table and step_table get filled on the way
+            adjacent_table(size, size, wrapped)
+            straight_first_table(size, size, wrapped)
+        for snakes in range(1, MAX_SNAKES + 1):
+            zobrist_keys(size * size, snakes)
+
+
+def play_synthetic_moves(seed: int = 0) -> int:
+    """One choose_move for every size, ruleset and player count, returns how many were played"""
+    rng = random.Random(seed)
+    played = 0
+    for size in SIZES:
+        for ruleset in RULESETS:
+            for players in PLAYERS:
+                state = arena.new_game(players, size, rng)
+                data = arena.request_data(state, 0, f"warm-up-{size}-{ruleset}-{players}", 0, TIMEOUT_MS,
+                                          [""] * players)
+                data['game']['ruleset']['name'] = ruleset
+                game_cache.games.start(data)
+                server_logic.choose_move(data)
+                game_cache.games.end(data)
+                played += 1
+    return played
+
+
+def warm_up() -> float:
+    """Runs the whole warm-up and sets `ready`, returns how long it took in seconds"""
+    started = time.perf_counter()
+    build_tables()
+    # Moves searched with the warm-up's short timeout shouldn't answer real games, which
+    # can already be running in other threads, and fake games don't go in /metrics or the logs
+    with position_cache.positions.disabled(), metrics.disabled(), logs.logger.disabled():
+        play_synthetic_moves()
+    ready.set()
+    return time.perf_counter() - started
+
+
+def start() -> None:
+    """Warms up in the background, or just marks the snake as ready with SNAKE_WARMUP=0"""
+    if not ENABLED:
+        ready.set()
+        return
+
+    def run():
+        logs.logger.info("warmup", elapsed_ms=round(warm_up() * 1000, 3))
+
+    threading.Thread(target=run, name="warm-up", daemon=True).start()